@@ -35,8 +35,54 @@ class Config:
     # 一致性检测配置
     CONSISTENCY_CHECK_ENABLED = os.getenv('CONSISTENCY_CHECK_ENABLED', 'true').lower() == 'true'
     CONSISTENCY_CHECK_API = os.getenv('CONSISTENCY_CHECK_API', 'deepseek')  # 用于检测的API平台
+    CONSISTENCY_CHECK_MAX_CONCURRENCY = int(os.getenv('CONSISTENCY_CHECK_MAX_CONCURRENCY', '5'))  # 异步检测的最大并发请求数
+    CONSISTENCY_CHECK_CACHE_SIZE = int(os.getenv('CONSISTENCY_CHECK_CACHE_SIZE', '512'))  # 检测结果缓存条目数（0表示关闭）
     
     # 剧本系统配置
     SCRIPT_SYSTEM_ENABLED = os.getenv('SCRIPT_SYSTEM_ENABLED', 'true').lower() == 'true'
     SCENARIOS_DIR = 'scenarios'  # 场景剧本目录名
+    
+    # 智能体响应缓存配置（缓存条目数，0表示关闭）：开启后相同指令、历史和场景直接复用上次的回复，
+    # 不再重新生成（回复temperature为0.7，关闭时每次都是新的回复），默认关闭
+    AGENT_RESPONSE_CACHE_SIZE = int(os.getenv('AGENT_RESPONSE_CACHE_SIZE', '0'))
+    
+    # 流式响应配置：开启后智能体通过SSE接收响应，JSON对象完整后即提前结束
+    LLM_STREAMING_ENABLED = os.getenv('LLM_STREAMING_ENABLED', 'false').lower() == 'true'
+    
+    # 确定性调用（temperature≈0）的LLM响应缓存条目数（0表示关闭）
+    LLM_RESPONSE_CACHE_SIZE = int(os.getenv('LLM_RESPONSE_CACHE_SIZE', '128'))
+    # 确定性调用响应和环境分析结果的磁盘缓存（sqlite文件路径，留空表示只在内存中缓存），开发调试和回放时跨运行复用
+    LLM_RESPONSE_CACHE_DB = os.getenv('LLM_RESPONSE_CACHE_DB', '')
+    
+    # 批量导演评估时一次LLM调用最多合并的回合数
+    DIRECTOR_BATCH_SIZE = int(os.getenv('DIRECTOR_BATCH_SIZE', '4'))
+    
+    # 导演提示词中保留的人物属性字段（逗号分隔，留空表示保留全部属性）
+    DIRECTOR_CHARACTER_FIELDS = [
+        field.strip() for field in
+        os.getenv('DIRECTOR_CHARACTER_FIELDS', 'level,class,ac,vitals,weapon,equipment,skills,state').split(',')
+        if field.strip()
+    ]
+    
+    # 导演提示词中场景描述和每条Agent响应的最大字符数（超出时保留开头和结尾，0表示不截断）
+    DIRECTOR_MAX_SCENE_CHARS = int(os.getenv('DIRECTOR_MAX_SCENE_CHARS', '1500'))
+    DIRECTOR_MAX_RESPONSE_CHARS = int(os.getenv('DIRECTOR_MAX_RESPONSE_CHARS', '1500'))
+    
+    # 环境分析结果缓存条目数：场景内容和Agent响应完全相同时复用上次结果（0表示关闭）
+    ENVIRONMENT_ANALYSIS_CACHE_SIZE = int(os.getenv('ENVIRONMENT_ANALYSIS_CACHE_SIZE', '32'))
+    
+    # 环境分析快速路径：剧情节奏无需触发事件、且Agent响应中没有移动/观察类行动时直接返回空变化，不调用LLM
+    ENVIRONMENT_ANALYSIS_FAST_PATH = os.getenv('ENVIRONMENT_ANALYSIS_FAST_PATH', 'false').lower() == 'true'
+    
+    # 空闲回合（没有玩家指令、Agent响应和场景状态变化）不调用导演LLM，直接推进的游戏内时间（分钟）
+    DIRECTOR_IDLE_TICK_MINUTES = float(os.getenv('DIRECTOR_IDLE_TICK_MINUTES', '1.0'))
+    
+    # 异步导演评估（多个场景同时评估）的最大并发请求数
+    DIRECTOR_MAX_CONCURRENCY = int(os.getenv('DIRECTOR_MAX_CONCURRENCY', '5'))
+    
+    # 导演评估使用JSON模式（response_format=json_object），接口保证返回合法JSON对象
+    DIRECTOR_JSON_MODE = os.getenv('DIRECTOR_JSON_MODE', 'true').lower() == 'true'
+    
+    # OpenAI Batch API（离线批量生成，24小时内完成，费用减半）
+    USE_BATCH_API = os.getenv('USE_BATCH_API', 'false').lower() == 'true'
 
@@ -1,12 +1,119 @@
 """
 智能体类：每个角色作为独立的智能体
 """
-import json
-from typing import Dict, Optional
-from services.chat_service import ChatService
+import copy
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from services import json_utils
+from services.chat_service import ChatService, get_default_chat_service
 from config import Config
 
 
+# 推理标记清理：<think>...</think>、未闭合的 <think>/<redacted_reasoning> 标记、**Thinking about...**
+_CLEAN_RE = re.compile(
+    r'<think>.*?</think>|<(?:think|redacted_reasoning)>.*?$|\*\*Thinking about.*?\*\*',
+    re.DOTALL | re.IGNORECASE | re.MULTILINE
+)
+
+
+def _extract_json_payload(text: str) -> str:
+    """
+    从LLM响应中提取JSON文本
+    
+    只有出现 '<' 或 '**' 时才运行推理标记清理正则；随后与其他解析器共用代码块/说明文字的处理，
+    截取第一个完整的 {...} 对象。找不到时返回清理后的原文本。
+    """
+    if '<' in text or '**' in text:
+        text = _CLEAN_RE.sub('', text)
+    return json_utils.extract_json_block(text)
+
+
+def is_json_object_complete(text: str) -> bool:
+    """
+    判断流式累积的响应文本中是否已经包含一个完整的JSON对象（用于提前结束流式接收）
+    
+    推理标记未闭合时其中的括号不可信，返回False。
+    """
+    if '}' not in text:
+        return False
+    lowered = text.lower()
+    if lowered.count('<think>') > lowered.count('</think>') or '<redacted_reasoning>' in lowered:
+        return False
+    if '<' in text or '**' in text:
+        text = _CLEAN_RE.sub('', text)
+    start = text.find('{')
+    return start != -1 and json_utils.find_object_end(text, start) != -1
+
+
+# 用户消息模板（静态部分在模块加载时确定，每次只填充指令和预期事件）
+_USER_MESSAGE_TEMPLATE = """指令：{instruction}{event_note}
+
+要求：
+1. 执行指令（可能因环境失败，需说明原因）
+2. 描述具体行动过程，不要只说"执行了"
+3. **如果遇到预期事件，必须立即停止，描述情况等待玩家**
+4. **队伍一致性：如果队伍在一起行动，所有角色应该在同一个时刻停止（要么都到达目标，要么都遇到事件）**
+5. 主动观察环境变化（天气/声音/地形等），简洁描述
+6. 严格遵循角色说话风格和性格特点，保持语气一致
+
+输出JSON：
+{{
+    "response": {{
+        "dialogue": "角色的语言内容（如果此刻不说话则留空）",
+        "action_intent": "角色的肢体动作或行动尝试（不做结果判定）"
+    }},
+    "hidden": {{
+        "inner_monologue": "基于性格的心理活动（用于解释为何做出上述行动，仅导演可见）"
+    }}
+}}
+
+**注意**: 
+- state_changes、attribute_changes、execution_result 由导演评估统一决定，Agent 不需要提供
+- Agent 只需提供 response（包含dialogue和action_intent）和 hidden.inner_monologue（心理活动）"""
+
+_EVENT_NOTE_TEMPLATE = "\n【重要：预期事件】在执行指令过程中，如果遇到以下事件，必须立即停止并描述情况：\n{expected_event}\n所有角色应该在同一时刻遇到这个事件并停止。如果队伍在一起行动，要么都到达目标，要么都遇到事件，不能出现部分角色到达而部分角色遇到事件的情况。"
+
+# 系统提示词中的输出协议（完全静态）
+_OUTPUT_PROTOCOL = """### 3. 输出协议 (Output Protocol)
+
+请输出严格的 JSON 格式：
+
+{
+    "response": {
+        "dialogue": "角色的语言内容（如果此刻不说话则留空）",
+        "action_intent": "角色的肢体动作或行动尝试（不做结果判定）"
+    },
+    "hidden": {
+        "inner_monologue": "基于性格的心理活动（用于解释为何做出上述行动，仅导演可见）",
+    }
+}
+
+**系统强调**: 不要自行生成 state_changes 或 execution_result，那是导演（Director）的工作。
+"""
+
+# 智能体响应缓存：相同角色在相同场景、相同历史下收到相同指令时直接复用结果（LRU淘汰）
+_response_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+def _response_cache_key(*parts) -> str:
+    """根据参与生成响应的所有输入计算稳定的缓存键"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(str(part or '').encode('utf-8'))
+        hasher.update(b'\x00')
+    return hasher.hexdigest()
+
+
+def clear_response_cache():
+    """清空智能体响应缓存"""
+    with _response_cache_lock:
+        _response_cache.clear()
+
+
 def format_agent_response(response_data) -> str:
     """
     格式化Agent响应为文本
@@ -39,22 +146,48 @@ def format_agent_response(response_data) -> str:
 class Agent:
     """单个智能体，代表一个角色"""
     
-    def __init__(self, character_data: Dict, config: Config):
+    def __init__(self, character_data: Dict, config: Config,
+                 chat_service: Optional[ChatService] = None):
         """
         初始化智能体
         
         Args:
             character_data: 人物卡数据
             config: 配置对象
+            chat_service: 共享的对话服务，默认使用进程内共享实例
         """
         self.character_id = character_data['id']
         self.character_name = character_data['name']
         self.description = character_data['description']
+        self._attr_version = 0
+        self._prompt_cache: Dict[tuple, str] = {}
+        self._attr_guide_cache: Optional[str] = None
         self.attributes = character_data.get('attributes', {})
         self.theme = character_data.get('theme', 'default')
-        self.chat_service = ChatService()
+        self.chat_service = chat_service or get_default_chat_service()
         self.config = config
     
+    @property
+    def attributes(self) -> Dict:
+        """角色属性"""
+        return self._attributes
+    
+    @attributes.setter
+    def attributes(self, value: Dict):
+        """替换角色属性，重新序列化并使已缓存的提示词失效"""
+        self._attributes = value
+        self._attributes_json = json_utils.dumps(value, sort_keys=True)
+        self._attr_version += 1
+        self._prompt_cache.clear()
+    
+    def update_attributes(self, new_attributes: Dict):
+        """
+        更新角色属性
+        
+        注意：直接修改 attributes 字典内容不会刷新序列化缓存，需通过本方法或重新赋值
+        """
+        self.attributes = new_attributes
+    
     def process_instruction(self, instruction: str, scene_content: str, 
                            platform: str = None, save_step: Optional[str] = None,
                            player_role: str = None, conversation_history: str = None,
@@ -72,109 +205,103 @@ class Agent:
         Returns:
             包含响应和状态变化的字典
         """
+        platform = platform or self.config.DEFAULT_API_PLATFORM
+        
+        cache_key, cached = self.lookup_cached_response(
+            instruction, scene_content, platform, player_role, conversation_history, expected_event
+        )
+        if cached is not None:
+            return cached
+        
+        messages = self.build_messages(instruction, scene_content, player_role,
+                                       conversation_history, expected_event)
+        
+        # 调用LLM生成响应
+        try:
+            response_text = self.chat_service.call_platform_api(
+                platform, messages, operation='agent_response',
+                context={'character_id': self.character_id, 'theme': self.theme},
+                stop_when=is_json_object_complete
+            )
+        except Exception as e:
+            return self.build_error_response(e)
+        
+        return self.parse_response(response_text, cache_key)
+    
+    def lookup_cached_response(self, instruction: str, scene_content: str, platform: str,
+                               player_role: str = None, conversation_history: str = None,
+                               expected_event: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        查询响应缓存（角色属性参与计算，属性更新后自动失效）
+        
+        Returns:
+            (缓存键, 缓存的响应)；缓存关闭时缓存键为None，未命中时响应为None
+        """
+        if getattr(self.config, 'AGENT_RESPONSE_CACHE_SIZE', 0) <= 0:
+            return None, None
+        cache_key = _response_cache_key(
+            self.character_id, self.theme, platform.lower(), instruction, scene_content,
+            player_role, conversation_history, expected_event,
+            self._attributes_json
+        )
+        with _response_cache_lock:
+            cached = _response_cache.get(cache_key)
+            if cached is None:
+                return cache_key, None
+            _response_cache.move_to_end(cache_key)
+            return cache_key, copy.deepcopy(cached)
+    
+    def build_messages(self, instruction: str, scene_content: str, player_role: str = None,
+                       conversation_history: str = None,
+                       expected_event: Optional[str] = None) -> List[Dict]:
+        """构建发送给LLM的消息列表（系统提示词 + 玩家指令）"""
         # 构建智能体专用的系统提示词
         system_prompt = self._build_agent_prompt(scene_content, player_role, conversation_history)
         
         # 构建用户消息（包含玩家指令和预期事件）
         event_note = ""
         if expected_event:
-            event_note = f"\n【重要：预期事件】在执行指令过程中，如果遇到以下事件，必须立即停止并描述情况：\n{expected_event}\n所有角色应该在同一时刻遇到这个事件并停止。如果队伍在一起行动，要么都到达目标，要么都遇到事件，不能出现部分角色到达而部分角色遇到事件的情况。"
+            event_note = _EVENT_NOTE_TEMPLATE.format(expected_event=expected_event)
         
         # 确保instruction不为None
         instruction = instruction or ""
         
-        user_message = f"""指令：{instruction}{event_note}
-
-要求：
-1. 执行指令（可能因环境失败，需说明原因）
-2. 描述具体行动过程，不要只说"执行了"
-3. **如果遇到预期事件，必须立即停止，描述情况等待玩家**
-4. **队伍一致性：如果队伍在一起行动，所有角色应该在同一个时刻停止（要么都到达目标，要么都遇到事件）**
-5. 主动观察环境变化（天气/声音/地形等），简洁描述
-6. 严格遵循角色说话风格和性格特点，保持语气一致
-
-输出JSON：
-{{
-    "response": {{
-        "dialogue": "角色的语言内容（如果此刻不说话则留空）",
-        "action_intent": "角色的肢体动作或行动尝试（不做结果判定）"
-    }},
-    "hidden": {{
-        "inner_monologue": "基于性格的心理活动（用于解释为何做出上述行动，仅导演可见）"
-    }}
-}}
-
-**注意**: 
-- state_changes、attribute_changes、execution_result 由导演评估统一决定，Agent 不需要提供
-- Agent 只需提供 response（包含dialogue和action_intent）和 hidden.inner_monologue（心理活动）"""
-        
-        # 调用LLM生成响应
-        platform = platform or self.config.DEFAULT_API_PLATFORM
+        user_message = _USER_MESSAGE_TEMPLATE.format(instruction=instruction, event_note=event_note)
         
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_message}
         ]
-        
-        try:
-            if platform.lower() == 'deepseek':
-                response_text = self.chat_service._call_deepseek_api(
-                    messages, operation='agent_response', 
-                    context={'character_id': self.character_id, 'theme': self.theme}
-                )
-            elif platform.lower() == 'openai':
-                response_text = self.chat_service._call_openai_api(
-                    messages, operation='agent_response',
-                    context={'character_id': self.character_id, 'theme': self.theme}
-                )
-            elif platform.lower() == 'aizex':
-                response_text = self.chat_service._call_aizex_api(
-                    messages, operation='agent_response',
-                    context={'character_id': self.character_id, 'theme': self.theme}
-                )
-            else:
-                raise ValueError(f"不支持的API平台: {platform}")
-        except Exception as e:
-            # API调用失败，返回错误响应
-            error_msg = f"API调用失败: {str(e)}"
-            print(f"[{self.character_name}] {error_msg}")
-            return {
-                'character_id': self.character_id,
-                'character_name': self.character_name,
-                'response': {
-                    'dialogue': f"抱歉，我无法处理这个指令。{error_msg}",
-                    'action_intent': ''
-                },
-                'hidden': {
-                    'inner_monologue': f'无法处理指令：{error_msg}'
-                }
+    
+    def build_error_response(self, error: Exception) -> Dict:
+        """API调用失败时返回的错误响应"""
+        error_msg = f"API调用失败: {str(error)}"
+        print(f"[{self.character_name}] {error_msg}")
+        return {
+            'character_id': self.character_id,
+            'character_name': self.character_name,
+            'response': {
+                'dialogue': f"抱歉，我无法处理这个指令。{error_msg}",
+                'action_intent': ''
+            },
+            'hidden': {
+                'inner_monologue': f'无法处理指令：{error_msg}'
             }
+        }
+    
+    def parse_response(self, response_text: str, cache_key: Optional[str] = None) -> Dict:
+        """
+        解析LLM响应文本
         
-        # 解析响应
+        Args:
+            response_text: LLM返回的原始文本
+            cache_key: 响应缓存键，解析成功时写入缓存
+        """
         try:
-            # 清理响应文本：移除推理标记及其内容
-            import re
-            # 移除各种推理标记及其内容（不区分大小写，支持多行）
-            # 移除 <think>...</think> 标记
-            response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL | re.IGNORECASE)
-            # 移除 <think>...</think> 标记
-            response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL | re.IGNORECASE)
-            # 移除单独的未闭合标记（如果没有闭合标签）
-            response_text = re.sub(r'<(think|redacted_reasoning)>.*?$', '', response_text, flags=re.DOTALL | re.IGNORECASE | re.MULTILINE)
-            # 移除 **Thinking about...** 这样的标记
-            response_text = re.sub(r'\*\*Thinking about.*?\*\*', '', response_text, flags=re.DOTALL | re.IGNORECASE)
-            
-            # 尝试提取JSON
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
+            # 清理推理标记并提取JSON
+            response_text = _extract_json_payload(response_text)
             
-            result = json.loads(response_text)
+            result = json_utils.loads(response_text)
             
             # 处理response字段（可能是字符串或对象）
             response_data = result.get('response', {})
@@ -207,21 +334,25 @@ class Agent:
                     'inner_monologue': ''
                 }
             
-            return {
+            result = {
                 'character_id': self.character_id,
                 'character_name': self.character_name,
                 'response': response_obj,
                 'hidden': hidden_obj
             }
-        except json.JSONDecodeError:
-            # 如果解析失败，清理响应文本后返回
-            import re
-            # 再次清理，确保没有推理标记
-            cleaned_response = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL | re.IGNORECASE)
-            cleaned_response = re.sub(r'<think>.*?</think>', '', cleaned_response, flags=re.DOTALL | re.IGNORECASE)
-            cleaned_response = re.sub(r'<(think|redacted_reasoning)>.*?$', '', cleaned_response, flags=re.DOTALL | re.IGNORECASE | re.MULTILINE)
-            cleaned_response = re.sub(r'\*\*Thinking about.*?\*\*', '', cleaned_response, flags=re.DOTALL | re.IGNORECASE)
-            cleaned_response = cleaned_response.strip()
+            
+            # 只缓存成功解析的响应
+            if cache_key:
+                cache_size = self.config.AGENT_RESPONSE_CACHE_SIZE
+                with _response_cache_lock:
+                    _response_cache[cache_key] = copy.deepcopy(result)
+                    while len(_response_cache) > cache_size:
+                        _response_cache.popitem(last=False)
+            
+            return result
+        except json_utils.JSONDecodeError:
+            # 如果解析失败，清理响应文本后返回（再次清理，确保没有推理标记）
+            cleaned_response = _CLEAN_RE.sub('', response_text).strip()
             
             return {
                 'character_id': self.character_id,
@@ -237,8 +368,16 @@ class Agent:
     
     def _build_agent_prompt(self, scene_content: str, player_role: str = None, 
                            conversation_history: str = None) -> str:
-        """构建智能体专用的系统提示词"""
-        attr_guide = self.chat_service._load_attr_guide(self.theme)
+        """构建智能体专用的系统提示词（按场景、玩家角色、历史和属性版本缓存）"""
+        cache_key = (scene_content, player_role, conversation_history, self._attr_version)
+        cached = self._prompt_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # 主题在智能体生命周期内不变，属性说明只读取一次
+        if self._attr_guide_cache is None:
+            self._attr_guide_cache = self.chat_service._load_attr_guide(self.theme)
+        attr_guide = self._attr_guide_cache
         
         # 从场景中提取玩家角色信息
         if not player_role and "玩家角色" in scene_content:
@@ -276,6 +415,8 @@ class Agent:
                 style_parts.append(f"说话：{speaking_style}")
             style_key = f"\n【核心特征】{' | '.join(style_parts)}\n- 严格遵循说话风格和性格，保持语气一致，禁止通用化语言\n"
         
+        # 提示词顺序：角色设定（同一角色稳定）→ 核心指令/输出协议（完全静态）→ 当前情境（每回合变化），
+        # 使稳定部分构成可被服务端前缀缓存复用的公共前缀
         prompt = f"""# Role: 跑团角色智能体 (TRPG Character Agent)
 
 **角色名称**: {self.character_name}
@@ -286,7 +427,7 @@ class Agent:
 
 **【核心档案】**
 - 描述: {self.description}
-- 当前状态/属性: {json.dumps(self.attributes, ensure_ascii=False)}
+- 当前状态/属性: {self._attributes_json}
 {style_key}
 
 **【扮演指南】**
@@ -296,20 +437,7 @@ class Agent:
 
 ---
 
-### 2. 当前情境 (Current Context)
-
-**【环境与事件】**
-{scene_content}
-
-**【在场人员】**
-{player_role_info}
-
-**【剧情记忆】**
-{history_info}
-
----
-
-### 3. 核心指令 (Prime Directives)
+### 2. 核心指令 (Prime Directives)
 
 1.  **绝对的角色沉浸**: 你不仅是文本生成器，你是 {self.character_name} 本人。任何回复必须符合角色人设，禁止跳出角色（OOC）。
 2.  **行动意图边界 (关键)**: 
@@ -324,21 +452,22 @@ class Agent:
 
 ---
 
-### 4. 输出协议 (Output Protocol)
+{_OUTPUT_PROTOCOL}
+---
 
-请输出严格的 JSON 格式：
+### 4. 当前情境 (Current Context)
 
-{{
-    "response": {{
-        "dialogue": "角色的语言内容（如果此刻不说话则留空）",
-        "action_intent": "角色的肢体动作或行动尝试（不做结果判定）"
-    }},
-    "hidden": {{
-        "inner_monologue": "基于性格的心理活动（用于解释为何做出上述行动，仅导演可见）",
-    }}
-}}
+**【环境与事件】**
+{scene_content}
 
-**系统强调**: 不要自行生成 state_changes 或 execution_result，那是导演（Director）的工作。
+**【在场人员】**
+{player_role_info}
+
+**【剧情记忆】**
+{history_info}
 """
+        if len(self._prompt_cache) >= 16:
+            self._prompt_cache.clear()
+        self._prompt_cache[cache_key] = prompt
         return prompt
 
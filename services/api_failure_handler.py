@@ -14,24 +14,12 @@ class APIConfirmationRequired(Exception):
 
 
 class APIFailureHandler:
-    """API失败处理器（单例模式）"""
-    _instance = None
-    _lock = threading.Lock()
-    
-    def __new__(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super().__new__(cls)
-                    cls._instance._initialized = False
-        return cls._instance
+    """API失败处理器（请使用模块级实例 api_failure_handler）"""
     
     def __init__(self):
-        if not self._initialized:
-            self.failure_count = 0
-            self.confirmation_callback: Optional[Callable[[int, str], bool]] = None
-            self._lock = threading.Lock()
-            self._initialized = True
+        self.failure_count = 0
+        self.confirmation_callback: Optional[Callable[[int, str], bool]] = None
+        self._lock = threading.Lock()
     
     def set_confirmation_callback(self, callback: Callable[[int, str], bool]):
         """
@@ -63,24 +51,24 @@ class APIFailureHandler:
         """
         with self._lock:
             self.failure_count += 1
-            
-            # 每3次失败后询问用户
-            if self.failure_count % 3 == 0:
-                if self.confirmation_callback:
-                    # 有回调函数，调用它获取用户确认
-                    should_continue = self.confirmation_callback(self.failure_count, error_message)
-                    if not should_continue:
-                        # 用户选择停止，重置计数并返回False
-                        self.failure_count = 0
-                        return False
-                    # 用户选择继续，重置计数
-                    self.failure_count = 0
-                    return True
-                else:
-                    # 没有回调函数，抛出异常让上层处理
-                    raise APIConfirmationRequired(self.failure_count, error_message)
-            
+            count = self.failure_count
+            callback = self.confirmation_callback
+        
+        # 每3次失败后询问用户
+        if count % 3 != 0:
             return True
+        
+        if not callback:
+            # 没有回调函数，抛出异常让上层处理
+            raise APIConfirmationRequired(count, error_message)
+        
+        # 回调可能阻塞等待用户输入，在锁外调用，避免阻塞其他线程记录成功/失败
+        should_continue = callback(count, error_message)
+        
+        # 无论用户选择继续还是停止，都重置计数
+        with self._lock:
+            self.failure_count = 0
+        return bool(should_continue)
     
     def get_failure_count(self) -> int:
         """获取当前失败计数"""
@@ -93,6 +81,6 @@ class APIFailureHandler:
             self.failure_count = 0
 
 
-# 全局单例实例
+# 全局单例实例（模块只导入一次，无需加锁）
 api_failure_handler = APIFailureHandler()
 
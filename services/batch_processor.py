@@ -0,0 +1,94 @@
+"""
+批量对话处理器：限制并发数和每分钟请求数，并发生成多个角色/多轮的回复
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Union
+
+from services.chat_service import ChatService, get_default_chat_service
+
+
+class _RateLimiter:
+    """滑动窗口限流：任意 period 秒内最多发出 max_rate 个请求"""
+
+    def __init__(self, max_rate: int, period: float = 60.0):
+        self.max_rate = max_rate
+        self.period = period
+        self._timestamps = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._timestamps and now - self._timestamps[0] >= self.period:
+                    self._timestamps.popleft()
+                if len(self._timestamps) < self.max_rate:
+                    self._timestamps.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._timestamps[0]))
+
+
+class BatchProcessor:
+    """批量调用 ChatService.achat，结果与输入顺序一致"""
+
+    def __init__(self, chat_service: Optional[ChatService] = None,
+                 max_concurrency: int = 10, rpm: int = 100):
+        """
+        Args:
+            chat_service: 对话服务，默认使用进程内共享实例
+            max_concurrency: 最大并发请求数
+            rpm: 每分钟最大请求数（与平台限流保持一致）
+        """
+        self.chat_service = chat_service or get_default_chat_service()
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+
+    async def run_batch(self, items: List[Dict],
+                        on_progress: Optional[Callable[[int, int], None]] = None
+                        ) -> List[Union[str, Exception]]:
+        """
+        并发处理一批对话请求
+
+        Args:
+            items: 每项为 achat 的关键字参数，如
+                {"character_description": ..., "character_attributes": {...}, "user_message": ...}
+            on_progress: 进度回调 on_progress(已完成数, 总数)
+
+        Returns:
+            与输入顺序一致的结果列表，重试一次仍失败的位置为异常对象
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        limiter = _RateLimiter(self.rpm, 60.0)
+        total = len(items)
+        done = 0
+
+        async def _run(item: Dict) -> str:
+            async with semaphore:
+                await limiter.acquire()
+                return await self.chat_service.achat(**item)
+
+        async def _run_first(item: Dict) -> str:
+            nonlocal done
+            try:
+                return await _run(item)
+            finally:
+                done += 1
+                if on_progress:
+                    on_progress(done, total)
+
+        results = await asyncio.gather(*(_run_first(item) for item in items), return_exceptions=True)
+
+        # 失败的请求重新排队重试一次
+        failed = [i for i, r in enumerate(results) if isinstance(r, Exception)]
+        if failed:
+            retried = await asyncio.gather(*(_run(items[i]) for i in failed), return_exceptions=True)
+            for i, r in zip(failed, retried):
+                results[i] = r
+        return list(results)
+
+    def run(self, items: List[Dict],
+            on_progress: Optional[Callable[[int, int], None]] = None) -> List[Union[str, Exception]]:
+        """run_batch 的同步入口（调用方没有运行中的事件循环时使用）"""
+        return asyncio.run(self.run_batch(items, on_progress))
@@ -1,10 +1,18 @@
-import json
+import copy
 import os
+import threading
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
 from config import Config
+from services import json_utils
+
+# 主题根目录下不是人物卡的JSON文件（旧格式兼容扫描时跳过）
+NON_CHARACTER_FILES = {"core_events.json", "random_events.json", "scene_network.json", "monster_bindings.json"}
+
+# 人物卡索引文件（位于主题根目录下）
+MANIFEST_FILENAME = "_manifest.json"
 
 
 class CharacterStore:
@@ -16,6 +24,12 @@ class CharacterStore:
             os.path.join(os.path.dirname(__file__), "..", self.config.CHARACTER_CONFIG_DIR)
         )
         os.makedirs(self.base_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        # 人物卡索引：character_id -> 相对 base_dir 的路径；目录 -> mtime，用于发现手动增删的文件
+        self._index: Optional[Dict[str, str]] = None
+        self._dir_mtimes: Dict[str, int] = {}
+        # 人物卡内存缓存：character_id -> (文件 st_mtime_ns, 数据)
+        self._cache: Dict[str, Tuple[int, Dict]] = {}
 
     def _file_path(self, character_id: str, theme: str) -> str:
         """
@@ -33,13 +47,77 @@ class CharacterStore:
         old_path = os.path.join(theme_dir, f"{character_id}.json")
         return old_path
 
+    def _manifest_path(self) -> str:
+        return os.path.join(self.base_dir, MANIFEST_FILENAME)
+
+    def _scan_dir_mtimes(self) -> Dict[str, int]:
+        """获取所有可能存放人物卡的目录（主题根目录及其 characters/）的修改时间"""
+        mtimes = {}
+        for entry in os.scandir(self.base_dir):
+            if not entry.is_dir():
+                continue
+            mtimes[entry.name] = entry.stat().st_mtime_ns
+            characters_subdir = os.path.join(entry.path, "characters")
+            if os.path.isdir(characters_subdir):
+                mtimes[os.path.join(entry.name, "characters")] = os.stat(characters_subdir).st_mtime_ns
+        return mtimes
+
+    def _rebuild_index(self) -> None:
+        """扫描主题目录重建人物卡索引，新格式优先于旧格式"""
+        index = {}
+        mtimes = self._scan_dir_mtimes()
+        theme_dirs = sorted(d for d in mtimes if os.sep not in d)
+        for theme_dir in theme_dirs:
+            characters_subdir = os.path.join(theme_dir, "characters")
+            if characters_subdir in mtimes:
+                for filename in sorted(os.listdir(os.path.join(self.base_dir, characters_subdir))):
+                    if filename.endswith(".json"):
+                        index.setdefault(filename[:-5], os.path.join(characters_subdir, filename))
+        for theme_dir in theme_dirs:
+            for filename in sorted(os.listdir(os.path.join(self.base_dir, theme_dir))):
+                if filename.endswith(".json") and filename not in NON_CHARACTER_FILES:
+                    index.setdefault(filename[:-5], os.path.join(theme_dir, filename))
+        self._index = index
+        self._dir_mtimes = mtimes
+        self._write_manifest()
+
+    def _write_manifest(self) -> None:
+        """原子地写入索引文件"""
+        manifest_path = self._manifest_path()
+        tmp_path = manifest_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(json_utils.dump_bytes({"characters": self._index, "dir_mtimes": self._dir_mtimes}, indent=True))
+            os.replace(tmp_path, manifest_path)
+        except OSError:
+            pass  # 索引只是加速手段，写入失败时下次重新扫描即可
+
+    def _ensure_index(self, check_stale: bool = False) -> Dict[str, str]:
+        """
+        获取人物卡索引：首次使用时从索引文件加载（不存在或损坏时扫描重建）；
+        check_stale 为 True 时对比目录修改时间，发现手动增删文件后重建
+        """
+        with self._lock:
+            if self._index is None:
+                try:
+                    with open(self._manifest_path(), "rb") as f:
+                        manifest = json_utils.loads(f.read())
+                    self._index = dict(manifest["characters"])
+                    self._dir_mtimes = dict(manifest["dir_mtimes"])
+                    check_stale = True
+                except (OSError, ValueError, KeyError, TypeError):
+                    self._rebuild_index()
+                    return self._index
+            if check_stale and self._scan_dir_mtimes() != self._dir_mtimes:
+                self._rebuild_index()
+            return self._index
+
     def _find_file(self, character_id: str) -> Optional[str]:
-        """在所有主题目录下查找人物文件"""
-        for root, _, files in os.walk(self.base_dir):
-            for filename in files:
-                if filename == f"{character_id}.json":
-                    return os.path.join(root, filename)
-        return None
+        """通过索引查找人物文件，索引未命中或文件已不存在时检查索引是否过期"""
+        rel_path = self._ensure_index().get(character_id)
+        if rel_path is None or not os.path.exists(os.path.join(self.base_dir, rel_path)):
+            rel_path = self._ensure_index(check_stale=True).get(character_id)
+        return os.path.join(self.base_dir, rel_path) if rel_path else None
 
     def list_characters(self) -> List[Dict]:
         """
@@ -47,38 +125,25 @@ class CharacterStore:
         优先从 themes/{theme}/characters/ 目录查找，也兼容旧格式
         """
         characters = []
-        loaded_ids = set()  # 用于去重
-        
-        # 遍历所有主题目录
-        for theme_dir in os.listdir(self.base_dir):
-            theme_path = os.path.join(self.base_dir, theme_dir)
-            if not os.path.isdir(theme_path):
+        for character_id, rel_path in list(self._ensure_index(check_stale=True).items()):
+            try:
+                characters.append(self._read_character(character_id, os.path.join(self.base_dir, rel_path)))
+            except (OSError, ValueError):
                 continue
-            
-            # 优先从新格式目录查找：themes/{theme}/characters/
-            characters_subdir = os.path.join(theme_path, "characters")
-            if os.path.exists(characters_subdir):
-                for filename in os.listdir(characters_subdir):
-                    if filename.endswith(".json"):
-                        character_id = filename.replace(".json", "")
-                        if character_id not in loaded_ids:
-                            data = self.get_character(character_id)
-                            if data:
-                                characters.append(data)
-                                loaded_ids.add(character_id)
-            
-            # 兼容旧格式：themes/{theme}/
-            for filename in os.listdir(theme_path):
-                if filename.endswith(".json") and filename not in ["core_events.json", "random_events.json", "scene_network.json", "monster_bindings.json"]:
-                    character_id = filename.replace(".json", "")
-                    if character_id not in loaded_ids:
-                        data = self.get_character(character_id)
-                        if data:
-                            characters.append(data)
-                            loaded_ids.add(character_id)
-        
         return sorted(characters, key=lambda x: x.get("created_at", ""))
 
+    def _read_character(self, character_id: str, path: str) -> Dict:
+        """读取人物卡，文件修改时间未变化时直接返回内存缓存的副本"""
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._cache.get(character_id)
+        if cached is None or cached[0] != mtime:
+            with open(path, "rb") as f:
+                data = json_utils.loads(f.read())
+            self._cache[character_id] = (mtime, data)
+        else:
+            data = cached[1]
+        return copy.deepcopy(data)
+
     def create_character(
         self,
         name: str,
@@ -100,15 +165,31 @@ class CharacterStore:
         self._save(character_id, data, theme)
         return data
 
-    def get_character(self, character_id: str) -> Optional[Dict]:
-        path = self._find_file(character_id)
+    def get_character(self, character_id: str, theme: Optional[str] = None) -> Optional[Dict]:
+        """
+        读取人物卡
+        
+        Args:
+            character_id: 人物ID
+            theme: 已知所属主题时直接定位文件（新格式/旧格式路径），找不到再查索引
+        """
+        path = None
+        if theme:
+            path = self._file_path(character_id, theme)
+            if not os.path.exists(path):
+                path = None
+        if not path:
+            path = self._find_file(character_id)
         if not path:
             return None
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        try:
+            return self._read_character(character_id, path)
+        except FileNotFoundError:
+            return None
 
-    def update_character(self, character_id: str, payload: Dict) -> Optional[Dict]:
-        data = self.get_character(character_id)
+    def update_character(self, character_id: str, payload: Dict,
+                         theme: Optional[str] = None) -> Optional[Dict]:
+        data = self.get_character(character_id, theme)
         if not data:
             return None
         changed = False
@@ -127,6 +208,11 @@ class CharacterStore:
         if not path:
             return False
         os.remove(path)
+        self._cache.pop(character_id, None)
+        with self._lock:
+            self._index.pop(character_id, None)
+            self._refresh_dir_mtime(os.path.dirname(path))
+            self._write_manifest()
         return True
 
     def _save(self, character_id: str, data: Dict, theme: str) -> None:
@@ -138,6 +224,26 @@ class CharacterStore:
         characters_dir = os.path.join(self.base_dir, theme, "characters")
         os.makedirs(characters_dir, exist_ok=True)
         path = os.path.join(characters_dir, f"{character_id}.json")
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # 先写临时文件再原子替换，写入中途崩溃不会损坏已有人物卡（不做fsync）
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json_utils.dump_bytes(data, indent=True))
+        os.replace(tmp_path, path)
+        self._cache.pop(character_id, None)
+        
+        # 更新索引
+        with self._lock:
+            index = self._ensure_index()
+            index[character_id] = os.path.relpath(path, self.base_dir)
+            self._refresh_dir_mtime(characters_dir)
+            self._refresh_dir_mtime(os.path.join(self.base_dir, theme))
+            self._write_manifest()
+
+    def _refresh_dir_mtime(self, directory: str) -> None:
+        """自身写入/删除文件后更新已记录的目录修改时间，避免被误判为索引过期"""
+        rel_dir = os.path.relpath(directory, self.base_dir)
+        try:
+            self._dir_mtimes[rel_dir] = os.stat(directory).st_mtime_ns
+        except OSError:
+            self._dir_mtimes.pop(rel_dir, None)
 
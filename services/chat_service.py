@@ -1,9 +1,23 @@
+import asyncio
+import atexit
+import functools
+import hashlib
 import os
+import queue
+import re
+import sqlite3
+import threading
 import requests
-import json
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Optional, Tuple, Union
 from config import Config
-from services.api_failure_handler import api_failure_handler, APIConfirmationRequired
+from services import json_utils
+from services.api_failure_handler import api_failure_handler
 
 DEFAULT_ATTR_GUIDE = """
 属性说明（用于参考，不要逐字复述）：
@@ -17,391 +31,850 @@ DEFAULT_ATTR_GUIDE = """
 - speaking_style: 说话风格
 """
 
+# 请求超时（连接, 读取），单位秒
+API_TIMEOUT = (10, 60)
+
+# 平台名称（小写） -> ChatService 调用方法名；按名称取方法，测试中替换的方法同样生效
+PLATFORM_DISPATCH: Dict[str, str] = {
+    'deepseek': '_call_deepseek_api',
+    'openai': '_call_openai_api',
+    'aizex': '_call_aizex_api',
+}
+
+# 可重试的HTTP状态码：请求超时、限流和服务端临时错误
+RETRY_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+
+def _create_session() -> requests.Session:
+    """创建带自动重试的HTTP会话（指数退避+随机抖动，429时遵循Retry-After）"""
+    retry = Retry(
+        total=3,
+        backoff_factor=1,
+        backoff_jitter=1,
+        backoff_max=60,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=None,  # 对话接口是POST，也需要重试
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    session = requests.Session()
+    # 显式声明可接受的压缩格式：urllib3按已安装的解码器给出（装了brotli/zstandard时包含br/zstd），
+    # 长回复的JSON压缩后传输量小得多；keep-alive 为requests默认行为
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    # 连接池：批量并发调用时每个主机最多保持64个长连接
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# 进程内共享的HTTP会话：所有ChatService实例（各服务各自创建）共用同一连接池
+_HTTP = _create_session()
+
+
+def get_http_session() -> requests.Session:
+    """获取进程内共享的HTTP会话（其他调用同一批LLM接口的服务复用同一连接池和重试策略）"""
+    return _HTTP
+
+
+# LLM调用日志的后台写入队列（守护线程在首次提交时启动）
+_LOG_QUEUE: "queue.Queue[Tuple[Callable, Dict]]" = queue.Queue()
+_log_worker: Optional[threading.Thread] = None
+_log_worker_lock = threading.Lock()
+
+
+def _log_worker_loop():
+    while True:
+        fn, kwargs = _LOG_QUEUE.get()
+        try:
+            fn(**kwargs)
+        except Exception:
+            pass  # 日志记录失败不影响对话
+        finally:
+            _LOG_QUEUE.task_done()
+
+
+def _submit_log(fn: Callable, **kwargs):
+    """把日志记录提交到后台线程执行"""
+    global _log_worker
+    if _log_worker is None:
+        with _log_worker_lock:
+            if _log_worker is None:
+                _log_worker = threading.Thread(target=_log_worker_loop, name="llm-call-logger", daemon=True)
+                _log_worker.start()
+    _LOG_QUEUE.put((fn, kwargs))
+
+
+def flush_call_logs():
+    """等待后台队列中的调用日志全部写完（测试或进程退出前调用）"""
+    _LOG_QUEUE.join()
+
+
+atexit.register(flush_call_logs)
+
+
+@functools.lru_cache(maxsize=64)
+def _read_text_cached(path: str, mtime_ns: int, size: int) -> Optional[str]:
+    """按 (路径, 修改时间, 大小) 缓存文件内容，文件被修改后缓存键变化自动失效"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+# 不高于该温度的调用视为确定性调用，结果可缓存
+DETERMINISTIC_TEMPERATURE = 0.01
+
+# 确定性调用的响应缓存（LRU淘汰），进程内所有ChatService实例共享
+_response_cache: "OrderedDict[str, str]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+def _response_cache_key(platform: str, model: str, messages: List[Dict], temperature: float,
+                        response_format: Optional[Dict] = None) -> str:
+    """
+    根据平台、模型、消息、温度（和输出格式）计算稳定的缓存键
+    
+    不同平台可能配置了同名模型（如代理平台转发的OpenAI模型），平台参与计算，互不复用。
+    """
+    key = {"platform": platform.lower(), "model": model, "messages": messages, "temperature": temperature}
+    if response_format is not None:
+        key["response_format"] = response_format
+    payload = json_utils.dump_bytes(key, sort_keys=True)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def clear_response_cache():
+    """清空LLM响应缓存（内存部分；磁盘缓存需删除数据库文件）"""
+    with _response_cache_lock:
+        _response_cache.clear()
+
+
+# 确定性调用响应的磁盘缓存（sqlite），配置 LLM_RESPONSE_CACHE_DB 后启用，重复运行时同样命中
+_response_db: Optional[sqlite3.Connection] = None
+_response_db_path: Optional[str] = None
+
+
+def _get_response_db(path: str) -> sqlite3.Connection:
+    """打开（首次使用时创建）磁盘缓存数据库，调用方需持有 _response_cache_lock"""
+    global _response_db, _response_db_path
+    if _response_db is None or _response_db_path != path:
+        if _response_db is not None:
+            _response_db.close()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        _response_db = sqlite3.connect(path, check_same_thread=False)
+        _response_db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT NOT NULL)")
+        _response_db_path = path
+    return _response_db
+
+
+def _get_cached_response(cache_key: str, max_size: int, db_path: str = "") -> Optional[str]:
+    """按缓存键查找响应：先查内存，未命中时查磁盘缓存并放回内存"""
+    with _response_cache_lock:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            _response_cache.move_to_end(cache_key)
+            return cached
+        if not db_path:
+            return None
+        content = _db_get(cache_key, db_path)
+        if content is not None:
+            _response_cache[cache_key] = content
+            while len(_response_cache) > max_size:
+                _response_cache.popitem(last=False)
+        return content
+
+
+def _store_response(cache_key: str, content: str, max_size: int, db_path: str = ""):
+    """写入响应缓存（内存LRU，配置了磁盘缓存时同时写入磁盘）"""
+    with _response_cache_lock:
+        _response_cache[cache_key] = content
+        while len(_response_cache) > max_size:
+            _response_cache.popitem(last=False)
+        if db_path:
+            _db_put(cache_key, content, db_path)
+
+
+def _db_get(cache_key: str, db_path: str) -> Optional[str]:
+    """读取磁盘缓存，调用方需持有 _response_cache_lock"""
+    try:
+        row = _get_response_db(db_path).execute(
+            "SELECT content FROM responses WHERE key = ?", (cache_key,)
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row is not None else None
+
+
+def _db_put(cache_key: str, content: str, db_path: str):
+    """写入磁盘缓存，调用方需持有 _response_cache_lock"""
+    try:
+        db = _get_response_db(db_path)
+        db.execute("INSERT OR REPLACE INTO responses (key, content) VALUES (?, ?)", (cache_key, content))
+        db.commit()
+    except sqlite3.Error:
+        pass  # 磁盘缓存只是加速，写入失败不影响本次调用
+
+
+def load_persisted(cache_key: str, db_path: str) -> Optional[str]:
+    """
+    只从磁盘缓存读取（不经过内存LRU），供其他服务在同一数据库中保存自己的结果
+    
+    缓存键需带上服务前缀，避免与LLM响应的键冲突。
+    """
+    if not db_path:
+        return None
+    with _response_cache_lock:
+        return _db_get(cache_key, db_path)
+
+
+def persist(cache_key: str, content: str, db_path: str):
+    """只写入磁盘缓存（不经过内存LRU），db_path 为空时不做任何事"""
+    if not db_path:
+        return
+    with _response_cache_lock:
+        _db_put(cache_key, content, db_path)
+
+
+def _completions_url(base_url: str) -> str:
+    """拼接 chat/completions 接口地址（base已包含该路径时不重复添加）"""
+    base_url = base_url.rstrip('/')
+    if base_url.endswith('/chat/completions'):
+        return base_url
+    return f"{base_url}/chat/completions"
+
+
+def _auth_headers(api_key: str) -> Dict[str, str]:
+    """构建接口请求头"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def _raise_api_failure(error: Exception):
+    """记录接口调用失败（连续失败时由处理器询问用户是否继续），并抛出异常"""
+    error_msg = f"API调用失败: {str(error)}"
+    if not api_failure_handler.record_failure(error_msg):
+        raise Exception("用户选择停止API调用")
+    raise Exception(error_msg)
+
+
+def _build_providers(config: Config) -> Dict[str, Dict]:
+    """各平台的接口配置（均为OpenAI兼容的 chat/completions 接口），请求头创建时生成一次"""
+    return {
+        'deepseek': {
+            'url': _completions_url(config.DEEPSEEK_API_BASE),
+            'headers': _auth_headers(config.DEEPSEEK_API_KEY),
+            'model': config.DEEPSEEK_MODEL,
+        },
+        'openai': {
+            'url': _completions_url(config.OPENAI_API_BASE),
+            'headers': _auth_headers(config.OPENAI_API_KEY),
+            'model': config.OPENAI_MODEL,
+        },
+        'aizex': {
+            'url': _completions_url(config.AIZEX_API_BASE),
+            'headers': _auth_headers(config.AIZEX_API_KEY),
+            'model': config.AIZEX_MODEL,
+        },
+    }
+
+
+def _provider_endpoint(providers: Dict[str, Dict], platform: str) -> Tuple[str, Dict[str, str], str]:
+    """从平台配置中取出 (接口URL, 请求头, 模型)，不支持的平台抛出ValueError"""
+    provider = providers.get(platform.lower())
+    if provider is None:
+        raise ValueError(f"不支持的API平台: {platform}")
+    return provider['url'], provider['headers'], provider['model']
+
+
+def _read_first_existing(paths: List[Union[str, Path]]) -> Optional[str]:
+    """
+    依次尝试候选路径，返回第一个可读取文件的内容（每个候选只stat一次）
+    
+    路径统一转为字符串作为缓存键，进程内各服务读取同一文件时共用一份缓存。
+    """
+    for path in paths:
+        path = os.fspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        content = _read_text_cached(path, st.st_mtime_ns, st.st_size)
+        if content is not None:
+            return content
+    return None
+
+
+# 系统提示词按"固定内容在前、每轮变化内容在后"排列：
+# 平台的提示词前缀缓存按最长公共前缀命中，固定规则 -> 属性说明（按主题）-> 人物卡 -> 场景
+_CHAT_PROMPT_HEADER = """# Role: 角色扮演助手
+
+### 回复要求
+- 严格保持角色的性格、背景和说话风格，结合场景（时间/地点/目标/事件）理解情境，自然体现内在想法
+- 表/里区分：surface为玩家可见，hidden为隐藏推演，不要暴露hidden信息
+- 回复1-3句，直接输出自然语言文本（不要JSON）
+
+### 角色信息
+**【属性说明】**
+"""
+
+# 合并多条消息为一次请求时附加的说明，回复按编号逐条返回
+_BATCH_CHAT_INSTRUCTION = "请分别回复以下每条消息。每条回复单独成段，以对应编号开头（如“1) ……”），不要输出其他内容。\n\n"
+
+# 一次合并请求的最大消息数，过多会拉长单次生成时间
+BATCH_CHAT_MAX_SIZE = 8
+
+_NUMBERED_REPLY_RE = re.compile(r'^\s*(\d+)\s*[)）.、:：]\s*')
+
+
+def _split_numbered_replies(text: str, count: int) -> Optional[List[str]]:
+    """按编号拆分合并请求的回复，编号缺失或重复时返回None"""
+    replies: Dict[int, List[str]] = {}
+    current = None
+    for line in text.splitlines():
+        match = _NUMBERED_REPLY_RE.match(line)
+        if match and 1 <= int(match.group(1)) <= count and int(match.group(1)) not in replies:
+            current = int(match.group(1))
+            replies[current] = [line[match.end():]]
+        elif current is not None:
+            replies[current].append(line)
+    if len(replies) != count:
+        return None
+    return ["\n".join(replies[n]).strip() for n in range(1, count + 1)]
+
 
 class ChatService:
     """对话服务，支持多个API平台"""
     
     def __init__(self):
         self.config = Config()
+        # 持久HTTP会话：复用连接，减少TCP/TLS握手
+        self.session = _HTTP
+        self._base_dir = Path(__file__).resolve().parent.parent
+        self._config_dir = self._base_dir / self.config.CHARACTER_CONFIG_DIR
+        self._save_dir = self._base_dir / self.config.SAVE_DIR
+        self._attr_guide_paths: Dict[str, List[Path]] = {}
+        self._providers = _build_providers(self.config)
+        
+        # LLM调用记录器和token统计（不可用时为None），创建时解析一次，避免每次调用都走import
+        try:
+            from tests.llm_call_logger import logger as llm_logger
+        except ImportError:
+            llm_logger = None
+        try:
+            from services.token_tracker import token_tracker
+        except ImportError:
+            token_tracker = None
+        self._llm_logger = llm_logger
+        self._token_tracker = token_tracker
 
     def _load_attr_guide(self, theme: str) -> str:
-        """读取属性说明文档，优先主题目录，其次根目录，最后默认文本"""
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        candidates = [
-            os.path.join(base_dir, self.config.CHARACTER_CONFIG_DIR, theme, "CHARACTER_ATTRIBUTES.md"),
-            os.path.join(base_dir, "CHARACTER_ATTRIBUTES.md"),
-        ]
-        for path in candidates:
-            if os.path.exists(path):
-                try:
-                    with open(path, "r", encoding="utf-8") as f:
-                        return f.read()
-                except Exception:
-                    continue
-        return DEFAULT_ATTR_GUIDE
+        """读取属性说明文档，优先主题目录，其次根目录，最后默认文本（文件未修改时使用缓存）"""
+        paths = self._attr_guide_paths.get(theme)
+        if paths is None:
+            paths = [
+                self._config_dir / theme / "CHARACTER_ATTRIBUTES.md",
+                self._base_dir / "CHARACTER_ATTRIBUTES.md",
+            ]
+            self._attr_guide_paths[theme] = paths
+        content = _read_first_existing(paths)
+        return content if content is not None else DEFAULT_ATTR_GUIDE
+    
+    @staticmethod
+    def refresh_attr_guides():
+        """清空文件内容缓存（正常情况下按修改时间自动失效，无需手动调用）"""
+        _read_text_cached.cache_clear()
     
     def _load_scene(self, theme: str, save_step: Optional[str] = None) -> Optional[str]:
-        """读取场景设定文件，优先读取存档场景，其次初始场景"""
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        
-        # 优先读取存档场景
+        """读取场景设定文件，优先读取存档场景，其次初始场景（文件未修改时使用缓存）"""
+        candidates = []
         if save_step:
-            scene_path = os.path.join(base_dir, self.config.SAVE_DIR, theme, save_step, "SCENE.md")
-            if os.path.exists(scene_path):
-                try:
-                    with open(scene_path, "r", encoding="utf-8") as f:
-                        return f.read()
-                except Exception:
-                    pass
-        
-        # 其次读取初始场景
-        scene_path = os.path.join(base_dir, self.config.CHARACTER_CONFIG_DIR, theme, "SCENE.md")
-        if os.path.exists(scene_path):
-            try:
-                with open(scene_path, "r", encoding="utf-8") as f:
-                    return f.read()
-            except Exception:
-                pass
-        return None
+            candidates.append(self._save_dir / theme / save_step / "SCENE.md")
+        candidates.append(self._config_dir / theme / "SCENE.md")
+        return _read_first_existing(candidates)
     
-    def _call_deepseek_api(self, messages: List[Dict], temperature: float = 0.7, 
-                           operation: str = "chat", context: Dict = None, 
-                           max_retries: int = 3) -> str:
-        """调用DeepSeek API（带重试机制）"""
-        url = f"{self.config.DEEPSEEK_API_BASE}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.config.DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json"
-        }
+    def _platform_endpoint(self, platform: str) -> Tuple[str, Dict[str, str], str]:
+        """获取平台的 (接口URL, 请求头, 模型)"""
+        return _provider_endpoint(self._providers, platform)
+    
+    def _call_openai_compatible(self, platform: str, messages: List[Dict], temperature: float = 0.7,
+                                operation: str = "chat", context: Dict = None,
+                                response_format: Optional[Dict] = None) -> str:
+        """
+        调用OpenAI兼容的对话接口（带重试机制），各平台共用
+        
+        response_format 原样传给接口，如 {"type": "json_object"} 要求模型只输出JSON对象
+        """
+        url, headers, model = self._platform_endpoint(platform)
+        
+        # 确定性调用：相同模型、相同消息的结果可直接复用，不再请求接口
+        cache_key = None
+        if temperature <= DETERMINISTIC_TEMPERATURE and self.config.LLM_RESPONSE_CACHE_SIZE > 0:
+            cache_key = _response_cache_key(platform, model, messages, temperature, response_format)
+            cached = _get_cached_response(cache_key, self.config.LLM_RESPONSE_CACHE_SIZE,
+                                          self.config.LLM_RESPONSE_CACHE_DB)
+            if cached is not None:
+                self._record_call(platform.lower(), model, messages, cached, temperature,
+                                  {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0,
+                                   'cached': True},
+                                  operation, context)
+                return cached
         
         data = {
-            "model": self.config.DEEPSEEK_MODEL,
+            "model": model,
             "messages": messages,
             "temperature": temperature
         }
+        if response_format is not None:
+            data["response_format"] = response_format
         
-        # 重试机制
-        last_exception = None
-        for attempt in range(max_retries):
-            try:
-                # 超时时间：第一次30秒，重试时增加到60秒
-                timeout = 60 if attempt > 0 else 30
-                response = requests.post(url, headers=headers, json=data, timeout=timeout)
-                response.raise_for_status()
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                # 成功，跳出重试循环
-                break
-            except requests.exceptions.Timeout as e:
-                last_exception = e
-                if attempt < max_retries - 1:
-                    print(f"API调用超时，正在重试 ({attempt + 1}/{max_retries})...")
-                    import time
-                    time.sleep(2 * (attempt + 1))  # 指数退避
-                else:
-                    # 记录失败并检查是否需要用户确认
-                    error_msg = f"API调用超时，已重试{max_retries}次: {str(e)}"
-                    try:
-                        should_continue = api_failure_handler.record_failure(error_msg)
-                        if not should_continue:
-                            raise Exception("用户选择停止API调用")
-                    except APIConfirmationRequired as confirm_ex:
-                        raise confirm_ex
-                    raise Exception(error_msg)
-            except requests.exceptions.RequestException as e:
-                last_exception = e
-                if attempt < max_retries - 1:
-                    print(f"API调用失败，正在重试 ({attempt + 1}/{max_retries}): {str(e)}")
-                    import time
-                    time.sleep(2 * (attempt + 1))
-                else:
-                    # 记录失败并检查是否需要用户确认
-                    error_msg = f"API调用失败，已重试{max_retries}次: {str(e)}"
-                    try:
-                        should_continue = api_failure_handler.record_failure(error_msg)
-                        if not should_continue:
-                            raise Exception("用户选择停止API调用")
-                    except APIConfirmationRequired as confirm_ex:
-                        raise confirm_ex
-                    raise Exception(error_msg)
-            except APIConfirmationRequired:
-                # 重新抛出确认异常
-                raise
-            except Exception as e:
-                # 其他错误直接抛出
-                raise
-        
-        if last_exception and 'content' not in locals():
-            error_msg = f"API调用失败: {str(last_exception)}"
-            try:
-                should_continue = api_failure_handler.record_failure(error_msg)
-                if not should_continue:
-                    raise Exception("用户选择停止API调用")
-            except APIConfirmationRequired as confirm_ex:
-                raise confirm_ex
-            raise Exception(error_msg)
+        # 超时/429/5xx 的重试由会话上挂载的 urllib3 Retry 完成（指数退避+抖动，遵循Retry-After）
+        try:
+            response = self.session.post(url, headers=headers, json=data, timeout=API_TIMEOUT)
+            response.raise_for_status()
+            result = response.json()
+            content = result['choices'][0]['message']['content']
+        except requests.exceptions.RequestException as e:
+            # 记录失败并检查是否需要用户确认
+            _raise_api_failure(e)
         
         # API调用成功，重置失败计数
         api_failure_handler.record_success()
         
-        # 记录LLM调用（如果记录器可用）
-        usage = result.get('usage', {})
+        if cache_key is not None:
+            _store_response(cache_key, content, self.config.LLM_RESPONSE_CACHE_SIZE,
+                            self.config.LLM_RESPONSE_CACHE_DB)
+        
+        # 记录LLM调用和token消耗
+        self._record_call(platform.lower(), model, messages, content, temperature,
+                          result.get('usage', {}), operation, context)
+        return content
+    
+    def _call_deepseek_api(self, messages: List[Dict], temperature: float = 0.7, 
+                           operation: str = "chat", context: Dict = None,
+                           response_format: Optional[Dict] = None) -> str:
+        """调用DeepSeek API（带重试机制）"""
+        return self._call_openai_compatible('deepseek', messages, temperature,
+                                            operation, context, response_format)
+    
+    def _call_aizex_api(self, messages: List[Dict], temperature: float = 0.7,
+                        operation: str = "chat", context: Dict = None,
+                        response_format: Optional[Dict] = None) -> str:
+        """调用AIZEX API（带重试机制）"""
+        return self._call_openai_compatible('aizex', messages, temperature,
+                                            operation, context, response_format)
+    
+    def _call_openai_api(self, messages: List[Dict], temperature: float = 0.7,
+                        operation: str = "chat", context: Dict = None,
+                        response_format: Optional[Dict] = None) -> str:
+        """调用OpenAI API（带重试机制）"""
+        return self._call_openai_compatible('openai', messages, temperature,
+                                            operation, context, response_format)
+    
+    def stream_platform_api(self, platform: str, messages: List[Dict], temperature: float = 0.7,
+                            operation: str = "chat", context: Dict = None,
+                            response_format: Optional[Dict] = None) -> Iterator[str]:
+        """
+        以流式（SSE）方式调用API，逐段返回生成的内容
+        
+        调用方提前结束迭代（或关闭生成器）时会断开连接，不再接收剩余内容。
+        接收过程中连接中断或数据无法解析时，与非流式调用一样记录失败并抛出异常。
+        """
+        platform = platform.lower()
+        url, headers, model = self._platform_endpoint(platform)
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True
+        }
+        if response_format is not None:
+            data["response_format"] = response_format
+        
+        try:
+            response = self.session.post(url, headers=headers, json=data, timeout=API_TIMEOUT, stream=True)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            _raise_api_failure(e)
+        api_failure_handler.record_success()
+        
+        parts = []
+        usage = {}
         try:
-            from tests.llm_call_logger import logger
-            logger.log_call(
-                platform='deepseek',
+            lines = iter(response.iter_lines(decode_unicode=False))
+            while True:
+                try:
+                    line = next(lines, None)
+                    if line is None:
+                        break
+                    if not line or not line.startswith(b"data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == b"[DONE]":
+                        break
+                    chunk = json_utils.loads(payload)
+                except (requests.exceptions.RequestException, json_utils.JSONDecodeError) as e:
+                    _raise_api_failure(e)
+                usage = chunk.get('usage') or usage
+                choices = chunk.get('choices') or []
+                delta = choices[0].get('delta', {}).get('content') if choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            response.close()
+            self._record_call(platform, model, messages, "".join(parts), temperature,
+                              usage, operation, context)
+    
+    def call_platform_api_streaming(self, platform: str, messages: List[Dict],
+                                    stop_when: Callable[[str], bool], temperature: float = 0.7,
+                                    operation: str = "chat", context: Dict = None) -> str:
+        """
+        流式调用API并累积内容，stop_when(已累积文本) 返回True时立即断开连接
+        
+        Returns:
+            累积的响应文本
+        """
+        text = ""
+        stream = self.stream_platform_api(platform, messages, temperature,
+                                          operation=operation, context=context)
+        try:
+            for delta in stream:
+                text += delta
+                if stop_when(text):
+                    break
+        finally:
+            stream.close()
+        return text
+    
+    def _record_call(self, platform: str, model: str, messages: List[Dict], content: str,
+                     temperature: float, usage: Dict, operation: str, context: Dict = None):
+        """记录LLM调用日志和token消耗（记录器不可用时忽略）"""
+        if self._llm_logger is not None:
+            # 写日志文件和打印放到后台线程，不阻塞响应返回
+            _submit_log(
+                self._llm_logger.log_call,
+                platform=platform,
                 messages=messages,
                 response=content,
-                model=self.config.DEEPSEEK_MODEL,
+                model=model,
                 temperature=temperature,
                 usage=usage
             )
-        except ImportError:
-            pass  # 记录器不可用时忽略
         
-        # 记录token消耗
-        try:
-            from services.token_tracker import token_tracker
-            token_tracker.record_call(
-                platform='deepseek',
-                model=self.config.DEEPSEEK_MODEL,
+        # token统计只是内存追加，保持同步，保证本轮统计在请求返回时已完整
+        if self._token_tracker is not None:
+            self._token_tracker.record_call(
+                platform=platform,
+                model=model,
                 usage=usage,
                 operation=operation,
                 context=context or {}
             )
-        except ImportError:
-            pass
+    
+    def call_platform_api(self, platform: str, messages: List[Dict], temperature: float = 0.7,
+                          operation: str = "chat", context: Dict = None,
+                          stop_when: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        根据平台名称调用对应的API
         
-        return content
+        Args:
+            stop_when: 提前结束条件；提供且开启了流式配置时改用流式调用
+        """
+        if stop_when is not None and self.config.LLM_STREAMING_ENABLED:
+            return self.call_platform_api_streaming(platform, messages, stop_when, temperature,
+                                                    operation=operation, context=context)
+        return self.platform_method(platform)(messages, temperature, operation=operation, context=context)
     
-    def _call_aizex_api(self, messages: List[Dict], temperature: float = 0.7,
-                        operation: str = "chat", context: Dict = None,
-                        max_retries: int = 3) -> str:
-        """调用AIZEX API（带重试机制）"""
-        # 处理URL，避免重复路径
-        base_url = self.config.AIZEX_API_BASE.rstrip('/')
-        if base_url.endswith('/chat/completions'):
-            url = base_url
-        else:
-            url = f"{base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.config.AIZEX_API_KEY}",
-            "Content-Type": "application/json"
-        }
+    def platform_method(self, platform: str) -> Callable[..., str]:
+        """按平台名称查表获取对应的调用方法（不支持的平台抛出ValueError）"""
+        try:
+            method_name = PLATFORM_DISPATCH[platform.lower()]
+        except KeyError:
+            raise ValueError(f"不支持的API平台: {platform}") from None
+        return getattr(self, method_name)
+    
+    def batch_call_api(self, messages_list: List[List[Dict]], platform: str = None,
+                       temperature: float = 0.7, operation: str = "chat",
+                       contexts: Optional[List[Dict]] = None,
+                       max_workers: int = 8,
+                       stop_when: Optional[Callable[[str], bool]] = None) -> List[Union[str, Exception]]:
+        """
+        并发发送一批请求（如同一回合内所有智能体的请求）
         
-        data = {
-            "model": self.config.AIZEX_MODEL,
-            "messages": messages,
-            "temperature": temperature
-        }
+        Args:
+            messages_list: 每个请求的消息列表
+            platform: API平台，默认使用配置的平台
+            contexts: 每个请求的上下文信息（用于token统计）
+            max_workers: 最大并发数
+            stop_when: 流式调用的提前结束条件（见 call_platform_api）
         
-        # 重试机制
-        last_exception = None
-        for attempt in range(max_retries):
+        Returns:
+            与输入顺序一致的结果列表，单个请求失败时对应位置为异常对象
+        """
+        platform = platform or self.config.DEFAULT_API_PLATFORM
+        contexts = contexts or [None] * len(messages_list)
+        if not messages_list:
+            return []
+        
+        def _call(messages, context):
             try:
-                # 超时时间：第一次30秒，重试时增加到60秒
-                timeout = 60 if attempt > 0 else 30
-                response = requests.post(url, headers=headers, json=data, timeout=timeout)
-                response.raise_for_status()
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                # 成功，跳出重试循环
-                break
-            except requests.exceptions.Timeout as e:
-                last_exception = e
-                if attempt < max_retries - 1:
-                    print(f"API调用超时，正在重试 ({attempt + 1}/{max_retries})...")
-                    import time
-                    time.sleep(2 * (attempt + 1))  # 指数退避
-                else:
-                    # 记录失败并检查是否需要用户确认
-                    error_msg = f"API调用超时，已重试{max_retries}次: {str(e)}"
-                    try:
-                        should_continue = api_failure_handler.record_failure(error_msg)
-                        if not should_continue:
-                            raise Exception("用户选择停止API调用")
-                    except APIConfirmationRequired as confirm_ex:
-                        raise confirm_ex
-                    raise Exception(error_msg)
-            except requests.exceptions.RequestException as e:
-                last_exception = e
-                if attempt < max_retries - 1:
-                    print(f"API调用失败，正在重试 ({attempt + 1}/{max_retries}): {str(e)}")
-                    import time
-                    time.sleep(2 * (attempt + 1))
-                else:
-                    # 记录失败并检查是否需要用户确认
-                    error_msg = f"API调用失败，已重试{max_retries}次: {str(e)}"
-                    try:
-                        should_continue = api_failure_handler.record_failure(error_msg)
-                        if not should_continue:
-                            raise Exception("用户选择停止API调用")
-                    except APIConfirmationRequired as confirm_ex:
-                        raise confirm_ex
-                    raise Exception(error_msg)
-            except APIConfirmationRequired:
-                # 重新抛出确认异常
-                raise
+                return self.call_platform_api(platform, messages, temperature,
+                                              operation=operation, context=context,
+                                              stop_when=stop_when)
             except Exception as e:
-                # 其他错误直接抛出
-                raise
+                return e
+        
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(messages_list))) as executor:
+            return list(executor.map(_call, messages_list, contexts))
+    
+    def batch_chat(self, items: List[Dict],
+                   max_batch_size: int = BATCH_CHAT_MAX_SIZE) -> List[Union[str, Exception]]:
+        """
+        批量生成角色对话回复（如多个玩家同时向同一角色发言）
+        
+        系统提示词相同（同一角色、同一场景）的消息合并为一次请求，按编号拆分回复；
+        不同系统提示词的请求之间并发执行。合并请求的回复无法按编号拆分时，逐条重新请求。
+        
+        Args:
+            items: 每项为 chat 的关键字参数
+            max_batch_size: 一次合并请求的最大消息数
         
-        if last_exception and 'content' not in locals():
-            error_msg = f"API调用失败: {str(last_exception)}"
+        Returns:
+            与输入顺序一致的回复列表，单条失败时对应位置为异常对象
+        """
+        # 按 (平台, 系统提示词) 分组
+        prepared = []
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        for i, item in enumerate(items):
+            platform = (item.get('platform') or self.config.DEFAULT_API_PLATFORM).lower()
+            theme = item.get('theme') or "default"
+            save_step = item.get('save_step')
+            messages = self._build_chat_messages(item['character_description'],
+                                                 item['character_attributes'],
+                                                 item['user_message'], theme, save_step)
+            prepared.append((platform, messages, {'theme': theme, 'save_step': save_step}))
+            groups.setdefault((platform, messages[0]['content']), []).append(i)
+        
+        chunks = []
+        for indices in groups.values():
+            for start in range(0, len(indices), max_batch_size):
+                chunks.append(indices[start:start + max_batch_size])
+        
+        results: List[Union[str, Exception]] = [None] * len(items)
+        
+        def _call_single(i):
+            platform, messages, context = prepared[i]
             try:
-                should_continue = api_failure_handler.record_failure(error_msg)
-                if not should_continue:
-                    raise Exception("用户选择停止API调用")
-            except APIConfirmationRequired as confirm_ex:
-                raise confirm_ex
-            raise Exception(error_msg)
+                results[i] = self.call_platform_api(platform, messages, operation='chat', context=context)
+            except Exception as e:
+                results[i] = e
         
-        # API调用成功，重置失败计数
-        api_failure_handler.record_success()
+        def _call_chunk(chunk):
+            if len(chunk) == 1:
+                _call_single(chunk[0])
+                return
+            platform, messages, context = prepared[chunk[0]]
+            numbered = "\n".join(
+                f"{n}) {' '.join(items[i]['user_message'].splitlines())}"
+                for n, i in enumerate(chunk, 1)
+            )
+            batch_messages = [
+                messages[0],
+                {"role": "user", "content": _BATCH_CHAT_INSTRUCTION + numbered}
+            ]
+            try:
+                text = self.call_platform_api(platform, batch_messages, operation='chat',
+                                              context={**context, 'batch_size': len(chunk)})
+                replies = _split_numbered_replies(text, len(chunk))
+            except Exception:
+                replies = None
+            if replies is None:
+                for i in chunk:
+                    _call_single(i)
+                return
+            for i, reply in zip(chunk, replies):
+                results[i] = reply
+        
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(8, len(chunks))) as executor:
+                list(executor.map(_call_chunk, chunks))
+        return results
+    
+    def _batch_map_path(self, batch_id: str) -> Path:
+        """Batch任务的请求映射文件路径"""
+        return self._save_dir / "batches" / f"{batch_id}.json"
+    
+    def submit_batch(self, messages_list: List[List[Dict]], temperature: float = 0.7,
+                     operation: str = "batch") -> str:
+        """
+        通过OpenAI Batch API提交一批离线请求（24小时内完成，费用减半，不占用同步限流额度）
+        
+        适用于不需要即时结果的任务，如批量重新生成NPC对话、场景评估。
+        
+        Args:
+            messages_list: 每个请求的消息列表
+            temperature: 温度
+            operation: 操作类型（记录在映射文件中）
+        
+        Returns:
+            batch_id，用 poll_batch 查询结果
+        """
+        if not self.config.USE_BATCH_API:
+            raise ValueError("未开启Batch API，请设置 USE_BATCH_API=true")
+        
+        _, headers, model = self._platform_endpoint('openai')
+        base_url = self.config.OPENAI_API_BASE.rstrip('/')
+        auth_headers = {"Authorization": headers["Authorization"]}
+        
+        custom_ids = [f"request-{i}" for i in range(len(messages_list))]
+        lines = [
+            json_utils.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": model, "messages": messages, "temperature": temperature}
+            })
+            for custom_id, messages in zip(custom_ids, messages_list)
+        ]
         
-        # 记录LLM调用（如果记录器可用）
-        usage = result.get('usage', {})
-        try:
-            from tests.llm_call_logger import logger
-            if logger:
-                logger.log_call(
-                    platform='aizex',
-                    messages=messages,
-                    response=content,
-                    model=self.config.AIZEX_MODEL,
-                    temperature=temperature,
-                    usage=usage
-                )
-        except (ImportError, AttributeError):
-            pass  # 记录器不可用时忽略
-        
-        # 记录token消耗
         try:
-            from services.token_tracker import token_tracker
-            token_tracker.record_call(
-                platform='aizex',
-                model=self.config.AIZEX_MODEL,
-                usage=usage,
-                operation=operation,
-                context=context or {}
+            # 上传请求文件（JSONL），再创建Batch任务
+            response = self.session.post(
+                f"{base_url}/files", headers=auth_headers, timeout=API_TIMEOUT,
+                data={"purpose": "batch"},
+                files={"file": ("batch.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")}
             )
-        except ImportError:
-            pass
+            response.raise_for_status()
+            input_file_id = response.json()["id"]
+            
+            response = self.session.post(
+                f"{base_url}/batches", headers=headers, timeout=API_TIMEOUT,
+                json={
+                    "input_file_id": input_file_id,
+                    "endpoint": "/v1/chat/completions",
+                    "completion_window": "24h"
+                }
+            )
+            response.raise_for_status()
+            batch_id = response.json()["id"]
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"提交Batch任务失败: {str(e)}")
         
-        return content
+        # 保存 batch_id -> 请求顺序 的映射，取结果时按原顺序还原
+        map_path = self._batch_map_path(batch_id)
+        map_path.parent.mkdir(parents=True, exist_ok=True)
+        map_path.write_bytes(json_utils.dump_bytes({
+            "batch_id": batch_id,
+            "model": model,
+            "operation": operation,
+            "custom_ids": custom_ids
+        }, indent=True))
+        return batch_id
     
-    def _call_openai_api(self, messages: List[Dict], temperature: float = 0.7,
-                        operation: str = "chat", context: Dict = None,
-                        max_retries: int = 3) -> str:
-        """调用OpenAI API（带重试机制）"""
-        url = f"{self.config.OPENAI_API_BASE}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.config.OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
+    def poll_batch(self, batch_id: str) -> Optional[List[Union[str, Exception]]]:
+        """
+        查询Batch任务结果
         
-        data = {
-            "model": self.config.OPENAI_MODEL,
-            "messages": messages,
-            "temperature": temperature
-        }
+        Returns:
+            任务未完成时返回None；完成时返回与提交顺序一致的结果列表，
+            单个请求失败时对应位置为异常对象
+        """
+        _, headers, model = self._platform_endpoint('openai')
+        base_url = self.config.OPENAI_API_BASE.rstrip('/')
+        
+        try:
+            response = self.session.get(f"{base_url}/batches/{batch_id}", headers=headers,
+                                        timeout=API_TIMEOUT)
+            response.raise_for_status()
+            batch = response.json()
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"查询Batch任务失败: {str(e)}")
+        
+        status = batch.get("status")
+        if status in ("failed", "expired", "cancelled"):
+            raise Exception(f"Batch任务未完成: {status}")
+        if status != "completed":
+            return None
         
-        # 重试机制
-        last_exception = None
-        for attempt in range(max_retries):
+        outputs: Dict[str, Union[str, Exception]] = {}
+        for file_key in ("output_file_id", "error_file_id"):
+            file_id = batch.get(file_key)
+            if not file_id:
+                continue
             try:
-                # 超时时间：第一次30秒，重试时增加到60秒
-                timeout = 60 if attempt > 0 else 30
-                response = requests.post(url, headers=headers, json=data, timeout=timeout)
+                response = self.session.get(f"{base_url}/files/{file_id}/content", headers=headers,
+                                            timeout=API_TIMEOUT)
                 response.raise_for_status()
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                # 成功，跳出重试循环
-                break
-            except requests.exceptions.Timeout as e:
-                last_exception = e
-                if attempt < max_retries - 1:
-                    print(f"API调用超时，正在重试 ({attempt + 1}/{max_retries})...")
-                    import time
-                    time.sleep(2 * (attempt + 1))  # 指数退避
-                else:
-                    # 记录失败并检查是否需要用户确认
-                    error_msg = f"API调用超时，已重试{max_retries}次: {str(e)}"
-                    try:
-                        should_continue = api_failure_handler.record_failure(error_msg)
-                        if not should_continue:
-                            raise Exception("用户选择停止API调用")
-                    except APIConfirmationRequired as confirm_ex:
-                        raise confirm_ex
-                    raise Exception(error_msg)
             except requests.exceptions.RequestException as e:
-                last_exception = e
-                if attempt < max_retries - 1:
-                    print(f"API调用失败，正在重试 ({attempt + 1}/{max_retries}): {str(e)}")
-                    import time
-                    time.sleep(2 * (attempt + 1))
+                raise Exception(f"下载Batch结果失败: {str(e)}")
+            for line in response.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json_utils.loads(line)
+                resp = record.get("response") or {}
+                if resp.get("status_code") == 200:
+                    body = resp["body"]
+                    outputs[record["custom_id"]] = body["choices"][0]["message"]["content"]
+                    if self._token_tracker is not None:
+                        self._token_tracker.record_call(
+                            platform='openai', model=model, usage=body.get('usage', {}),
+                            operation='batch', context={'batch_id': batch_id}
+                        )
                 else:
-                    # 记录失败并检查是否需要用户确认
-                    error_msg = f"API调用失败，已重试{max_retries}次: {str(e)}"
-                    try:
-                        should_continue = api_failure_handler.record_failure(error_msg)
-                        if not should_continue:
-                            raise Exception("用户选择停止API调用")
-                    except APIConfirmationRequired as confirm_ex:
-                        raise confirm_ex
-                    raise Exception(error_msg)
-            except APIConfirmationRequired:
-                # 重新抛出确认异常
-                raise
-            except Exception as e:
-                # 其他错误直接抛出
-                raise
+                    outputs[record["custom_id"]] = Exception(
+                        f"Batch请求失败: {record.get('error') or resp.get('body')}"
+                    )
         
-        if last_exception and 'content' not in locals():
-            error_msg = f"API调用失败: {str(last_exception)}"
-            try:
-                should_continue = api_failure_handler.record_failure(error_msg)
-                if not should_continue:
-                    raise Exception("用户选择停止API调用")
-            except APIConfirmationRequired as confirm_ex:
-                raise confirm_ex
-            raise Exception(error_msg)
-        
-        # API调用成功，重置失败计数
-        api_failure_handler.record_success()
+        map_path = self._batch_map_path(batch_id)
+        if map_path.exists():
+            custom_ids = json_utils.loads(map_path.read_bytes())["custom_ids"]
+        else:
+            custom_ids = sorted(outputs, key=lambda cid: int(cid.rsplit('-', 1)[-1]))
+        return [outputs.get(cid, Exception(f"Batch结果缺失: {cid}")) for cid in custom_ids]
+    
+    async def acall_platform_api(self, platform: str, messages: List[Dict], temperature: float = 0.7,
+                                 operation: str = "chat", context: Dict = None,
+                                 stop_when: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        call_platform_api 的异步版本，网络等待在线程中进行，不阻塞事件循环
         
-        # 记录LLM调用（如果记录器可用）
-        usage = result.get('usage', {})
-        try:
-            from tests.llm_call_logger import logger
-            logger.log_call(
-                platform='openai',
-                messages=messages,
-                response=content,
-                model=self.config.OPENAI_MODEL,
-                temperature=temperature,
-                usage=usage
-            )
-        except ImportError:
-            pass  # 记录器不可用时忽略
+        多个请求可以用 asyncio.gather 并发执行，共用同一个HTTP连接池。
+        """
+        return await asyncio.to_thread(self.call_platform_api, platform, messages, temperature,
+                                       operation, context, stop_when)
+    
+    async def achat(self, character_description: str, character_attributes: Dict,
+                    user_message: str, platform: str = None, theme: str = "default",
+                    save_step: Optional[str] = None) -> str:
+        """chat 的异步版本，参数与返回值相同"""
+        return await asyncio.to_thread(self.chat, character_description, character_attributes,
+                                       user_message, platform, theme, save_step)
+    
+    def _build_chat_messages(self, character_description: str, character_attributes: Dict,
+                             user_message: str, theme: str,
+                             save_step: Optional[str] = None) -> List[Dict]:
+        """构建角色对话的消息列表（不使用对话历史）"""
+        attr_guide = self._load_attr_guide(theme)
+        scene_content = self._load_scene(theme, save_step)
         
-        # 记录token消耗
-        try:
-            from services.token_tracker import token_tracker
-            token_tracker.record_call(
-                platform='openai',
-                model=self.config.OPENAI_MODEL,
-                usage=usage,
-                operation=operation,
-                context=context or {}
-            )
-        except ImportError:
-            pass
+        # 构建系统提示词（固定部分为模块常量，可变部分依次追加在后面）
+        system_prompt = "".join([
+            _CHAT_PROMPT_HEADER,
+            attr_guide,
+            "\n**【人物卡】**\n- 描述: ", character_description,
+            "\n- 属性: ", json_utils.dumps(character_attributes),
+            "\n\n**【场景】**\n" + scene_content if scene_content else "",
+            "\n",
+        ])
         
-        return content
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ]
     
     def chat(self, character_description: str, character_attributes: Dict,
              user_message: str, platform: str = None, theme: str = "default",
@@ -422,58 +895,49 @@ class ChatService:
         """
         platform = platform or self.config.DEFAULT_API_PLATFORM
         theme = theme or "default"
-        attr_guide = self._load_attr_guide(theme)
-        scene_content = self._load_scene(theme, save_step)
+        messages = self._build_chat_messages(character_description, character_attributes,
+                                             user_message, theme, save_step)
+        return self.call_platform_api(platform, messages, operation='chat',
+                                      context={'theme': theme, 'save_step': save_step})
+    
+    def stream_chat(self, character_description: str, character_attributes: Dict,
+                    user_message: str, platform: str = None, theme: str = "default",
+                    save_step: Optional[str] = None) -> Iterator[str]:
+        """
+        流式生成角色对话回复，参数同 chat，逐段返回生成的内容
         
-        # 构建系统提示词
-        system_prompt = f"""# Role: 角色扮演助手 (Role-Play Assistant)
-
-生成角色对话回复。
-
----
-
-### 1. 角色信息 (Character Information)
-
-**【人物卡】**
-- 描述: {character_description}
-- 属性: {json.dumps(character_attributes, ensure_ascii=False)}
-**【属性说明】**
-{attr_guide}
-{'\n**【场景】**\n' + scene_content if scene_content else ''}
-
----
-
-### 2. 回复要求 (Response Requirements)
-
-1. **角色一致性**: 严格遵循角色性格、背景和说话风格
-2. **情境理解**: 结合场景理解情境（时间/地点/目标/事件）
-3. **表/里区分**: surface=玩家可见，hidden=隐藏推演
-4. **自然表达**: 自然体现内在想法，不暴露里信息
-5. **简洁性**: 回复1-3句，简洁自然
+        完整回复在流结束时统一记录日志和token消耗。
+        """
+        platform = platform or self.config.DEFAULT_API_PLATFORM
+        theme = theme or "default"
+        messages = self._build_chat_messages(character_description, character_attributes,
+                                             user_message, theme, save_step)
+        return self.stream_platform_api(platform, messages, operation='chat',
+                                        context={'theme': theme, 'save_step': save_step})
+    
+    async def astream_chat(self, character_description: str, character_attributes: Dict,
+                           user_message: str, platform: str = None, theme: str = "default",
+                           save_step: Optional[str] = None) -> AsyncIterator[str]:
+        """stream_chat 的异步版本，读取下一段内容时不阻塞事件循环"""
+        stream = self.stream_chat(character_description, character_attributes,
+                                  user_message, platform, theme, save_step)
+        finished = object()
+        try:
+            while True:
+                delta = await asyncio.to_thread(next, stream, finished)
+                if delta is finished:
+                    break
+                yield delta
+        finally:
+            stream.close()
 
----
 
-### 3. 输出格式 (Output Format)
+_default_chat_service: Optional[ChatService] = None
 
-直接输出回复文本（自然语言，不需要JSON格式）。
-"""
-        
-        # 构建消息列表（不使用对话历史）
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ]
-        
-        # 根据平台调用不同的API
-        if platform.lower() == 'deepseek':
-            return self._call_deepseek_api(messages, operation='chat', 
-                                           context={'theme': theme, 'save_step': save_step})
-        elif platform.lower() == 'openai':
-            return self._call_openai_api(messages, operation='chat',
-                                        context={'theme': theme, 'save_step': save_step})
-        elif platform.lower() == 'aizex':
-            return self._call_aizex_api(messages, operation='chat',
-                                       context={'theme': theme, 'save_step': save_step})
-        else:
-            raise ValueError(f"不支持的API平台: {platform}")
 
+def get_default_chat_service() -> ChatService:
+    """获取进程内共享的ChatService实例（首次调用时创建），各智能体共用同一个HTTP连接池"""
+    global _default_chat_service
+    if _default_chat_service is None:
+        _default_chat_service = ChatService()
+    return _default_chat_service
@@ -1,8 +1,14 @@
+import asyncio
+import hashlib
 import os
-import requests
-import json
-from typing import List, Dict, Optional, Tuple
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple, Union
 from config import Config
+from services import json_utils
+from services.chat_service import (_build_providers, _provider_endpoint, _read_first_existing,
+                                   get_http_session)
 
 DEFAULT_ATTR_GUIDE = """
 属性说明（用于参考，不要逐字复述）：
@@ -16,102 +22,173 @@ DEFAULT_ATTR_GUIDE = """
 - speaking_style: 说话风格
 """
 
+# 一致性检测提示词模板（通过 str.format 填入人物卡、场景和对话），单条和批量检测共用输入部分
+_CHECK_PROMPT_INPUT = """# Role: 一致性检测器 (Consistency Checker)
+
+评估角色回复是否符合设定。
+
+---
+
+### 1. 输入信息 (Input)
+
+**【人物卡】**
+- 描述: {character_description}
+- 属性: {character_attributes}
+**【属性说明】**
+{attr_guide}
+{scene_block}
+
+"""
+
+_CHECK_REQUIREMENTS = """---
+
+### 2. 评估要求 (Evaluation Requirements)
+
+评估以下方面：
+1. **性格设定**: 是否符合角色性格特点
+2. **场景状态**: 是否符合当前场景状态
+3. **违和感**: 是否有违和感或不一致的地方
+
+---
+
+### 3. 输出格式 (Output Format)
+
+"""
+
+_CHECK_PROMPT_TEMPLATE = _CHECK_PROMPT_INPUT + """**【对话】**
+- 用户: {user_message}
+- 角色: {latest_response}
+
+""" + _CHECK_REQUIREMENTS + """输出JSON格式：
+{{
+    "score": 0.95,
+    "feedback": "反馈内容"
+}}
+"""
+
+_BATCH_CHECK_PROMPT_TEMPLATE = _CHECK_PROMPT_INPUT + """**【对话列表】**（逐条独立评估）
+{dialogues}
+
+""" + _CHECK_REQUIREMENTS + """输出JSON格式，results 中每条对话一项，idx 与对话列表一致：
+{{
+    "results": [
+        {{"idx": 0, "score": 0.95, "feedback": "反馈内容"}}
+    ]
+}}
+"""
+
+
+# 一次批量检测请求的最大对话数，过多会拉长单次生成时间
+BATCH_CHECK_MAX_SIZE = 8
+
+
+def _dump_attributes(character_attributes: Union[Dict, str]) -> str:
+    """
+    人物属性序列化为紧凑JSON（键排序，内容相同的属性得到相同文本）
+    
+    每次检测只序列化一次，结果同时用于缓存键和提示词；已序列化的文本原样返回。
+    """
+    if isinstance(character_attributes, str):
+        return character_attributes
+    return json_utils.dumps(character_attributes, sort_keys=True)
+
 
 class ConsistencyChecker:
     """一致性检测服务"""
     
     def __init__(self):
         self.config = Config()
+        # 是否启用检测（创建时读取一次，关闭时各入口第一行即返回）
+        self._enabled = bool(self.config.CONSISTENCY_CHECK_ENABLED)
+        self.base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+        # 与对话服务共用HTTP会话：复用长连接，限流和服务端临时错误由会话自动重试
+        self.session = get_http_session()
+        # 各平台的接口地址、请求头和模型与对话服务使用同一份配置构建
+        self._providers = _build_providers(self.config)
+        # 异步检测的并发上限（信号量需要绑定事件循环，首次使用时创建）
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._sem_loop = None
+        # 检测结果缓存（LRU淘汰）：相同人物卡、对话和场景的重复检测直接返回上次的评分
+        self._score_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._score_cache_lock = threading.Lock()
 
     def _load_attr_guide(self, theme: str) -> str:
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        candidates = [
-            os.path.join(base_dir, self.config.CHARACTER_CONFIG_DIR, theme, "CHARACTER_ATTRIBUTES.md"),
-            os.path.join(base_dir, "CHARACTER_ATTRIBUTES.md"),
-        ]
-        for path in candidates:
-            if os.path.exists(path):
-                try:
-                    with open(path, "r", encoding="utf-8") as f:
-                        return f.read()
-                except Exception:
-                    continue
-        return DEFAULT_ATTR_GUIDE
+        """读取属性说明文档，优先主题目录，其次根目录，最后默认文本（文件未修改时使用缓存）"""
+        content = _read_first_existing([
+            os.path.join(self.base_dir, self.config.CHARACTER_CONFIG_DIR, theme, "CHARACTER_ATTRIBUTES.md"),
+            os.path.join(self.base_dir, "CHARACTER_ATTRIBUTES.md"),
+        ])
+        return content if content is not None else DEFAULT_ATTR_GUIDE
     
     def _load_scene(self, theme: str, save_step: Optional[str] = None) -> Optional[str]:
-        """读取场景设定文件，优先读取存档场景，其次初始场景"""
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        
-        # 优先读取存档场景
+        """读取场景设定文件，优先读取存档场景，其次初始场景（文件未修改时使用缓存）"""
+        candidates = []
         if save_step:
-            scene_path = os.path.join(base_dir, self.config.SAVE_DIR, theme, save_step, "SCENE.md")
-            if os.path.exists(scene_path):
-                try:
-                    with open(scene_path, "r", encoding="utf-8") as f:
-                        return f.read()
-                except Exception:
-                    pass
-        
-        # 其次读取初始场景
-        scene_path = os.path.join(base_dir, self.config.CHARACTER_CONFIG_DIR, theme, "SCENE.md")
-        if os.path.exists(scene_path):
-            try:
-                with open(scene_path, "r", encoding="utf-8") as f:
-                    return f.read()
-            except Exception:
-                pass
-        return None
+            candidates.append(os.path.join(self.base_dir, self.config.SAVE_DIR, theme, save_step, "SCENE.md"))
+        candidates.append(os.path.join(self.base_dir, self.config.CHARACTER_CONFIG_DIR, theme, "SCENE.md"))
+        return _read_first_existing(candidates)
+    
+    def _score_cache_key(self, character_description: str, character_attributes: Union[Dict, str],
+                         user_message: str, latest_response: str, platform: Optional[str],
+                         theme: str, save_step: Optional[str]) -> str:
+        """根据检测输入计算缓存键（属性按键排序后序列化，与字典顺序无关）"""
+        payload = json_utils.dump_bytes([
+            (platform or self.config.CONSISTENCY_CHECK_API).lower(), theme or "default", save_step,
+            character_description, _dump_attributes(character_attributes), user_message, latest_response
+        ])
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+    
+    def _get_cached_score(self, cache_key: str) -> Optional[Tuple[float, str]]:
+        """读取缓存的检测结果"""
+        with self._score_cache_lock:
+            cached = self._score_cache.get(cache_key)
+            if cached is not None:
+                self._score_cache.move_to_end(cache_key)
+            return cached
+    
+    def _store_score(self, cache_key: str, result: Tuple[float, str]):
+        """缓存检测结果（只缓存成功解析的结果）"""
+        size = self.config.CONSISTENCY_CHECK_CACHE_SIZE
+        if size <= 0:
+            return
+        with self._score_cache_lock:
+            self._score_cache[cache_key] = result
+            self._score_cache.move_to_end(cache_key)
+            while len(self._score_cache) > size:
+                self._score_cache.popitem(last=False)
     
     def _call_api(self, messages: List[Dict], platform: str = None) -> str:
         """调用API进行检测"""
         platform = platform or self.config.CONSISTENCY_CHECK_API
+        url, headers, model = _provider_endpoint(self._providers, platform)
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": 0.3  # 使用较低温度以获得更稳定的评估
+        }
         
-        if platform.lower() == 'deepseek':
-            url = f"{self.config.DEEPSEEK_API_BASE}/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {self.config.DEEPSEEK_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": self.config.DEEPSEEK_MODEL,
-                "messages": messages,
-                "temperature": 0.3  # 使用较低温度以获得更稳定的评估
-            }
-        elif platform.lower() == 'openai':
-            url = f"{self.config.OPENAI_API_BASE}/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {self.config.OPENAI_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": self.config.OPENAI_MODEL,
-                "messages": messages,
-                "temperature": 0.3
-            }
-        elif platform.lower() == 'aizex':
-            # 处理URL，避免重复路径
-            base_url = self.config.AIZEX_API_BASE.rstrip('/')
-            if base_url.endswith('/chat/completions'):
-                url = base_url
-            else:
-                url = f"{base_url}/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {self.config.AIZEX_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": self.config.AIZEX_MODEL,
-                "messages": messages,
-                "temperature": 0.3
-            }
-        else:
-            raise ValueError(f"不支持的API平台: {platform}")
-        
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = self.session.post(url, headers=headers, json=data, timeout=30)
         response.raise_for_status()
         result = response.json()
         return result['choices'][0]['message']['content']
     
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """获取当前事件循环的并发信号量"""
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._sem_loop is not loop:
+            self._sem = asyncio.Semaphore(self.config.CONSISTENCY_CHECK_MAX_CONCURRENCY)
+            self._sem_loop = loop
+        return self._sem
+    
+    async def _call_api_async(self, messages: List[Dict], platform: str = None) -> str:
+        """
+        _call_api 的异步版本：网络等待在线程中进行，多个检测可用 asyncio.gather 并发
+        
+        同时进行中的请求数不超过 CONSISTENCY_CHECK_MAX_CONCURRENCY，避免触发平台限流。
+        """
+        async with self._get_semaphore():
+            return await asyncio.to_thread(self._call_api, messages, platform)
+    
     def check_consistency(self, character_description: str, 
                          character_attributes: Dict,
                          user_message: str,
@@ -134,77 +211,202 @@ class ConsistencyChecker:
         Returns:
             (一致性评分 0-1, 反馈文本)
         """
-        if not self.config.CONSISTENCY_CHECK_ENABLED:
+        if not self._enabled:
             return None, None
+        character_attributes = _dump_attributes(character_attributes)
+        cache_key = self._score_cache_key(character_description, character_attributes, user_message,
+                                          latest_response, platform, theme, save_step)
+        cached = self._get_cached_score(cache_key)
+        if cached is not None:
+            return cached
+        messages = self._build_check_messages(character_description, character_attributes,
+                                              user_message, latest_response, theme, save_step)
+        try:
+            result_text = self._call_api(messages, platform)
+            result = self._parse_check_result(result_text)
+        except Exception as e:
+            # 如果解析失败，返回默认值
+            return 0.5, f"检测过程中出现错误: {str(e)}"
+        self._store_score(cache_key, result)
+        return result
+    
+    async def check_consistency_async(self, character_description: str,
+                                      character_attributes: Dict,
+                                      user_message: str,
+                                      latest_response: str,
+                                      platform: str = None,
+                                      theme: str = "default",
+                                      save_step: Optional[str] = None) -> Tuple[float, str]:
+        """check_consistency 的异步版本，参数与返回值相同"""
+        if not self._enabled:
+            return None, None
+        character_attributes = _dump_attributes(character_attributes)
+        cache_key = self._score_cache_key(character_description, character_attributes, user_message,
+                                          latest_response, platform, theme, save_step)
+        cached = self._get_cached_score(cache_key)
+        if cached is not None:
+            return cached
+        messages = await self._build_check_messages_async(character_description, character_attributes,
+                                                          user_message, latest_response, theme, save_step)
+        try:
+            result_text = await self._call_api_async(messages, platform)
+            result = self._parse_check_result(result_text)
+        except Exception as e:
+            return 0.5, f"检测过程中出现错误: {str(e)}"
+        self._store_score(cache_key, result)
+        return result
+    
+    async def _load_attr_guide_async(self, theme: str) -> str:
+        """_load_attr_guide 的异步版本，文件读取在线程中进行"""
+        return await asyncio.to_thread(self._load_attr_guide, theme)
+    
+    async def _load_scene_async(self, theme: str, save_step: Optional[str] = None) -> Optional[str]:
+        """_load_scene 的异步版本，文件读取在线程中进行"""
+        return await asyncio.to_thread(self._load_scene, theme, save_step)
+    
+    def _format_input_fields(self, character_description: str, character_attributes: Union[Dict, str],
+                             attr_guide: str, scene_content: Optional[str]) -> Dict[str, str]:
+        """提示词输入部分（人物卡、属性说明、场景）的填充内容"""
+        return {
+            "character_description": character_description,
+            "character_attributes": _dump_attributes(character_attributes),
+            "attr_guide": attr_guide,
+            "scene_block": f"\n**【场景】**\n{scene_content}" if scene_content else "",
+        }
+    
+    def _prompt_input_fields(self, character_description: str, character_attributes: Union[Dict, str],
+                             theme: str = "default", save_step: Optional[str] = None) -> Dict[str, str]:
+        """读取属性说明和场景，返回提示词输入部分的填充内容"""
         theme = theme or "default"
-        attr_guide = self._load_attr_guide(theme)
-        scene_content = self._load_scene(theme, save_step)
+        return self._format_input_fields(character_description, character_attributes,
+                                         self._load_attr_guide(theme), self._load_scene(theme, save_step))
+    
+    def _build_check_messages(self, character_description: str, character_attributes: Union[Dict, str],
+                              user_message: str, latest_response: str,
+                              theme: str = "default", save_step: Optional[str] = None) -> List[Dict]:
+        """构建一致性检测的消息列表"""
+        # 构建检测提示词（固定部分为模块常量，只填入可变内容）
+        check_prompt = _CHECK_PROMPT_TEMPLATE.format(
+            **self._prompt_input_fields(character_description, character_attributes, theme, save_step),
+            user_message=user_message,
+            latest_response=latest_response,
+        )
         
-        # 构建检测提示词
-        check_prompt = f"""# Role: 一致性检测器 (Consistency Checker)
-
-评估角色回复是否符合设定。
-
----
-
-### 1. 输入信息 (Input)
-
-**【人物卡】**
-- 描述: {character_description}
-- 属性: {json.dumps(character_attributes, ensure_ascii=False)}
-**【属性说明】**
-{attr_guide}
-{'\n**【场景】**\n' + scene_content if scene_content else ''}
-
-**【对话】**
-- 用户: {user_message}
-- 角色: {latest_response}
-
----
-
-### 2. 评估要求 (Evaluation Requirements)
-
-评估以下方面：
-1. **性格设定**: 是否符合角色性格特点
-2. **场景状态**: 是否符合当前场景状态
-3. **违和感**: 是否有违和感或不一致的地方
-
----
-
-### 3. 输出格式 (Output Format)
-
-输出JSON格式：
-{{
-    "score": 0.95,
-    "feedback": "反馈内容"
-}}
-"""
+        return [{"role": "user", "content": check_prompt}]
+    
+    async def _build_check_messages_async(self, character_description: str, character_attributes: Union[Dict, str],
+                                          user_message: str, latest_response: str,
+                                          theme: str = "default",
+                                          save_step: Optional[str] = None) -> List[Dict]:
+        """_build_check_messages 的异步版本：属性说明和场景文件在线程中并发读取，不阻塞事件循环"""
+        theme = theme or "default"
+        attr_guide, scene_content = await asyncio.gather(
+            self._load_attr_guide_async(theme), self._load_scene_async(theme, save_step)
+        )
+        check_prompt = _CHECK_PROMPT_TEMPLATE.format(
+            **self._format_input_fields(character_description, character_attributes, attr_guide, scene_content),
+            user_message=user_message,
+            latest_response=latest_response,
+        )
+        
+        return [{"role": "user", "content": check_prompt}]
+    
+    def _build_batch_check_messages(self, character_description: str, character_attributes: Union[Dict, str],
+                                    dialogues: List[Tuple[str, str]],
+                                    theme: str = "default", save_step: Optional[str] = None) -> List[Dict]:
+        """构建批量一致性检测的消息列表（同一人物卡的多组对话）"""
+        numbered = json_utils.dumps([
+            {"idx": idx, "user": user_message, "reply": latest_response}
+            for idx, (user_message, latest_response) in enumerate(dialogues)
+        ], indent=True)
+        check_prompt = _BATCH_CHECK_PROMPT_TEMPLATE.format(
+            **self._prompt_input_fields(character_description, character_attributes, theme, save_step),
+            dialogues=numbered,
+        )
+        
+        return [{"role": "user", "content": check_prompt}]
+    
+    def check_consistency_batch(self, character_description: str,
+                                character_attributes: Dict,
+                                dialogues: List[Tuple[str, str]],
+                                platform: str = None,
+                                theme: str = "default",
+                                save_step: Optional[str] = None) -> List[Tuple[float, str]]:
+        """
+        批量检测同一角色的多组对话，合并为一次请求（共享人物卡和场景部分）
         
-        messages = [{"role": "user", "content": check_prompt}]
+        对话数超过 BATCH_CHECK_MAX_SIZE 时改为逐条并发检测，避免单次生成过长；
+        合并请求的结果缺失某条时，该条单独重新检测。
         
+        Args:
+            dialogues: [(用户消息, 角色回复), ...]
+            其余参数同 check_consistency
+        
+        Returns:
+            与 dialogues 顺序一致的 (一致性评分, 反馈文本) 列表
+        """
+        if not self._enabled:
+            return [(None, None)] * len(dialogues)
+        character_attributes = _dump_attributes(character_attributes)
+        if len(dialogues) <= 1:
+            return [self.check_consistency(character_description, character_attributes,
+                                           user_message, latest_response, platform, theme, save_step)
+                    for user_message, latest_response in dialogues]
+        if len(dialogues) > BATCH_CHECK_MAX_SIZE:
+            # 在线程池中逐条检测（不依赖事件循环，调用方已有运行中的事件循环时同样可用）
+            def _check_one(dialogue: Tuple[str, str]) -> Tuple[float, str]:
+                user_message, latest_response = dialogue
+                return self.check_consistency(character_description, character_attributes,
+                                              user_message, latest_response, platform, theme, save_step)
+            max_workers = max(1, min(self.config.CONSISTENCY_CHECK_MAX_CONCURRENCY, len(dialogues)))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(_check_one, dialogues))
+        
+        messages = self._build_batch_check_messages(character_description, character_attributes,
+                                                    dialogues, theme, save_step)
         try:
             result_text = self._call_api(messages, platform)
-            
-            # 尝试解析JSON结果
-            # 如果结果包含代码块，提取JSON部分
-            if "```json" in result_text:
-                json_start = result_text.find("```json") + 7
-                json_end = result_text.find("```", json_start)
-                result_text = result_text[json_start:json_end].strip()
-            elif "```" in result_text:
-                json_start = result_text.find("```") + 3
-                json_end = result_text.find("```", json_start)
-                result_text = result_text[json_start:json_end].strip()
-            
-            result = json.loads(result_text)
-            score = float(result.get('score', 0.5))
-            feedback = result.get('feedback', '')
-            
-            # 确保评分在0-1范围内
-            score = max(0.0, min(1.0, score))
-            
-            return score, feedback
+            results = self._parse_batch_check_result(result_text, len(dialogues))
         except Exception as e:
-            # 如果解析失败，返回默认值
-            return 0.5, f"检测过程中出现错误: {str(e)}"
-
+            return [(0.5, f"检测过程中出现错误: {str(e)}")] * len(dialogues)
+        
+        for idx, result in enumerate(results):
+            user_message, latest_response = dialogues[idx]
+            if result is None:
+                results[idx] = self.check_consistency(character_description, character_attributes,
+                                                      user_message, latest_response, platform,
+                                                      theme, save_step)
+            else:
+                self._store_score(self._score_cache_key(character_description, character_attributes,
+                                                        user_message, latest_response, platform,
+                                                        theme, save_step), result)
+        return results
+    
+    def _extract_json_text(self, result_text: str) -> str:
+        """如果结果包含代码块或说明文字，提取其中的JSON部分"""
+        return json_utils.extract_json_block(result_text)
+    
+    def _parse_check_result(self, result_text: str) -> Tuple[float, str]:
+        """解析检测结果，返回 (评分, 反馈)"""
+        result = json_utils.loads(self._extract_json_text(result_text))
+        score = float(result.get('score', 0.5))
+        feedback = result.get('feedback', '')
+        
+        # 确保评分在0-1范围内
+        score = max(0.0, min(1.0, score))
+        
+        return score, feedback
+    
+    def _parse_batch_check_result(self, result_text: str, count: int) -> List[Optional[Tuple[float, str]]]:
+        """解析批量检测结果，按 idx 放回对应位置，缺失的位置为None"""
+        result = json_utils.loads(self._extract_json_text(result_text))
+        results: List[Optional[Tuple[float, str]]] = [None] * count
+        for item in result.get('results', []):
+            try:
+                idx = int(item['idx'])
+                score = max(0.0, min(1.0, float(item.get('score', 0.5))))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                continue
+            if 0 <= idx < count and results[idx] is None:
+                results[idx] = (score, item.get('feedback', ''))
+        return results
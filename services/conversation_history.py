@@ -2,9 +2,9 @@
 对话历史管理：保存和加载最近N个步骤的指令和摘要
 """
 import os
-import json
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from config import Config
+from services import json_utils
 
 
 class ConversationHistory:
@@ -13,6 +13,10 @@ class ConversationHistory:
     def __init__(self, config: Config):
         self.config = config
         self.base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+        # HISTORY.json 解析缓存：{文件路径: (修改时间, 最后一条记录)}
+        self._history_cache: Dict[str, Tuple[int, Optional[Dict]]] = {}
+        # 步骤目录索引：{主题: (步骤目录修改时间, 排好序的步骤列表)}
+        self._steps_index: Dict[str, Tuple[int, List[str]]] = {}
     
     def save_conversation(self, theme: str, step: str, instruction: str, summary: str) -> bool:
         """
@@ -48,8 +52,10 @@ class ConversationHistory:
             }
             
             # 保存（每个步骤只有一条记录）
-            with open(history_file, "w", encoding="utf-8") as f:
-                json.dump([record], f, ensure_ascii=False, indent=2)
+            with open(history_file, "wb") as f:
+                f.write(json_utils.dump_bytes([record], indent=True))
+            self._history_cache.pop(history_file, None)
+            self._steps_index.pop(theme, None)
             
             return True
         except Exception as e:
@@ -70,27 +76,12 @@ class ConversationHistory:
         """
         history_list = []
         
-        # 获取所有步骤
+        # 获取所有步骤（已按步骤号排序）
         steps_dir = os.path.join(self.base_dir, self.config.SAVE_DIR, theme)
-        if not os.path.exists(steps_dir):
+        all_steps = self._list_steps(theme, steps_dir)
+        if all_steps is None:
             return history_list
         
-        # 获取所有步骤并排序
-        all_steps = []
-        for item in os.listdir(steps_dir):
-            item_path = os.path.join(steps_dir, item)
-            if os.path.isdir(item_path) and item.endswith("_step"):
-                all_steps.append(item)
-        
-        # 按步骤号排序
-        def step_key(step):
-            try:
-                return int(step.replace("_step", ""))
-            except ValueError:
-                return 999999
-        
-        all_steps = sorted(all_steps, key=step_key)
-        
         # 找到当前步骤的位置
         try:
             current_index = all_steps.index(current_step)
@@ -103,19 +94,66 @@ class ConversationHistory:
         
         # 加载每个步骤的历史
         for step in steps_to_load:
-            history_file = os.path.join(steps_dir, step, "HISTORY.json")
-            if os.path.exists(history_file):
-                try:
-                    with open(history_file, "r", encoding="utf-8") as f:
-                        step_history = json.load(f)
-                        # 取最后一条记录（该步骤的指令和摘要）
-                        if step_history:
-                            history_list.append(step_history[-1])
-                except:
-                    pass
+            record = self._load_step_record(os.path.join(steps_dir, step, "HISTORY.json"))
+            if record is not None:
+                history_list.append(record)
         
         return history_list
     
+    def _list_steps(self, theme: str, steps_dir: str) -> Optional[List[str]]:
+        """
+        列出主题下所有步骤目录并按步骤号排序，目录不存在时返回None
+        
+        结果按目录修改时间缓存：新增/删除步骤目录会改变目录的修改时间。
+        """
+        try:
+            mtime_ns = os.stat(steps_dir).st_mtime_ns
+        except OSError:
+            return None
+        
+        cached = self._steps_index.get(theme)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        
+        # 按步骤号排序
+        def step_key(step):
+            try:
+                return int(step.replace("_step", ""))
+            except ValueError:
+                return 999999
+        
+        with os.scandir(steps_dir) as entries:
+            all_steps = sorted(
+                (entry.name for entry in entries if entry.name.endswith("_step") and entry.is_dir()),
+                key=step_key
+            )
+        self._steps_index[theme] = (mtime_ns, all_steps)
+        return all_steps
+    
+    def _load_step_record(self, history_file: str) -> Optional[Dict]:
+        """
+        读取步骤的历史记录（最后一条，即该步骤的指令和摘要）
+        
+        已写入的步骤基本不再变化，解析结果按文件修改时间缓存。
+        """
+        try:
+            mtime_ns = os.stat(history_file).st_mtime_ns
+        except OSError:
+            return None  # 该步骤没有历史记录
+        
+        cached = self._history_cache.get(history_file)
+        if cached is None or cached[0] != mtime_ns:
+            try:
+                with open(history_file, "rb") as f:
+                    step_history = json_utils.loads(f.read())
+            except (OSError, ValueError):
+                return None
+            cached = (mtime_ns, step_history[-1] if step_history else None)
+            self._history_cache[history_file] = cached
+        
+        record = cached[1]
+        return dict(record) if record is not None else None
+    
     def get_history_text(self, history_list: List[Dict]) -> str:
         """
         将历史列表转换为文本格式（用于prompt）
@@ -129,14 +167,11 @@ class ConversationHistory:
         if not history_list:
             return ""
         
-        lines = ["【对话历史（最近5个步骤）】"]
-        for i, record in enumerate(history_list, 1):
-            step = record.get('step', '未知')
-            instruction = record.get('instruction', '')
-            summary = record.get('summary', '')
-            lines.append(f"\n步骤 {step}:")
-            lines.append(f"  玩家指令: {instruction}")
-            lines.append(f"  摘要: {summary}")
-        
-        return "\n".join(lines)
+        # 每条记录一次格式化为完整段落，再整体拼接
+        return "【对话历史（最近5个步骤）】" + "".join(
+            f"\n\n步骤 {record.get('step', '未知')}:"
+            f"\n  玩家指令: {record.get('instruction', '')}"
+            f"\n  摘要: {record.get('summary', '')}"
+            for record in history_list
+        )
 
@@ -1,64 +1,122 @@
 """
-对话记录存储服务：使用JSON文件存储对话历史
+对话记录存储服务：使用JSON Lines文件存储对话历史（每行一条记录，追加写入）
 """
-import json
+import asyncio
 import os
+import threading
+from collections import deque
 from datetime import datetime
 from typing import List, Dict, Optional
 from config import Config
+from services import json_utils
+
+# 超过该大小的记录文件在按数量读取时从文件末尾向前分块读取，不再逐行扫描整个文件
+TAIL_READ_THRESHOLD = 1 << 20
+TAIL_READ_BLOCK = 64 * 1024
 
 
 class ConversationStore:
-    """对话记录存储（JSON文件）"""
+    """对话记录存储（JSON Lines文件）"""
     
     def __init__(self, config: Config):
         self.config = config
         self.base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "conversations"))
         os.makedirs(self.base_dir, exist_ok=True)
+        # 每个角色的记录条数（用于生成id），首次写入时统计一次
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
     
     def _get_file_path(self, character_id: str) -> str:
         """获取对话记录文件路径"""
-        return os.path.join(self.base_dir, f"{character_id}.json")
+        return os.path.join(self.base_dir, f"{character_id}.jsonl")
+    
+    def _migrate_legacy_file(self, character_id: str):
+        """把旧格式（整个JSON数组）的记录文件转换为JSON Lines格式"""
+        legacy_path = os.path.join(self.base_dir, f"{character_id}.json")
+        file_path = self._get_file_path(character_id)
+        try:
+            with open(legacy_path, "rb") as f:
+                conversations = json_utils.loads(f.read())
+        except (OSError, ValueError):
+            return
+        if os.path.exists(file_path):
+            return
+        
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(json_utils.dump_bytes(c) + b"\n" for c in conversations))
+        os.replace(tmp_path, file_path)
+        os.remove(legacy_path)
+    
+    def _count_records(self, file_path: str) -> int:
+        """统计记录文件中的记录条数"""
+        try:
+            with open(file_path, "rb") as f:
+                return sum(1 for line in f if line.strip())
+        except OSError:
+            return 0
+    
+    def _read_tail_lines(self, f, limit: int) -> List[bytes]:
+        """读取文件末尾的limit行（大文件从末尾向前分块读取，只读到足够的行数为止）"""
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        if pos <= TAIL_READ_THRESHOLD:
+            f.seek(0)
+            return list(deque(f, maxlen=limit))
+        
+        buffer = b""
+        while pos > 0 and buffer.count(b"\n") <= limit:
+            size = min(TAIL_READ_BLOCK, pos)
+            pos -= size
+            f.seek(pos)
+            buffer = f.read(size) + buffer
+        lines = buffer.splitlines()
+        if pos > 0:
+            lines = lines[1:]  # 第一行可能只读到了一部分
+        return lines[-limit:]
     
     def save_conversation(self, character_id: str, user_message: str, 
                          character_response: str, consistency_score: Optional[float] = None,
                          consistency_feedback: Optional[str] = None) -> Dict:
         """
-        保存对话记录
+        保存对话记录（追加一行，不重写已有记录）
         
         Returns:
             保存的对话记录
         """
         file_path = self._get_file_path(character_id)
         
-        # 读取现有记录
-        conversations = []
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    conversations = json.load(f)
-            except Exception:
-                conversations = []
-        
-        # 添加新记录
-        conversation = {
-            "id": len(conversations) + 1,
-            "character_id": character_id,
-            "user_message": user_message,
-            "character_response": character_response,
-            "consistency_score": consistency_score,
-            "consistency_feedback": consistency_feedback,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        
-        conversations.append(conversation)
-        
-        # 保存到文件
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(conversations, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            count = self._counts.get(character_id)
+            if count is None:
+                self._migrate_legacy_file(character_id)
+                count = self._count_records(file_path)
+            
+            # 添加新记录
+            conversation = {
+                "id": count + 1,
+                "character_id": character_id,
+                "user_message": user_message,
+                "character_response": character_response,
+                "consistency_score": consistency_score,
+                "consistency_feedback": consistency_feedback,
+                "created_at": datetime.utcnow().isoformat()
+            }
+            
+            # 追加到文件
+            with open(file_path, "ab") as f:
+                f.write(json_utils.dump_bytes(conversation) + b"\n")
+            self._counts[character_id] = count + 1
         
         return conversation
     
+    async def save_conversation_async(self, character_id: str, user_message: str,
+                                      character_response: str, consistency_score: Optional[float] = None,
+                                      consistency_feedback: Optional[str] = None) -> Dict:
+        """save_conversation 的异步版本：文件写入在线程中进行，不阻塞事件循环"""
+        return await asyncio.to_thread(self.save_conversation, character_id, user_message,
+                                       character_response, consistency_score, consistency_feedback)
+    
     def get_conversations(self, character_id: str, limit: Optional[int] = None) -> List[Dict]:
         """
         获取对话历史
@@ -70,21 +128,19 @@ class ConversationStore:
         Returns:
             对话记录列表（按时间倒序）
         """
+        if character_id not in self._counts:
+            with self._lock:
+                self._migrate_legacy_file(character_id)
         file_path = self._get_file_path(character_id)
         
-        if not os.path.exists(file_path):
-            return []
-        
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                conversations = json.load(f)
+            with open(file_path, "rb") as f:
+                # 记录按时间顺序追加，有限制时只读取文件末尾的limit行
+                lines = self._read_tail_lines(f, limit) if limit else f.readlines()
+            conversations = [json_utils.loads(line) for line in lines if line.strip()]
             
             # 按时间倒序排序
             conversations.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-            
-            if limit:
-                return conversations[:limit]
             return conversations
         except Exception:
             return []
-
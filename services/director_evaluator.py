@@ -1,22 +1,455 @@
 """
 导演评估器：LLM作为导演评估当前状态，决定事件触发和场景转换
 """
+import asyncio
+import copy
+import functools
 import json
-import re
-from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 from config import Config
-from services.chat_service import ChatService
+from services import json_utils
+from services.chat_service import get_default_chat_service
 from services.agent import format_agent_response
 
+# 导演评估的固定指令（角色、任务流程、输出格式），作为第一条系统消息，所有回合完全相同
+_DIRECTOR_INSTRUCTIONS = """# Role: 游戏剧情导演 (Game Director)
+
+你负责推进游戏剧情，处理环境变化并制定游戏进程决策。
+**核心指令：这是一个单次 LLM 调用，你必须严格按照顺序完成两个阶段的任务：【阶段一：多角色判定与模拟】 -> 【阶段二：全局决策】。**
+
+输入上下文分两部分在后续消息中给出：【场景与隐藏信息】（场景不变时保持不变）和【本回合输入】。
+
+---
+
+### 1. 任务流程 (Workflow)
+
+请在同一个 JSON 输出中，依次完成以下两个阶段的思考与生成：
+
+#### 阶段一：环境变化分析 (Environment Analysis)
+**目标**：遍历处理**所有** Agent 的行为结果，并更新环境描述。
+
+1.  **多角色动作执行判定 (Batch Adjudication)**：
+    * **必须遍历列表中的每一个 Agent**，不要遗漏。
+    * 读取每个 Agent 的 `action_intent`。
+    * **判定逻辑**：根据环境限制（如锁、障碍、敌人数量）判定 `success` (true/false)。
+    * **填写 output**：在 `agent_execution_results` 数组中为**每一个** Agent 生成对应的结果对象。
+2.  **场景描述重绘**:
+    * 更新 `updated_scene_description`。
+    * **综合叙事**：必须将**所有** Agent 的对话和动作结果融合在一起，形成一段连贯的群像描写。
+3.  **决策点与进度**:
+    * 如果发现线索/异常、或需要玩家做出选择，在 `decision_points` 中标记决策点并列出选项。
+    * 在 `status_summary` 中概括当前目标的进展，并给出下一步建议。
+
+#### 阶段二：决策制定 (Director Decision)
+**目标**：基于全局状态，决定唯一的下一步流向。
+
+**A. 意图与阻断检查**
+    * 检查**任意** Agent 是否表达了移动/转场意图。
+    * **逻辑阻断**：如果转场需要前置条件（如“全队集合”或“开门”），且相关动作在阶段一中失败，则**阻止转场**（`transition_target: null`）。
+
+**B. 优先级规则 (事件互斥逻辑)**
+    * **规则 1 (单事件触发 - 最高优先级)**：检查 `【可能事件列表】`。
+        * **唯一性原则**：即使满足多个事件的条件，**同时也只能触发一个事件**。
+        * **筛选标准**：优先选择剧情优先级最高、或与当前玩家行为最相关的**这一个**事件 ID 填入 `trigger_event`。
+    * **规则 2 (转场)**：如果没有触发事件，且意图明确、地点可达、动作判定成功，填入 `transition_target`。
+    * **规则 3 (原地)**：以上皆不满足，保持在当前场景。
+
+**C. 怪物生成 (多实体支持)**
+    * 检查 `【潜在怪物列表】`。
+    * 如果剧情需要战斗（如遭遇埋伏、进入巢穴），可以从列表中选择**一个或多个**怪物。
+    * *示例*：可以同时选择 "Goblin_Archer" 和 "Goblin_Warrior" 组成混合编队。
+    * 将选中的所有怪物 ID/名称填入 `appear_monster` 列表。
+
+---
+
+### 2. 输出格式 (Output Format)
+
+必须输出为严格的 JSON 格式，`appear_monster` 必须为列表。
+
+```json
+{
+  "environment_analysis": {
+    "updated_scene_description": "融合了多角色对话、多动作判定结果和NPC反应的完整群像剧情描述",
+    "scene_state_changes": {
+      "location": "当前位置",
+      "time": "时间变化描述，无变化则为 null",
+      "weather": "天气变化描述，无变化则为 null"
+    },
+    "hidden": {
+      "final_goal": "最终目标（仅导演可见）",
+      "potential_enemies": "潜在敌人",
+      "risk_hints": "风险提示"
+    },
+    "major_events": ["本回合发生的重大事件（具体、有画面感），没有则为空列表"],
+    "agent_execution_results": [
+      {
+        "character_id": "角色ID_1",
+        "character_name": "角色名_1",
+        "execution_result": {
+          "success": true,
+          "failure_reason": "失败原因，成功则为 null",
+          "actual_outcome": "动作的实际结果描述"
+        }
+      },
+      ...可能有多个Agent响应
+    ],
+    "decision_points": {"has_decision": false, "description": "需要玩家选择的情况，没有则为空", "options": ["选项1", "选项2"]},
+    "status_summary": {"goal_progress": "当前目标的进展", "next_suggestions": ["下一步建议"]}
+  },
+  "director_decision": {
+    "trigger_event": "唯一的事件ID 或 null (严格互斥)",
+    "event_description": "事件描述文本",
+    "appear_monster": ["怪物ID_1", "怪物ID_2", ...可能有多个怪物], 
+    "monster_description": "描述所有登场怪物的出场画面（如：一只巨魔撞破大门，身后跟着两只狂叫的地精）",
+    "transition_target": "目标场景ID 或 null",
+    "transition_type": "scene 或 room",
+    "elapsed_time": 5.0,
+    "reasoning": "决策链思维：多角色动作判定 -> 事件互斥筛选 -> 怪物编队选择 -> 最终决定"
+  }
+}
+"""
+
+_DIRECTOR_USER_INSTRUCTION = "请作为导演，先完成环境变化分析，然后基于分析结果做出决策。"
+
+# 批量评估时追加的说明（多个回合合并到一次调用）
+_DIRECTOR_BATCH_INSTRUCTION = """### 批量评估 (Batch)
+
+本次请求包含多个相互独立的回合（## Turn 0、## Turn 1 ...），每个回合有各自的场景与隐藏信息和本回合输入。
+请对每个回合分别完成上述两个阶段，不要混用不同回合的信息。输出一个 JSON 对象：
+
+```json
+{
+  "turns": [
+    {"turn": 0, "environment_analysis": {...}, "director_decision": {...}},
+    ...每个回合一项
+  ]
+}
+```
+
+turn 与回合编号一致，每项中 environment_analysis 和 director_decision 的结构与单回合输出格式相同。
+"""
+
+# 场景级上下文模板：同一场景/房间内各回合基本不变，放在固定指令之后形成稳定前缀
+_SCENE_CONTEXT_TEMPLATE = """### 场景与隐藏信息 (Scene Context)
+
+**【场景描述 (玩家可见)】**
+{surface_desc}
+
+**【隐藏信息 (仅导演可见)】**
+- **可能事件列表**: {events_text}
+- **潜在怪物列表**: {monsters_text}
+- **可连接目标**: {targets_text}
+"""
+
+# 本回合输入模板：每回合都会变化，放在最后
+_TURN_CONTEXT_TEMPLATE = """### 本回合输入 (Turn Context)
+
+**【当前场景状态】**
+{scene_state_text}
+**【时间信息】**
+{time_info_text} | {enter_time_text}
+**【事件状态】**
+{event_state_text}
+
+**【玩家指令】**
+{player_instruction}
+
+**【Agent 响应数据 (多角色列表)】**
+*注意：这里包含**一个或多个** Agent 的响应。每个响应包含 `dialogue` (事实) 和 `action_intent` (待判定的尝试)。*
+{agent_responses_text}
+
+**【角色状态】**
+{character_states_text}"""
+
+# JSON修复：导演响应无法解析时，把原文交给一次短小的修复调用，保留已生成的决策
+_DIRECTOR_REPAIR_INSTRUCTION = """下面是一段应为 JSON 的导演评估输出，但格式有误（可能有多余文字、缺少引号或括号、被截断等）。
+请把它修复为严格的 JSON 对象，只输出 JSON，不要添加任何解释。保留原有内容，不要改写含义。
+
+结构：
+{"environment_analysis": {"updated_scene_description": str, "scene_state_changes": {}, "hidden": {},
+  "major_events": [str], "agent_execution_results": [],
+  "decision_points": {"has_decision": bool, "description": str, "options": [str]},
+  "status_summary": {"goal_progress": str, "next_suggestions": [str]}},
+ "director_decision": {"trigger_event": str|null, "event_description": str, "appear_monster": [str],
+  "monster_description": str, "transition_target": str|null, "transition_type": "scene"|"room",
+  "elapsed_time": number, "reasoning": str}}"""
+
+# JSON模式：接口保证返回一个合法的JSON对象（不带代码块和说明文字）
+_JSON_OBJECT_FORMAT = {"type": "json_object"}
+
+# 提示词中的JSON使用紧凑分隔符（LLM不需要缩进，减少token）
+_COMPACT = (',', ':')
+
+# 导演结果的默认字段（只读模板，填充时复制可变值）
+_DEFAULT_ENVIRONMENT_ANALYSIS = {
+    "updated_scene_description": "",
+    "scene_state_changes": {},
+    "hidden": {},
+    "major_events": [],
+    "agent_execution_results": []
+}
+_DEFAULT_DIRECTOR_DECISION = {
+    "trigger_event": None,
+    "event_description": "",
+    "appear_monster": [],
+    "monster_description": "",
+    "transition_target": None,
+    "transition_type": "scene",
+    "elapsed_time": 1.0,
+    "reasoning": ""
+}
+
+
+def _fill_defaults(target: Dict, defaults: Dict):
+    """补全缺失的字段（可变的默认值复制后再放入，避免多个结果共享同一对象）"""
+    for key, value in defaults.items():
+        if key not in target:
+            target[key] = copy.copy(value)
+
+
+def _default_director_result(reasoning: str) -> Dict:
+    """评估或解析失败时返回的默认导演结果"""
+    result = {
+        "environment_analysis": copy.deepcopy(_DEFAULT_ENVIRONMENT_ANALYSIS),
+        "director_decision": copy.deepcopy(_DEFAULT_DIRECTOR_DECISION)
+    }
+    result["director_decision"]["reasoning"] = reasoning
+    return result
+
+
+def _preview(text, limit: int) -> str:
+    """截取预览文本，只有确实被截断时才加省略号（按字符截取，中文文本没有空格可供断词）"""
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _clip_middle(text: str, limit: int) -> str:
+    """
+    把过长的文本截到 limit 个字符以内：保留开头（设定）和更长的结尾（最近的叙述），中间用省略号代替
+    
+    limit 不大于0时不截断。
+    """
+    if limit <= 0 or not isinstance(text, str) or len(text) <= limit:
+        return text
+    marker = "\n...\n"
+    keep = limit - len(marker)
+    if keep <= 0:
+        return text[-limit:]
+    head = keep * 2 // 5
+    return text[:head] + marker + text[len(text) - (keep - head):]
+
+
+def _freeze(items: List[Dict]) -> str:
+    """把列表/字典序列化为JSON文本，作为渲染缓存的键（保留键顺序，渲染结果与原数据一致）"""
+    return json.dumps(items, ensure_ascii=False, default=str)
+
+
+@functools.lru_cache(maxsize=256)
+def _render_events(events_json: str, triggered_ids: frozenset) -> str:
+    """渲染潜在事件列表文本（区分核心事件和随机事件，标记已触发状态）"""
+    potential_events = json.loads(events_json)
+    core_events = []
+    random_events = []
+    
+    for i, event in enumerate(potential_events, 1):
+        event_id = event.get('id', '')
+        # 从JSON加载的事件使用type字段，旧格式使用event_type字段
+        event_type = event.get('type') or event.get('event_type') or 'random'
+        event_name = event.get('name', '未知')
+        event_description = event.get('description', '')
+        trigger_conditions = event.get('trigger_conditions', {})
+        
+        # 检查事件是否已触发
+        is_triggered = event_id in triggered_ids if event_id else False
+        status_mark = " [已触发]" if is_triggered else " [未触发]"
+        
+        event_info = [f"\n事件{i}: {event_name} (ID: {event_id}){status_mark}"]
+        if event_type == "core":
+            event_info.append(" [核心事件]")
+        else:
+            event_info.append(" [随机事件]")
+        
+        # 添加简单介绍
+        if event_description:
+            event_info.append(f"\n  简介: {event_description}")
+        
+        # 添加触发条件（简化显示）
+        if trigger_conditions:
+            conditions_summary = []
+            if trigger_conditions.get("time_condition"):
+                conditions_summary.append(f"时间: {trigger_conditions['time_condition']}")
+            if trigger_conditions.get("behavior_condition"):
+                conditions_summary.append(f"行为: {_preview(trigger_conditions['behavior_condition'], 50)}")
+            if trigger_conditions.get("state_condition") and trigger_conditions.get("state_condition") != "无特殊要求":
+                conditions_summary.append(f"状态: {trigger_conditions['state_condition']}")
+            if trigger_conditions.get("random_factor"):
+                conditions_summary.append(f"随机: {trigger_conditions['random_factor']}")
+            
+            if conditions_summary:
+                event_info.append(f"\n  触发条件: {' | '.join(conditions_summary)}")
+        
+        # 添加描述模板（简要）
+        description_template = event.get('description_template', '')
+        if description_template:
+            event_info.append(f"\n  描述预览: {_preview(description_template, 100)}")
+        
+        if event_type == "core":
+            core_events.extend(event_info)
+        else:
+            random_events.extend(event_info)
+    
+    parts = []
+    if core_events:
+        parts.append("\n【核心事件】（可以转换状态和推进剧本阶段）:")
+        parts.extend(core_events)
+    if random_events:
+        parts.append("\n【随机事件】（如遭遇战、发现财宝等，不触发场景转换）:")
+        parts.extend(random_events)
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=256)
+def _render_monsters(monsters_json: str) -> str:
+    """渲染潜在怪物列表文本（从怪物卡加载）"""
+    potential_monsters = json.loads(monsters_json)
+    parts = []
+    for i, monster in enumerate(potential_monsters, 1):
+        monster_id = monster.get('id', '未知')
+        monster_name = monster.get('name', '未知')
+        monster_type = monster.get('type', '')
+        monster_level = monster.get('level', '')
+        monster_desc = monster.get('description', '')
+        attributes = monster.get('attributes', {})
+        appearance_conditions = monster.get('appearance_conditions', {})
+        battle_template = monster.get('battle_description_template', '')
+        battle_effects = monster.get('battle_effects', {})
+        director_hints = monster.get('director_hints', {})
+        
+        parts.append(f"\n怪物{i}: {monster_name} (ID: {monster_id})\n")
+        parts.append(f"  类型: {monster_type}\n")
+        parts.append(f"  等级/难度: {monster_level}\n")
+        parts.append(f"  描述: {monster_desc}\n")
+        if attributes:
+            parts.append(f"  属性: HP={attributes.get('hp', 'N/A')}, 攻击={attributes.get('attack', 'N/A')}, 防御={attributes.get('defense', 'N/A')}\n")
+            if attributes.get('special_abilities'):
+                parts.append(f"  特殊能力: {', '.join(attributes.get('special_abilities', []))}\n")
+        if appearance_conditions:
+            parts.append(f"  出现条件: {json.dumps(appearance_conditions, ensure_ascii=False, separators=_COMPACT)}\n")
+        if battle_template:
+            parts.append(f"  战斗描述模板: {battle_template}\n")
+        if battle_effects:
+            parts.append(f"  战斗影响: {json.dumps(battle_effects, ensure_ascii=False, separators=_COMPACT)}\n")
+        if director_hints:
+            parts.append(f"  导演提示: {json.dumps(director_hints, ensure_ascii=False, separators=_COMPACT)}\n")
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=256)
+def _render_targets(targets_json: str) -> str:
+    """渲染可连接目标列表文本"""
+    connected_targets = json.loads(targets_json)
+    parts = []
+    for target in connected_targets:
+        target_type = target.get("type", "scene")
+        target_id = target.get("target", "")
+        description = target.get("description", "")
+        trigger_events = target.get("trigger_events", [])
+        prerequisite = target.get("prerequisite")
+        
+        parts.append(f"\n- {target_id} ({target_type})")
+        if description:
+            parts.append(f" - {description}")
+        if trigger_events:
+            parts.append(f" [触发事件: {', '.join(trigger_events)}]")
+        if prerequisite:
+            parts.append(f" [前置条件: {prerequisite}]")
+    return "".join(parts)
+
+
+def _project_character_states(states: Dict, fields: Tuple[str, ...]) -> Dict:
+    """只保留导演决策需要的人物属性字段（fields为空时保留全部）"""
+    if not fields:
+        return states
+    return {
+        char_id: {key: attrs[key] for key in fields if key in attrs} if isinstance(attrs, dict) else attrs
+        for char_id, attrs in states.items()
+    }
+
+
+@functools.lru_cache(maxsize=64)
+def _render_character_states(states_json: str, fields: Tuple[str, ...] = ()) -> str:
+    """
+    渲染角色状态的紧凑JSON文本（只保留导演需要的字段，不缩进以减少提示词token）
+    
+    以C编码器生成的序列化文本为键，状态不变的回合直接复用渲染结果。
+    """
+    states = _project_character_states(json.loads(states_json), fields)
+    return json.dumps(states, ensure_ascii=False, separators=_COMPACT)
+
+
+class _StreamingFieldWatcher:
+    """
+    增量扫描流式JSON响应，指定字段的对象值闭合时返回该对象的文本
+    
+    每段内容只扫描一次（跳过字符串内的括号），不依赖第三方增量JSON解析库。
+    """
+    
+    def __init__(self, field: str):
+        self._key = f'"{field}"'
+        self._buffer = ""
+        self._start = -1
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+    
+    def feed(self, delta: str) -> Optional[str]:
+        """追加一段响应内容，字段对象闭合时返回其文本，否则返回None"""
+        self._buffer += delta
+        if self._start < 0:
+            key_pos = self._buffer.find(self._key)
+            if key_pos < 0:
+                return None
+            brace = self._buffer.find('{', key_pos + len(self._key))
+            if brace < 0:
+                return None
+            self._start = self._pos = brace
+        text = self._buffer
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == '\\':
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c == '{':
+                self._depth += 1
+            elif c == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._pos = len(text)
+                    return text[self._start:i + 1]
+        self._pos = len(text)
+        return None
+
 
 class DirectorEvaluator:
     """LLM导演评估器"""
     
     def __init__(self, config: Config):
         self.config = config
-        self.chat_service = ChatService()
+        self.chat_service = get_default_chat_service()
+        # 异步评估的并发信号量（按事件循环创建）
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._sem_loop = None
     
-    def evaluate_as_director(self, context: Dict, platform: str = None) -> Dict:
+    def evaluate_as_director(self, context: Dict, platform: str = None,
+                             on_environment_analysis: Optional[Callable[[Dict], None]] = None) -> Dict:
         """
         LLM作为导演评估当前状态，这是一个LLM调用，包含两部分工作：
         1. 环境变化分析（第一部分）：分析Agent响应对环境的影响，以及Agent响应的实际执行情况
@@ -36,13 +469,20 @@ class DirectorEvaluator:
                 - player_instruction: 玩家指令
                 - story_overview: 故事总览
                 - agent_responses: Agent响应列表
-                - scene_content: 当前场景内容（用于环境变化分析）
+                - scene_content: 当前场景内容（没有场景/房间剧本时作为场景描述）
+                - pacing_hint: 剧情节奏提示（可选）
+            platform: API平台
+            on_environment_analysis: 环境变化分析结果回调（可选）。开启流式响应时，
+                environment_analysis 对象生成完毕即回调，后续处理可与决策部分的生成并行；
+                否则在解析完整响应后回调
         
         Returns:
             包含两部分结果的字典：
                 - environment_analysis: 环境变化分析结果
                     - updated_scene_description: 更新后的场景描述
                     - scene_state_changes: 场景状态变化
+                    - hidden: 里部分变化（最终目标、潜在敌人、风险提示）
+                    - major_events: 重大事件列表
                     - agent_execution_results: Agent执行结果列表
                 - director_decision: 导演决策结果
                     - trigger_event: 事件ID或None
@@ -54,67 +494,299 @@ class DirectorEvaluator:
                     - elapsed_time: 消耗的游戏内时间（分钟）
                     - reasoning: 决策理由（隐藏）
         """
-        # 构建导演Prompt
-        prompt = self._build_director_prompt(context)
+        # 空闲回合没有需要裁定的内容，不调用LLM
+        if self._is_idle_turn(context):
+            result = _default_director_result("空闲回合，无需导演决策")
+            result["director_decision"]["elapsed_time"] = self.config.DIRECTOR_IDLE_TICK_MINUTES
+            if on_environment_analysis is not None:
+                self._notify_environment_analysis(on_environment_analysis, result["environment_analysis"])
+            return result
+        
+        # 构建导演消息
+        messages = self._build_director_messages(context)
         
         # 调用LLM（这是一个LLM调用，包含两部分工作）
         platform = platform or self.config.DEFAULT_API_PLATFORM
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": "请作为导演，先完成环境变化分析，然后基于分析结果做出决策。"}
-        ]
         context_dict = {'theme': context.get('current_scene', 'unknown')}
         
         try:
-            if platform.lower() == 'deepseek':
-                response = self.chat_service._call_deepseek_api(
-                    messages,
-                    operation='director_evaluate',
-                    context=context_dict
-                )
-            elif platform.lower() == 'openai':
-                response = self.chat_service._call_openai_api(
-                    messages,
-                    operation='director_evaluate',
-                    context=context_dict
-                )
-            elif platform.lower() == 'aizex':
-                response = self.chat_service._call_aizex_api(
-                    messages,
-                    operation='director_evaluate',
-                    context=context_dict
-                )
+            if on_environment_analysis is not None and self.config.LLM_STREAMING_ENABLED:
+                response, notified = self._call_llm_streaming(messages, platform, context_dict,
+                                                              on_environment_analysis)
             else:
-                raise ValueError(f"不支持的API平台: {platform}")
+                response, notified = self._call_llm(messages, platform, context_dict), False
             
-            # 解析响应（包含environment_analysis和director_decision两部分）
-            result = self._parse_director_response(response)
+            # 解析响应（包含environment_analysis和director_decision两部分），格式有误时修复一次
+            result = self._parse_director_response(response, platform=platform, context_dict=context_dict)
+            if on_environment_analysis is not None and not notified:
+                self._notify_environment_analysis(on_environment_analysis, result["environment_analysis"])
             return result
         except Exception as e:
             print(f"导演评估失败: {e}")
             import traceback
             traceback.print_exc()
             # 返回默认结构
-            return {
-                "environment_analysis": {
-                    "updated_scene_description": "",
-                    "scene_state_changes": {},
-                    "agent_execution_results": []
-                },
-                "director_decision": {
-                    "trigger_event": None,
-                    "event_description": "",
-                    "appear_monster": None,
-                    "monster_description": "",
-                    "transition_target": None,
-                    "transition_type": "scene",
-                    "elapsed_time": 1.0,
-                    "reasoning": f"评估失败: {str(e)}"
-                }
+            return _default_director_result(f"评估失败: {str(e)}")
+    
+    @staticmethod
+    def _is_idle_turn(context: Dict) -> bool:
+        """没有Agent响应、玩家指令为空且场景状态没有变化的回合"""
+        return (not context.get("agent_responses")
+                and not (context.get("player_instruction") or "").strip()
+                and not (context.get("scene_state") or {}).get("state_changes"))
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """获取当前事件循环的并发信号量"""
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._sem_loop is not loop:
+            self._sem = asyncio.Semaphore(self.config.DIRECTOR_MAX_CONCURRENCY)
+            self._sem_loop = loop
+        return self._sem
+    
+    async def evaluate_as_director_async(self, context: Dict, platform: str = None) -> Dict:
+        """
+        evaluate_as_director 的异步版本：网络等待在线程中进行，多个场景可用 asyncio.gather 并发评估
+        
+        同时进行中的请求数不超过 DIRECTOR_MAX_CONCURRENCY，避免触发平台限流。
+        """
+        async with self._get_semaphore():
+            return await asyncio.to_thread(self.evaluate_as_director, context, platform)
+    
+    async def evaluate_concurrently_async(self, contexts: List[Dict], platform: str = None) -> List[Dict]:
+        """并发评估多个场景/房间（各自独立的导演上下文），结果与输入顺序一致"""
+        return list(await asyncio.gather(
+            *(self.evaluate_as_director_async(context, platform) for context in contexts)
+        ))
+    
+    def evaluate_concurrently(self, contexts: List[Dict], platform: str = None) -> List[Dict]:
+        """evaluate_concurrently_async 的同步入口（调用方没有运行中的事件循环时使用）"""
+        return asyncio.run(self.evaluate_concurrently_async(contexts, platform))
+    
+    def _call_llm(self, messages: List[Dict], platform: str, context_dict: Dict) -> str:
+        """按平台调用LLM"""
+        if self.config.DIRECTOR_JSON_MODE:
+            return self.chat_service.platform_method(platform)(
+                messages,
+                operation='director_evaluate',
+                context=context_dict,
+                response_format=_JSON_OBJECT_FORMAT
+            )
+        return self.chat_service.platform_method(platform)(
+            messages,
+            operation='director_evaluate',
+            context=context_dict
+        )
+    
+    def _call_llm_streaming(self, messages: List[Dict], platform: str, context_dict: Dict,
+                            on_environment_analysis: Callable[[Dict], None]) -> Tuple[str, bool]:
+        """
+        流式调用LLM，environment_analysis 对象闭合时立即回调（此时决策部分仍在生成）
+        
+        Returns:
+            (完整响应文本, 是否已回调)
+        """
+        kwargs = {'response_format': _JSON_OBJECT_FORMAT} if self.config.DIRECTOR_JSON_MODE else {}
+        stream = self.chat_service.stream_platform_api(
+            platform, messages, operation='director_evaluate', context=context_dict, **kwargs
+        )
+        watcher = _StreamingFieldWatcher("environment_analysis")
+        parts = []
+        notified = False
+        for delta in stream:
+            parts.append(delta)
+            if notified:
+                continue
+            field_text = watcher.feed(delta)
+            if field_text is None:
+                continue
+            try:
+                analysis = json_utils.loads(field_text)
+            except json_utils.JSONDecodeError:
+                analysis = None
+            if isinstance(analysis, dict):
+                notified = True
+                self._notify_environment_analysis(
+                    on_environment_analysis,
+                    self._normalize_director_result({"environment_analysis": analysis})["environment_analysis"]
+                )
+        return "".join(parts), notified
+    
+    @staticmethod
+    def _notify_environment_analysis(callback: Callable[[Dict], None], analysis: Dict):
+        """调用环境变化分析回调（回调出错不影响导演评估）"""
+        try:
+            callback(analysis)
+        except Exception as e:
+            print(f"环境变化分析回调失败: {e}")
+    
+    def evaluate_as_director_batch(self, contexts: List[Dict], platform: str = None) -> List[Dict]:
+        """
+        批量导演评估：多个待评估的回合（如多个场景/房间）合并到一次LLM调用
+        
+        每次请求最多合并 DIRECTOR_BATCH_SIZE 个回合，多个请求之间并发执行；
+        只有一个回合时直接调用 evaluate_as_director。合并请求失败或结果缺少某个回合时，
+        该回合单独重新评估。
+        
+        Args:
+            contexts: 导演上下文列表，每项格式同 evaluate_as_director 的 context
+            platform: API平台
+        
+        Returns:
+            与 contexts 顺序一致的导演评估结果列表
+        """
+        if len(contexts) <= 1:
+            return [self.evaluate_as_director(context, platform=platform) for context in contexts]
+        
+        platform = platform or self.config.DEFAULT_API_PLATFORM
+        results: List[Optional[Dict]] = [None] * len(contexts)
+        # 空闲回合直接得到结果，不占用合并请求的名额
+        pending = []
+        for i, context in enumerate(contexts):
+            if self._is_idle_turn(context):
+                results[i] = self.evaluate_as_director(context, platform=platform)
+            else:
+                pending.append(i)
+        if not pending:
+            return results
+        batch_size = max(1, self.config.DIRECTOR_BATCH_SIZE)
+        chunks = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        
+        def _evaluate_chunk(indices: List[int]):
+            if len(indices) == 1:
+                results[indices[0]] = self.evaluate_as_director(contexts[indices[0]], platform=platform)
+                return
+            
+            turns_text = []
+            for n, i in enumerate(indices):
+                scene_context, turn_context = self._build_context_sections(contexts[i])
+                turns_text.append(f"## Turn {n}\n\n{scene_context}\n{turn_context}")
+            messages = [
+                {"role": "system", "content": _DIRECTOR_INSTRUCTIONS},
+                {"role": "system", "content": _DIRECTOR_BATCH_INSTRUCTION},
+                {"role": "user", "content": "\n\n".join(turns_text)}
+            ]
+            context_dict = {'theme': contexts[indices[0]].get('current_scene', 'unknown'),
+                            'batch_size': len(indices)}
+            try:
+                turns = self._parse_batch_response(self._call_llm(messages, platform, context_dict),
+                                                   len(indices))
+            except Exception as e:
+                print(f"批量导演评估失败，逐个重新评估: {e}")
+                turns = [None] * len(indices)
+            
+            for i, turn in zip(indices, turns):
+                results[i] = turn if turn is not None else self.evaluate_as_director(contexts[i], platform=platform)
+        
+        if len(chunks) == 1:
+            _evaluate_chunk(chunks[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+                list(executor.map(_evaluate_chunk, chunks))
+        return results
+    
+    def _parse_batch_response(self, response: str, count: int) -> List[Optional[Dict]]:
+        """解析批量导演响应，按回合编号放回对应位置，缺失的回合为None"""
+        data = json_utils.parse_json_lenient(response)
+        if not isinstance(data, dict):
+            raise ValueError("批量导演响应中没有有效的JSON对象")
+        turns = data.get("turns", [])
+        results: List[Optional[Dict]] = [None] * count
+        for position, turn in enumerate(turns):
+            if not isinstance(turn, dict):
+                continue
+            try:
+                index = int(turn.pop("turn", position))
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < count and results[index] is None:
+                results[index] = self._normalize_director_result(turn)
+        return results
+    
+    def analyze_environment_changes(self, scene_content: str, agent_responses: List[Dict],
+                                    platform: str = None, pacing_hint: str = "",
+                                    preset_events: Optional[List[str]] = None) -> Dict:
+        """
+        环境变化分析（EnvironmentAnalyzer.analyze_environment_changes 的替代）
+        
+        每次调用都会进行一次完整的导演评估（一次LLM调用），取其中的 environment_analysis，
+        转换为环境分析器的格式。
+        
+        Args:
+            scene_content: 当前场景内容
+            agent_responses: 所有智能体的响应列表
+            platform: API平台
+            pacing_hint: 剧情节奏提示（可选）
+            preset_events: 场景文本中的预设事件（可选，最多列出10个）
+        
+        Returns:
+            {scene_changes: {surface, hidden}, major_events, decision_points, status_summary}
+        """
+        result = self.evaluate_as_director({
+            "scene_content": scene_content,
+            "agent_responses": agent_responses,
+            "pacing_hint": pacing_hint,
+            "events": preset_events or [],
+        }, platform=platform)
+        return self.to_environment_changes(result["environment_analysis"])
+    
+    @staticmethod
+    def to_environment_changes(environment_analysis: Dict) -> Dict:
+        """把导演评估的 environment_analysis 转换为环境分析器的结果格式（scene_changes 表/里、重大事件、决策点和状态摘要）"""
+        state_changes = environment_analysis.get("scene_state_changes") or {}
+        # location 可能是字符串或字典，统一为字典
+        location = state_changes.get("location") or {}
+        if isinstance(location, str):
+            location = {"specific_location": location}
+        elif not isinstance(location, dict):
+            location = {}
+        surface = {k: v for k, v in state_changes.items() if v is not None}
+        surface.update({
+            "location": location,
+            "time": state_changes.get("time") or "",
+            "current_narrative": environment_analysis.get("updated_scene_description") or ""
+        })
+        decision_points = environment_analysis.get("decision_points")
+        if not isinstance(decision_points, dict):
+            decision_points = {}
+        status_summary = environment_analysis.get("status_summary")
+        if not isinstance(status_summary, dict):
+            status_summary = {}
+        return {
+            'scene_changes': {
+                'surface': surface,
+                'hidden': environment_analysis.get("hidden") or {}
+            },
+            'major_events': environment_analysis.get("major_events") or [],
+            'agent_execution_results': environment_analysis.get("agent_execution_results", []),
+            'decision_points': {
+                'has_decision': bool(decision_points.get("has_decision")),
+                'description': decision_points.get("description") or '',
+                'options': list(decision_points.get("options") or [])
+            },
+            'status_summary': {
+                'current_location': location.get("specific_location", ""),
+                'current_time': surface["time"],
+                'goal_progress': status_summary.get("goal_progress") or '',
+                'next_suggestions': list(status_summary.get("next_suggestions") or [])
             }
+        }
     
-    def _build_director_prompt(self, context: Dict) -> str:
-        """构建导演Prompt"""
+    def _build_director_messages(self, context: Dict) -> List[Dict]:
+        """
+        构建导演评估的消息列表
+        
+        按变化频率排列：固定指令（模块常量）-> 场景级上下文（事件/怪物/可连接目标）-> 本回合输入，
+        前两部分在多个回合间保持不变，可以命中平台的前缀缓存。
+        """
+        scene_context, turn_context = self._build_context_sections(context)
+        return [
+            {"role": "system", "content": _DIRECTOR_INSTRUCTIONS},
+            {"role": "system", "content": scene_context},
+            {"role": "user", "content": f"{turn_context}\n\n---\n\n{_DIRECTOR_USER_INSTRUCTION}"}
+        ]
+    
+    def _build_context_sections(self, context: Dict) -> Tuple[str, str]:
+        """构建 (场景级上下文, 本回合输入) 两段文本"""
         current_scene = context.get("current_scene", "未知")
         current_room = context.get("current_room")
         player_instruction = context.get("player_instruction", "")
@@ -134,119 +806,30 @@ class DirectorEvaluator:
             surface_desc = room_script.get("surface", {}).get("description", "")
         else:
             surface_desc = scene_script.get("surface", {}).get("description", "")
+        if not surface_desc:
+            # 没有剧本时使用场景内容（如环境分析的调用方只提供场景文本）
+            surface_desc = context.get("scene_content", "")
+        surface_desc = _clip_middle(surface_desc, self.config.DIRECTOR_MAX_SCENE_CHARS)
         
         # 获取潜在事件和怪物（里部分）
         potential_events = context.get("potential_events", [])
         potential_monsters = context.get("potential_monsters", [])
         connected_targets = context.get("connected_targets", [])
         
-        # 构建事件列表文本（区分核心事件和随机事件，标记已触发状态）
-        core_events_text = ""
-        random_events_text = ""
-        
-        for i, event in enumerate(potential_events, 1):
-            event_id = event.get('id', '')
-            event_type = event.get('type', 'random')  # 从JSON加载的事件使用type字段
-            if not event_type:
-                event_type = event.get('event_type', 'random')  # 兼容旧格式
-            event_name = event.get('name', '未知')
-            event_description = event.get('description', '')
-            trigger_conditions = event.get('trigger_conditions', {})
-            
-            # 检查事件是否已触发
-            is_triggered = event_id in triggered_events if event_id else False
-            status_mark = " [已触发]" if is_triggered else " [未触发]"
-            
-            event_info = f"\n事件{i}: {event_name} (ID: {event_id}){status_mark}"
-            if event_type == "core":
-                event_info += " [核心事件]"
-            else:
-                event_info += " [随机事件]"
-            
-            # 添加简单介绍
-            if event_description:
-                event_info += f"\n  简介: {event_description}"
-            
-            # 添加触发条件（简化显示）
-            if trigger_conditions:
-                conditions_summary = []
-                if trigger_conditions.get("time_condition"):
-                    conditions_summary.append(f"时间: {trigger_conditions['time_condition']}")
-                if trigger_conditions.get("behavior_condition"):
-                    conditions_summary.append(f"行为: {trigger_conditions['behavior_condition'][:50]}...")
-                if trigger_conditions.get("state_condition") and trigger_conditions.get("state_condition") != "无特殊要求":
-                    conditions_summary.append(f"状态: {trigger_conditions['state_condition']}")
-                if trigger_conditions.get("random_factor"):
-                    conditions_summary.append(f"随机: {trigger_conditions['random_factor']}")
-                
-                if conditions_summary:
-                    event_info += f"\n  触发条件: {' | '.join(conditions_summary)}"
-            
-            # 添加描述模板（简要）
-            description_template = event.get('description_template', '')
-            if description_template:
-                event_info += f"\n  描述预览: {description_template[:100]}..."
-            
-            if event_type == "core":
-                core_events_text += event_info
-            else:
-                random_events_text += event_info
-        
-        events_text = ""
-        if core_events_text:
-            events_text += "\n【核心事件】（可以转换状态和推进剧本阶段）:"
-            events_text += core_events_text
-        if random_events_text:
-            events_text += "\n【随机事件】（如遭遇战、发现财宝等，不触发场景转换）:"
-            events_text += random_events_text
-        
-        # 构建怪物列表文本（从怪物卡加载）
-        monsters_text = ""
-        for i, monster in enumerate(potential_monsters, 1):
-            monster_id = monster.get('id', '未知')
-            monster_name = monster.get('name', '未知')
-            monster_type = monster.get('type', '')
-            monster_level = monster.get('level', '')
-            monster_desc = monster.get('description', '')
-            attributes = monster.get('attributes', {})
-            appearance_conditions = monster.get('appearance_conditions', {})
-            battle_template = monster.get('battle_description_template', '')
-            battle_effects = monster.get('battle_effects', {})
-            director_hints = monster.get('director_hints', {})
-            
-            monsters_text += f"\n怪物{i}: {monster_name} (ID: {monster_id})\n"
-            monsters_text += f"  类型: {monster_type}\n"
-            monsters_text += f"  等级/难度: {monster_level}\n"
-            monsters_text += f"  描述: {monster_desc}\n"
-            if attributes:
-                monsters_text += f"  属性: HP={attributes.get('hp', 'N/A')}, 攻击={attributes.get('attack', 'N/A')}, 防御={attributes.get('defense', 'N/A')}\n"
-                if attributes.get('special_abilities'):
-                    monsters_text += f"  特殊能力: {', '.join(attributes.get('special_abilities', []))}\n"
-            if appearance_conditions:
-                monsters_text += f"  出现条件: {json.dumps(appearance_conditions, ensure_ascii=False)}\n"
-            if battle_template:
-                monsters_text += f"  战斗描述模板: {battle_template}\n"
-            if battle_effects:
-                monsters_text += f"  战斗影响: {json.dumps(battle_effects, ensure_ascii=False)}\n"
-            if director_hints:
-                monsters_text += f"  导演提示: {json.dumps(director_hints, ensure_ascii=False)}\n"
-        
-        # 构建可连接目标列表文本
-        targets_text = ""
-        for target in connected_targets:
-            target_type = target.get("type", "scene")
-            target_id = target.get("target", "")
-            description = target.get("description", "")
-            trigger_events = target.get("trigger_events", [])
-            prerequisite = target.get("prerequisite")
-            
-            targets_text += f"\n- {target_id} ({target_type})"
-            if description:
-                targets_text += f" - {description}"
-            if trigger_events:
-                targets_text += f" [触发事件: {', '.join(trigger_events)}]"
-            if prerequisite:
-                targets_text += f" [前置条件: {prerequisite}]"
+        # 事件/怪物/可连接目标只在场景或房间切换时变化，渲染结果按内容缓存
+        # 已触发事件转为集合后查找；缓存键只包含本场景事件中已触发的ID，其他场景的事件触发不影响缓存命中
+        triggered_set = frozenset(triggered_events)
+        scene_triggered = frozenset(
+            event.get('id') for event in potential_events if event.get('id') in triggered_set
+        )
+        events_text = _render_events(_freeze(potential_events), scene_triggered)
+        if not potential_events and context.get("events"):
+            # 没有剧本事件时（如环境分析的调用方只提供场景文本），列出场景文本中的预设事件
+            events_text = "\n【预设事件】请根据当前情况判断是否应该触发：\n" + "\n".join(
+                f"- {event}" for event in context["events"][:10]
+            )
+        monsters_text = _render_monsters(_freeze(potential_monsters))
+        targets_text = _render_targets(_freeze(connected_targets))
         
         # 构建场景状态文本
         scene_state_text = f"场景ID: {current_scene}"
@@ -284,251 +867,131 @@ class DirectorEvaluator:
         event_state_text = f"已触发事件数: {len(triggered_events)}"
         if triggered_events:
             event_state_text += f"\n已触发事件ID: {', '.join(triggered_events)}"
-        
-        # 获取场景内容（用于环境变化分析）
-        scene_content = context.get("scene_content", "")
+        if context.get("pacing_hint"):
+            event_state_text += f"\n剧情节奏: {context['pacing_hint']}"
         
         # 构建Agent响应文本（用于环境变化分析和决策制定）
-        agent_responses_text = ""
         if agent_responses:
-            agent_responses_text = "\n【重要角色的想法/决策】**（最重要，用于环境变化分析和决策制定）**\n"
-            agent_responses_text += "**注意**：只有重要角色会生成Agent响应。环境NPC（如村民、路人等）的反应由你在环境变化分析中处理。\n"
+            response_parts = [
+                "\n【重要角色的想法/决策】**（最重要，用于环境变化分析和决策制定）**\n",
+                "**注意**：只有重要角色会生成Agent响应。环境NPC（如村民、路人等）的反应由你在环境变化分析中处理。\n",
+            ]
             for i, resp in enumerate(agent_responses, 1):
                 character_id = resp.get("character_id", "")
                 character_name = resp.get("character_name", "未知")
-                response = format_agent_response(resp.get("response", ""))
-                hidden = resp.get("hidden", {})
-                inner_monologue = hidden.get("inner_monologue", "") if isinstance(hidden, dict) else ""
+                # 协调器生成导演上下文时已格式化为文本，此时无需再次格式化
+                response = resp.get("response", "")
+                if not isinstance(response, str):
+                    response = format_agent_response(response)
+                response = _clip_middle(response, self.config.DIRECTOR_MAX_RESPONSE_CHARS)
+                inner_monologue = resp.get("inner_monologue", "")
+                if not inner_monologue:
+                    hidden = resp.get("hidden", {})
+                    inner_monologue = hidden.get("inner_monologue", "") if isinstance(hidden, dict) else ""
                 
-                agent_responses_text += f"\n重要角色{i}: {character_name} (ID: {character_id})\n"
-                agent_responses_text += f"  响应: {response}\n"
+                response_parts.append(f"\n重要角色{i}: {character_name} (ID: {character_id})\n")
+                response_parts.append(f"  响应: {response}\n")
                 if inner_monologue:
-                    agent_responses_text += f"  内心活动: {inner_monologue}\n"
+                    response_parts.append(f"  内心活动: {inner_monologue}\n")
+            agent_responses_text = "".join(response_parts)
         else:
-            agent_responses_text = "\n【重要角色的想法/决策】: 暂无重要角色响应\n"
-            agent_responses_text += "**注意**：如果没有重要角色，环境NPC（如村民、路人等）的反应由你在环境变化分析中处理。\n"
+            agent_responses_text = ("\n【重要角色的想法/决策】: 暂无重要角色响应\n"
+                                    "**注意**：如果没有重要角色，环境NPC（如村民、路人等）的反应由你在环境变化分析中处理。\n")
         
-        prompt = f"""# Role: 游戏剧情导演 (Game Director)
-
-你负责推进游戏剧情，处理环境变化并制定游戏进程决策。
-**核心指令：这是一个单次 LLM 调用，你必须严格按照顺序完成两个阶段的任务：【阶段一：多角色判定与模拟】 -> 【阶段二：全局决策】。**
-
----
-
-### 1. 输入上下文 (Context)
-
-**【当前场景状态】**
-{scene_state_text}
-**【时间信息】**
-{time_info_text} | {enter_time_text}
-**【事件状态】**
-{event_state_text}
-
-**【玩家指令】**
-{player_instruction}
-
-**【Agent 响应数据 (多角色列表)】**
-*注意：这里包含**一个或多个** Agent 的响应。每个响应包含 `dialogue` (事实) 和 `action_intent` (待判定的尝试)。*
-{agent_responses_text}
-
-**【场景描述 (玩家可见)】**
-{surface_desc}
-**【角色状态】**
-{json.dumps(character_states, ensure_ascii=False, indent=2)}
-
-**【隐藏信息 (仅导演可见)】**
-- **可能事件列表**: {events_text}
-- **潜在怪物列表**: {monsters_text}
-- **可连接目标**: {targets_text}
-
----
-
-### 2. 任务流程 (Workflow)
-
-请在同一个 JSON 输出中，依次完成以下两个阶段的思考与生成：
-
-#### 阶段一：环境变化分析 (Environment Analysis)
-**目标**：遍历处理**所有** Agent 的行为结果，并更新环境描述。
-
-1.  **多角色动作执行判定 (Batch Adjudication)**：
-    * **必须遍历列表中的每一个 Agent**，不要遗漏。
-    * 读取每个 Agent 的 `action_intent`。
-    * **判定逻辑**：根据环境限制（如锁、障碍、敌人数量）判定 `success` (true/false)。
-    * **填写 output**：在 `agent_execution_results` 数组中为**每一个** Agent 生成对应的结果对象。
-2.  **场景描述重绘**:
-    * 更新 `updated_scene_description`。
-    * **综合叙事**：必须将**所有** Agent 的对话和动作结果融合在一起，形成一段连贯的群像描写。
-
-#### 阶段二：决策制定 (Director Decision)
-**目标**：基于全局状态，决定唯一的下一步流向。
-
-**A. 意图与阻断检查**
-    * 检查**任意** Agent 是否表达了移动/转场意图。
-    * **逻辑阻断**：如果转场需要前置条件（如“全队集合”或“开门”），且相关动作在阶段一中失败，则**阻止转场**（`transition_target: null`）。
-
-**B. 优先级规则 (事件互斥逻辑)**
-    * **规则 1 (单事件触发 - 最高优先级)**：检查 `【可能事件列表】`。
-        * **唯一性原则**：即使满足多个事件的条件，**同时也只能触发一个事件**。
-        * **筛选标准**：优先选择剧情优先级最高、或与当前玩家行为最相关的**这一个**事件 ID 填入 `trigger_event`。
-    * **规则 2 (转场)**：如果没有触发事件，且意图明确、地点可达、动作判定成功，填入 `transition_target`。
-    * **规则 3 (原地)**：以上皆不满足，保持在当前场景。
-
-**C. 怪物生成 (多实体支持)**
-    * 检查 `【潜在怪物列表】`。
-    * 如果剧情需要战斗（如遭遇埋伏、进入巢穴），可以从列表中选择**一个或多个**怪物。
-    * *示例*：可以同时选择 "Goblin_Archer" 和 "Goblin_Warrior" 组成混合编队。
-    * 将选中的所有怪物 ID/名称填入 `appear_monster` 列表。
-
----
-
-### 3. 输出格式 (Output Format)
-
-必须输出为严格的 JSON 格式，`appear_monster` 必须为列表。
-
-```json
-{{
-  "environment_analysis": {{
-    "updated_scene_description": "融合了多角色对话、多动作判定结果和NPC反应的完整群像剧情描述",
-    "scene_state_changes": {{
-      "location": "当前位置",
-      "time": "时间变化描述，无变化则为 null",
-      "weather": "天气变化描述，无变化则为 null"
-    }},
-    "agent_execution_results": [
-      {{
-        "character_id": "角色ID_1",
-        "character_name": "角色名_1",
-        "execution_result": {{
-          "success": true,
-          "failure_reason": "失败原因，成功则为 null",
-          "actual_outcome": "动作的实际结果描述"
-        }}
-      }},
-      ...可能有多个Agent响应
-    ]
-  }},
-  "director_decision": {{
-    "trigger_event": "唯一的事件ID 或 null (严格互斥)",
-    "event_description": "事件描述文本",
-    "appear_monster": ["怪物ID_1", "怪物ID_2", ...可能有多个怪物], 
-    "monster_description": "描述所有登场怪物的出场画面（如：一只巨魔撞破大门，身后跟着两只狂叫的地精）",
-    "transition_target": "目标场景ID 或 null",
-    "transition_type": "scene 或 room",
-    "elapsed_time": 5.0,
-    "reasoning": "决策链思维：多角色动作判定 -> 事件互斥筛选 -> 怪物编队选择 -> 最终决定"
-  }}
-}}
-"""
-        return prompt
+        # 场景级上下文在前（同一场景/房间内各回合基本不变，形成稳定前缀），本回合输入在后
+        scene_context = _SCENE_CONTEXT_TEMPLATE.format(
+            surface_desc=surface_desc,
+            events_text=events_text,
+            monsters_text=monsters_text,
+            targets_text=targets_text,
+        )
+        turn_context = _TURN_CONTEXT_TEMPLATE.format(
+            scene_state_text=scene_state_text,
+            time_info_text=time_info_text,
+            enter_time_text=enter_time_text,
+            event_state_text=event_state_text,
+            player_instruction=player_instruction,
+            agent_responses_text=agent_responses_text,
+            character_states_text=_render_character_states(
+                _freeze(character_states), tuple(self.config.DIRECTOR_CHARACTER_FIELDS)
+            ),
+        )
+        
+        return scene_context, turn_context
     
-    def _parse_director_response(self, response: str) -> Dict:
-        """解析导演响应（包含environment_analysis和director_decision两部分）"""
-        # 清理响应文本
-        response_text = response.strip()
-        
-        # 尝试提取JSON
-        if "```json" in response_text:
-            json_start = response_text.find("```json") + 7
-            json_end = response_text.find("```", json_start)
-            response_text = response_text[json_start:json_end].strip()
-        elif "```" in response_text:
-            json_start = response_text.find("```") + 3
-            json_end = response_text.find("```", json_start)
-            response_text = response_text[json_start:json_end].strip()
-        
-        # 尝试提取JSON对象
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            response_text = json_match.group(0)
+    def _parse_director_response(self, response: str, platform: Optional[str] = None,
+                                 context_dict: Optional[Dict] = None) -> Dict:
+        """
+        解析导演响应（包含environment_analysis和director_decision两部分）
         
+        指定 platform 时，解析失败会发起一次修复调用（不会递归修复），修复后仍无法解析才返回默认结果。
+        """
+        result = json_utils.parse_json_lenient(response)
+        if not isinstance(result, dict) and platform:
+            repaired = self._repair_json(response, platform, context_dict or {})
+            if repaired is not None:
+                result = json_utils.parse_json_lenient(repaired)
+        if not isinstance(result, dict):
+            print("解析导演响应失败: 响应中没有有效的JSON对象")
+            print(f"响应内容: {response[:500]}")
+            return _default_director_result("解析失败: 响应中没有有效的JSON对象")
+        return self._normalize_director_result(result)
+    
+    def _repair_json(self, response: str, platform: str, context_dict: Dict) -> Optional[str]:
+        """把无法解析的导演输出交给LLM修复为严格JSON（temperature=0），调用失败返回None"""
+        messages = [
+            {"role": "system", "content": _DIRECTOR_REPAIR_INSTRUCTION},
+            {"role": "user", "content": response}
+        ]
+        kwargs = {'response_format': _JSON_OBJECT_FORMAT} if self.config.DIRECTOR_JSON_MODE else {}
         try:
-            result = json.loads(response_text)
-            
-            # 确保包含environment_analysis和director_decision两部分
-            default_result = {
-                "environment_analysis": {
-                    "updated_scene_description": "",
-                    "scene_state_changes": {},
-                    "agent_execution_results": []
-                },
-                "director_decision": {
-                    "trigger_event": None,
-                    "event_description": "",
-                    "appear_monster": [],
-                    "monster_description": "",
-                    "transition_target": None,
-                    "transition_type": "scene",
-                    "elapsed_time": 1.0,
-                    "reasoning": ""
-                }
-            }
-            
-            # 如果返回格式是旧的（只有director_decision），转换为新格式
-            if "environment_analysis" not in result and "director_decision" not in result:
-                # 旧格式，只有决策部分
-                old_decision = result
-                result = {
-                    "environment_analysis": default_result["environment_analysis"],
-                    "director_decision": {}
-                }
-                # 将旧格式的字段迁移到director_decision
-                for key in default_result["director_decision"]:
-                    result["director_decision"][key] = old_decision.get(key, default_result["director_decision"][key])
-            elif "environment_analysis" not in result:
-                result["environment_analysis"] = default_result["environment_analysis"]
-            elif "director_decision" not in result:
-                result["director_decision"] = default_result["director_decision"]
-            
-            # 确保environment_analysis的所有字段存在
-            for key in default_result["environment_analysis"]:
-                if key not in result["environment_analysis"]:
-                    result["environment_analysis"][key] = default_result["environment_analysis"][key]
-            
-            # 确保director_decision的所有字段存在
-            for key in default_result["director_decision"]:
-                if key not in result["director_decision"]:
-                    result["director_decision"][key] = default_result["director_decision"][key]
-            
-            # 处理null字符串和空值
-            if result["director_decision"].get("trigger_event") == "null" or result["director_decision"].get("trigger_event") == "":
-                result["director_decision"]["trigger_event"] = None
-            if result["director_decision"].get("transition_target") == "null" or result["director_decision"].get("transition_target") == "":
-                result["director_decision"]["transition_target"] = None
-            
-            # 处理appear_monster：兼容旧格式（字符串）和新格式（数组）
-            appear_monster = result["director_decision"].get("appear_monster")
-            if appear_monster is None or appear_monster == "null" or appear_monster == "":
-                result["director_decision"]["appear_monster"] = []
-            elif isinstance(appear_monster, str):
-                # 旧格式：字符串，转换为数组
-                result["director_decision"]["appear_monster"] = [appear_monster] if appear_monster else []
-            elif not isinstance(appear_monster, list):
-                # 如果不是列表，转换为列表
-                result["director_decision"]["appear_monster"] = [appear_monster] if appear_monster else []
-            
-            # 确保elapsed_time是数字
-            if not isinstance(result["director_decision"].get("elapsed_time"), (int, float)):
-                result["director_decision"]["elapsed_time"] = 1.0
-            
-            return result
-        except json.JSONDecodeError as e:
-            print(f"解析导演响应失败: {e}")
-            print(f"响应内容: {response_text[:500]}")
-            return {
-                "environment_analysis": {
-                    "updated_scene_description": "",
-                    "scene_state_changes": {},
-                    "agent_execution_results": []
-                },
-                "director_decision": {
-                    "trigger_event": None,
-                    "event_description": "",
-                    "appear_monster": [],
-                    "monster_description": "",
-                    "transition_target": None,
-                    "transition_type": "scene",
-                    "elapsed_time": 1.0,
-                    "reasoning": f"解析失败: {str(e)}"
-                }
+            return self.chat_service.platform_method(platform)(
+                messages,
+                0,
+                operation='director_repair',
+                context=context_dict,
+                **kwargs
+            )
+        except Exception as e:
+            print(f"修复导演响应失败: {e}")
+            return None
+    
+    def _normalize_director_result(self, result: Dict) -> Dict:
+        """补全导演结果的缺失字段，统一空值和字段类型"""
+        # 如果返回格式是旧的（只有director_decision），转换为新格式
+        if "environment_analysis" not in result and "director_decision" not in result:
+            # 旧格式，只有决策部分，将其字段迁移到director_decision
+            result = {
+                "environment_analysis": {},
+                "director_decision": {key: result[key] for key in _DEFAULT_DIRECTOR_DECISION if key in result}
             }
-
+        else:
+            result.setdefault("environment_analysis", {})
+            result.setdefault("director_decision", {})
+        
+        # 补全缺失字段
+        _fill_defaults(result["environment_analysis"], _DEFAULT_ENVIRONMENT_ANALYSIS)
+        _fill_defaults(result["director_decision"], _DEFAULT_DIRECTOR_DECISION)
+        
+        # 处理null字符串和空值
+        if result["director_decision"].get("trigger_event") == "null" or result["director_decision"].get("trigger_event") == "":
+            result["director_decision"]["trigger_event"] = None
+        if result["director_decision"].get("transition_target") == "null" or result["director_decision"].get("transition_target") == "":
+            result["director_decision"]["transition_target"] = None
+        
+        # 处理appear_monster：兼容旧格式（字符串）和新格式（数组）
+        appear_monster = result["director_decision"].get("appear_monster")
+        if appear_monster is None or appear_monster == "null" or appear_monster == "":
+            result["director_decision"]["appear_monster"] = []
+        elif isinstance(appear_monster, str):
+            # 旧格式：字符串，转换为数组
+            result["director_decision"]["appear_monster"] = [appear_monster] if appear_monster else []
+        elif not isinstance(appear_monster, list):
+            # 如果不是列表，转换为列表
+            result["director_decision"]["appear_monster"] = [appear_monster] if appear_monster else []
+        
+        # 确保elapsed_time是数字
+        if not isinstance(result["director_decision"].get("elapsed_time"), (int, float)):
+            result["director_decision"]["elapsed_time"] = 1.0
+        
+        return result
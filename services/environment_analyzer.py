@@ -2,11 +2,18 @@
 环境分析器：使用LLM分析智能体响应，提取环境变化
 包含轻量级剧情控制器功能：评估剧情节奏，主动触发事件
 """
-import json
+import asyncio
+import copy
+import hashlib
 import re
 import logging
-from typing import Dict, List, Optional
-from services.chat_service import ChatService
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from services import json_utils
+from services.chat_service import ChatService, load_persisted, persist
+from services.director_evaluator import DirectorEvaluator
 from config import Config
 
 # 配置日志（输出到服务器端）
@@ -17,45 +24,95 @@ if not logger.handlers:
     logger.addHandler(handler)
     logger.setLevel(logging.INFO)
 
+# 场景Markdown解析用的正则（预编译，每个游戏步骤都会调用）
+_PRESET_RE = re.compile(r'##\s*剧本预设事件.*?##', re.DOTALL | re.IGNORECASE)
+_MAJOR_RE = re.compile(r'##\s*重大事件.*?##', re.DOTALL | re.IGNORECASE)
+# 列表项（编号或-/*开头），一次扫描同时完成识别和去除标记
+_LIST_ITEM_RE = re.compile(r'^[ \t]*(?:\d+\.|[-*])[ \t]*(.+?)[ \t]*$', re.MULTILINE)
+_BULLET_ITEM_RE = re.compile(r'^[ \t]*[-*][ \t]*(.+?)[ \t]*$', re.MULTILINE)
+_BOLD_RE = re.compile(r'\*\*.*?\*\*')
+_PREFIX_RE = re.compile(r'^[^：:]+[：:]\s*')
+
+# 节奏评估关键词（中文无大小写之分，不需要lower()），编译为单个正则一次扫描
+_MOVE_KEYWORDS = ['前进', '移动', '探索', '前往', '出发', '离开', '继续', '推进', '行进']
+_INSTRUCTION_MOVE_RE = re.compile('|'.join(map(re.escape, _MOVE_KEYWORDS + ['去', '到'])))
+_RESPONSE_MOVE_RE = re.compile('|'.join(map(re.escape, _MOVE_KEYWORDS)))
+_ADVANCE_RE = re.compile('|'.join(map(re.escape, _MOVE_KEYWORDS[:-1])))
+_OBSERVE_RE = re.compile('|'.join(map(re.escape, ['发现', '遭遇', '异常', '可疑', '听到', '看到', '注意到',
+                                                  '察觉', '痕迹', '线索', '声音', '动静'])))
+
+# "无事发生"时的分析结果（返回深拷贝）
+_EMPTY_ANALYSIS = {
+    'scene_changes': {
+        'surface': {},
+        'hidden': {}
+    },
+    'major_events': [],
+    'decision_points': {'has_decision': False, 'description': '', 'options': []},
+    'status_summary': {'current_location': '', 'current_time': '', 'goal_progress': '', 'next_suggestions': []}
+}
+
+
+def _join_responses(agent_responses: List[Dict]) -> str:
+    """把Agent响应拼接为一段文本，用于关键词判断"""
+    return "\n\n".join([
+        f"【{resp.get('character_name', '未知')}】\n{resp.get('response', '')}"
+        for resp in agent_responses
+        if resp and isinstance(resp, dict)
+    ])
+
+# 事件提取结果缓存的最大条目数
+_EXTRACT_CACHE_SIZE = 64
+
+# 环境分析结果在磁盘缓存（LLM_RESPONSE_CACHE_DB）中的键前缀，与LLM响应的键区分
+_PERSIST_PREFIX = "environment_analysis:"
+
 
 class EnvironmentAnalyzer:
     """环境分析器（包含剧情控制功能）"""
     
     def __init__(self, config: Config):
         self.config = config
-        self.chat_service = ChatService()
+        self.director_evaluator = DirectorEvaluator(config)
+        self.chat_service = self.director_evaluator.chat_service
+        # 最近的分析结果（LRU淘汰）：场景内容和Agent响应相同的回合（如空闲回合）直接复用
+        self._recent_cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._recent_cache_lock = threading.Lock()
+        # 场景事件提取结果（按场景内容摘要缓存）：同一回合内节奏评估会重复解析同一份场景
+        self._extract_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._extract_cache_lock = threading.Lock()
+    
+    @staticmethod
+    def _analysis_cache_key(scene_content: str, agent_responses: List[Dict], platform: Optional[str]) -> str:
+        """根据场景内容、Agent响应（与顺序无关）和平台计算缓存键"""
+        responses = sorted(
+            ([str(r.get('character_id') or r.get('character_name', '')), r.get('response', '')]
+             for r in agent_responses if isinstance(r, dict)),
+            key=lambda item: item[0]
+        )
+        payload = json_utils.dump_bytes([scene_content, responses, platform], sort_keys=True)
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
     
     def _extract_preset_events(self, scene_content: str) -> List[str]:
         """从场景内容中提取预设事件"""
         events = []
         
-        # 查找"剧本预设事件"或"重大事件"部分
-        preset_pattern = r'##\s*剧本预设事件.*?##'
-        major_events_pattern = r'##\s*重大事件.*?##'
-        
-        # 尝试匹配预设事件部分
-        preset_match = re.search(preset_pattern, scene_content, re.DOTALL | re.IGNORECASE)
+        # 尝试匹配"剧本预设事件"部分，提取所有列表项
+        preset_match = _PRESET_RE.search(scene_content)
         if preset_match:
-            preset_section = preset_match.group(0)
-            # 提取所有列表项
-            for line in preset_section.split('\n'):
-                if re.match(r'^\s*\d+\.', line) or re.match(r'^\s*[-*]', line):
-                    event = re.sub(r'^\s*\d+\.\s*', '', line)
-                    event = re.sub(r'^\s*[-*]\s*', '', event)
-                    event = re.sub(r'\*\*.*?\*\*', '', event)  # 移除粗体标记
-                    if event.strip():
-                        events.append(event.strip())
+            for m in _LIST_ITEM_RE.finditer(preset_match.group(0)):
+                event = _BOLD_RE.sub('', m.group(1)).strip()  # 移除粗体标记
+                if event:
+                    events.append(event)
         
         # 如果没有预设事件，尝试从重大事件中提取
         if not events:
-            major_match = re.search(major_events_pattern, scene_content, re.DOTALL | re.IGNORECASE)
+            major_match = _MAJOR_RE.search(scene_content)
             if major_match:
-                major_section = major_match.group(0)
-                for line in major_section.split('\n'):
-                    if re.match(r'^\s*[-*]', line):
-                        event = re.sub(r'^\s*[-*]\s*', '', line)
-                        if event.strip() and '暂无' not in event:
-                            events.append(event.strip())
+                for m in _BULLET_ITEM_RE.finditer(major_match.group(0)):
+                    event = m.group(1).strip()
+                    if event and '暂无' not in event:
+                        events.append(event)
         
         return events
     
@@ -64,21 +121,38 @@ class EnvironmentAnalyzer:
         events = []
         
         # 查找"重大事件"部分中已发生的事件
-        major_events_pattern = r'##\s*重大事件.*?##'
-        major_match = re.search(major_events_pattern, scene_content, re.DOTALL | re.IGNORECASE)
+        major_match = _MAJOR_RE.search(scene_content)
         
         if major_match:
-            major_section = major_match.group(0)
-            for line in major_section.split('\n'):
-                if re.match(r'^\s*[-*]', line):
-                    event = re.sub(r'^\s*[-*]\s*', '', line)
-                    if event.strip() and '暂无' not in event and '初始场景' not in event:
-                        # 移除角色名前缀（如果有）
-                        event = re.sub(r'^[^：:]+[：:]\s*', '', event)
-                        events.append(event.strip())
+            for m in _BULLET_ITEM_RE.finditer(major_match.group(0)):
+                event = m.group(1).strip()
+                if event and '暂无' not in event and '初始场景' not in event:
+                    # 移除角色名前缀（如果有）
+                    events.append(_PREFIX_RE.sub('', event, count=1).strip())
         
         return events
     
+    def _extract_all(self, scene_content: str) -> Tuple[List[str], List[str]]:
+        """
+        提取预设事件和已发生事件，相同的场景内容只解析一次
+        
+        Returns:
+            (preset_events, occurred_events)，均为新列表，调用方可以修改
+        """
+        key = hashlib.blake2b(scene_content.encode('utf-8'), digest_size=16).digest()
+        with self._extract_cache_lock:
+            cached = self._extract_cache.get(key)
+            if cached is not None:
+                self._extract_cache.move_to_end(key)
+        if cached is None:
+            cached = (tuple(self._extract_preset_events(scene_content)),
+                      tuple(self._extract_occurred_events(scene_content)))
+            with self._extract_cache_lock:
+                self._extract_cache[key] = cached
+                while len(self._extract_cache) > _EXTRACT_CACHE_SIZE:
+                    self._extract_cache.popitem(last=False)
+        return list(cached[0]), list(cached[1])
+    
     def _assess_pacing_before_action(self, scene_content: str, instruction: str) -> Dict:
         """
         在执行动作前评估剧情节奏，用于生成预期事件
@@ -90,11 +164,8 @@ class EnvironmentAnalyzer:
         Returns:
             剧情节奏评估结果
         """
-        # 从场景中提取已发生的事件
-        occurred_events = self._extract_occurred_events(scene_content)
-        
-        # 提取预设事件
-        preset_events = self._extract_preset_events(scene_content)
+        # 从场景中提取预设事件和已发生的事件
+        preset_events, occurred_events = self._extract_all(scene_content)
         
         # 判断是否需要触发事件
         should_trigger = False
@@ -110,7 +181,7 @@ class EnvironmentAnalyzer:
         
         # 规则2：如果指令是移动类，应该触发事件
         if instruction and isinstance(instruction, str):
-            if any(keyword in instruction.lower() for keyword in ['前进', '移动', '探索', '前往', '出发', '离开', '继续', '推进', '行进', '去', '到']):
+            if _INSTRUCTION_MOVE_RE.search(instruction):
                 should_trigger = True
                 trigger_reason = "队伍在移动中，应该遇到一些事件或线索"
         
@@ -132,22 +203,12 @@ class EnvironmentAnalyzer:
         """评估剧情节奏，判断是否需要触发事件"""
         previous_events = previous_events or []
         
-        # 从场景中提取已发生的事件
-        occurred_events = self._extract_occurred_events(scene_content)
+        # 从场景中提取预设事件和已发生的事件
+        preset_events, occurred_events = self._extract_all(scene_content)
         all_previous_events = previous_events + occurred_events
         
-        # 提取预设事件
-        preset_events = self._extract_preset_events(scene_content)
-        
         # 分析当前状态
-        responses_text = "\n\n".join([
-            f"【{resp.get('character_name', '未知')}】\n{resp.get('response', '')}"
-            for resp in agent_responses
-            if resp and isinstance(resp, dict)
-        ])
-        
-        # 确保responses_text不为None
-        responses_text = responses_text or ""
+        responses_text = _join_responses(agent_responses)
         
         # 判断是否需要触发事件
         should_trigger = False
@@ -162,8 +223,8 @@ class EnvironmentAnalyzer:
             trigger_reason = "剧情推进较慢，必须生成事件推动情节发展"
         
         # 规则2：如果角色在移动/探索，且没有遇到任何异常，必须触发（更严格）
-        if responses_text and any(keyword in responses_text.lower() for keyword in ['前进', '移动', '探索', '前往', '出发', '离开', '继续', '推进', '行进']):
-            if not any(keyword in responses_text.lower() for keyword in ['发现', '遭遇', '异常', '可疑', '听到', '看到', '注意到', '察觉', '痕迹', '线索', '声音', '动静']):
+        if responses_text and _RESPONSE_MOVE_RE.search(responses_text):
+            if not _OBSERVE_RE.search(responses_text):
                 should_trigger = True
                 trigger_reason = "队伍在移动中但未遇到任何事件，必须立即生成事件（如发现痕迹、听到声音、环境变化等）"
         
@@ -176,7 +237,7 @@ class EnvironmentAnalyzer:
         # 通过检查场景内容中的重大事件数量来判断
         if len(all_previous_events) >= 1 and len(all_previous_events) < 3:
             # 如果已经有事件但还不够，继续触发
-            if any(keyword in responses_text.lower() for keyword in ['前进', '移动', '探索', '前往', '出发', '离开', '继续', '推进']):
+            if _ADVANCE_RE.search(responses_text):
                 should_trigger = True
                 trigger_reason = "队伍已移动多步，必须生成新事件保持剧情节奏"
         
@@ -193,6 +254,10 @@ class EnvironmentAnalyzer:
         """
         分析智能体响应，提取环境变化
         
+        已弃用：环境变化分析已合并到导演评估（DirectorEvaluator.evaluate_as_director）中。
+        快速路径和缓存都未命中时，这里委托给 DirectorEvaluator.analyze_environment_changes，
+        进行一次完整的导演评估（一次LLM调用）。
+        
         Args:
             scene_content: 当前场景内容
             agent_responses: 所有智能体的响应列表
@@ -202,205 +267,168 @@ class EnvironmentAnalyzer:
             包含环境变化的字典
         """
         if not agent_responses:
-            return {
-                'scene_changes': {
-                    'surface': {},
-                    'hidden': {}
-                },
-                'major_events': [],
-                'decision_points': {'has_decision': False, 'description': '', 'options': []},
-                'status_summary': {'current_location': '', 'current_time': '', 'goal_progress': '', 'next_suggestions': []}
-            }
-        
-        # 收集所有响应文本
-        responses_text = "\n\n".join([
-            f"【{resp.get('character_name', '未知')}】\n{resp.get('response', '')}"
-            for resp in agent_responses
-            if resp and isinstance(resp, dict)
-        ])
+            return copy.deepcopy(_EMPTY_ANALYSIS)
+        
+        warnings.warn(
+            "EnvironmentAnalyzer.analyze_environment_changes 已弃用，请直接使用 DirectorEvaluator 的导演评估结果",
+            DeprecationWarning, stacklevel=2
+        )
+        
+        local_result, cache_key, pacing_hint = self._analyze_locally(scene_content, agent_responses, platform)
+        if local_result is not None:
+            return local_result
+        
+        # 环境变化由一次导演评估给出，这里只转换结果格式
+        result = self.director_evaluator.analyze_environment_changes(
+            scene_content, agent_responses, platform=platform, pacing_hint=pacing_hint,
+            preset_events=self._extract_all(scene_content)[0]
+        )
+        self._remember_analysis(cache_key, result)
+        return result
+    
+    def analyze_environment_changes_batch(self, items: List[Tuple[str, List[Dict]]],
+                                          platform: str = None) -> List[Dict]:
+        """
+        批量环境分析：多个回合（如回放存档、评估多个分支）合并为尽量少的LLM调用
         
-        # 评估剧情节奏
-        pacing_assessment = self._assess_pacing(scene_content, agent_responses)
+        不需要LLM的回合（没有响应、快速路径、缓存命中）直接得到结果；其余回合交给
+        DirectorEvaluator.evaluate_as_director_batch，按 DIRECTOR_BATCH_SIZE 合并请求，
+        合并结果缺少的回合单独重新评估。
         
-        # 详细日志输出到服务器端（不省略内容）
-        logger.info(f"\n{'='*80}")
-        logger.info(f"🎬 剧情控制器评估")
-        logger.info(f"{'='*80}")
-        logger.info(f"已发生事件数: {len(pacing_assessment.get('occurred_events', []))}")
-        if pacing_assessment.get('occurred_events'):
-            logger.info(f"已发生事件: {', '.join(pacing_assessment['occurred_events'][:3])}")
-        logger.info(f"预设事件数: {len(pacing_assessment.get('preset_events', []))}")
-        if pacing_assessment.get('preset_events'):
-            logger.info(f"预设事件: {', '.join(pacing_assessment['preset_events'][:3])}")
-        logger.info(f"是否需要触发事件: {pacing_assessment.get('should_trigger', False)}")
-        logger.info(f"触发原因: {pacing_assessment.get('trigger_reason', '无')}")
-        logger.info(f"节奏评分: {pacing_assessment.get('pacing_score', 'unknown')}")
-        logger.info(f"{'='*80}\n")
-        
-        preset_events_text = ""
-        if pacing_assessment.get('preset_events'):
-            preset_events_text = f"\n【预设事件】场景中包含以下预设事件，请根据当前情况判断是否应该触发：\n" + "\n".join([f"- {e}" for e in pacing_assessment['preset_events'][:10]])  # 增加到10个
-        
-        pacing_note = ""
-        if pacing_assessment.get('should_trigger'):
-            pacing_note = f"\n【⚠️ 强制要求 - 剧情节奏评估】{pacing_assessment['trigger_reason']}。\n**你必须生成至少1个重大事件，重大事件列表不能为空。**\n如果队伍在移动中，必须生成具体的事件描述（如发现痕迹、听到声音、环境变化等），不能返回空列表。"
-        
-        # 使用完整内容，不截断
-        scene_preview = scene_content
-        responses_preview = responses_text
-        
-        system_prompt = f"""环境分析：提取场景变化、重大事件、决策点和状态总结
-
-【场景】{scene_preview}{'...' if len(scene_content) > 1500 else ''}
-【响应】{responses_preview}{'...' if len(responses_text) > 1500 else ''}{preset_events_text}{pacing_note}
-
-提取内容：
-1. 场景变化（表/里）：
-   - surface: time, location{{region/specific_location/coordinates/environment}}, current_narrative, goal, resources
-   - hidden: final_goal, potential_enemies, risk_hints
-   
-2. 重大事件列表：
-   - {pacing_note.split('。')[0] if pacing_note else '根据当前行动和场景背景主动识别事件'}
-   - 如果场景中有预设事件，在适当时候应该触发（优先考虑预设事件）
-   - 事件示例：发现可疑痕迹、听到异常声音、环境变化、发现物品、遭遇敌人、发现线索、地形变化、天气变化、到达新地点等
-   - 事件应该具体、有画面感（如"发现地面有可疑的爪印"、"听到远处传来奇怪的声响"等）
-   
-3. 决策点检测：
-   - 判断是否需要玩家做出决策（如路线选择、行动方式、是否调查等）
-   - 如果发现线索、异常、需要选择的情况，必须标记为决策点
-   - 如果有决策点，提供决策描述和选项
-   
-4. 状态总结：
-   - 当前位置和时间（即使没有变化也要显示当前状态）
-   - 目标进度
-   - 下一步建议（2-3个可选行动，要具体可操作）
-
-关键规则：
-- **位置更新（最高优先级，必须与事件地点一致）**：
-  * **核心原则**：位置必须反映角色当前实际所在的地点，必须与事件发生地点一致
-  * 如果响应提到"抵达X地"、"到达X地"、"来到X地"、"进入X地"、"移动到X地"等，无论是否触发事件，location.specific_location必须更新为X地
-  * 如果响应提到"推进至X地并遇到Y事件"、"在X地附近遭遇Y"、"到达X地外围时发现Y"等，位置必须更新为X地（事件发生的地点）
-  * **事件与位置的关系**：
-    - 如果事件发生在移动过程中（如"推进至遗迹入口外围，雾中遭遇不明魔物"），位置必须更新到事件发生的地点（"遗迹入口外围"）
-    - 如果事件发生在起始位置（如"在公会大厅发现异常"），位置保持起始位置
-    - **禁止**：事件发生在X地，但位置显示为Y地（X≠Y）
-  * **位置信息必须与响应描述完全一致**：
-    - 如果响应说"抵达遗迹入口"，location.specific_location必须是"遗迹入口"
-    - 如果响应说"推进至遗迹入口外围"，location.specific_location应该是"遗迹入口外围"或"遗迹入口"
-    - 如果响应说"从公会出发，到达遗迹入口"，location.specific_location必须是"遗迹入口"（不是"公会大厅"）
-  * **禁止**：响应描述移动但位置不更新；位置更新但响应不描述移动；事件发生在A地但位置显示B地
-- **事件触发**：如果剧情节奏评估显示需要触发事件，必须生成至少1个事件；如果队伍在移动中，必须生成具体事件，不能总是"无异常"；禁止返回空的事件列表
-- **其他**：时间明显流逝需更新time；如果发现线索/异常/需要选择，必须标记为决策点
-
-输出JSON（重要：位置必须与事件发生地点一致）：
-{{
-    "scene_changes": {{"surface": {{"time": "", "location": {{"region": "", "specific_location": "", "coordinates": "", "environment": ""}}, "current_narrative": "", "goal": "", "resources": ""}}, "hidden": {{"final_goal": "", "potential_enemies": "", "risk_hints": ""}}}},
-    "major_events": [],
-    "decision_points": {{"has_decision": false, "description": "", "options": []}},
-    "status_summary": {{"current_location": "", "current_time": "", "goal_progress": "", "next_suggestions": []}}
-}}
-
-**位置更新检查清单**（必须全部满足）：
-1. 如果响应提到"抵达/到达/来到/进入/移动到"某个地点，location.specific_location必须更新为该地点
-2. 如果事件发生在移动过程中（如"推进至X地并遇到Y"），location.specific_location必须是X地（事件发生地点）
-3. location.specific_location必须与响应中描述的实际位置完全一致
-4. 禁止：事件发生在A地，但location.specific_location是B地（A≠B）
-5. 禁止：响应说"抵达遗迹入口"，但location.specific_location是"公会大厅"（这是严重错误）"""
+        Args:
+            items: (场景内容, Agent响应列表) 的列表
+            platform: API平台
         
-        user_message = "分析响应，提取变化和事件。"
+        Returns:
+            与 items 顺序一致的环境变化字典列表
+        """
+        results: List[Optional[Dict]] = [None] * len(items)
+        pending = []
+        for i, (scene_content, agent_responses) in enumerate(items):
+            if not agent_responses:
+                results[i] = copy.deepcopy(_EMPTY_ANALYSIS)
+                continue
+            local_result, cache_key, pacing_hint = self._analyze_locally(scene_content, agent_responses, platform)
+            if local_result is not None:
+                results[i] = local_result
+                continue
+            pending.append((i, cache_key, {
+                "scene_content": scene_content,
+                "agent_responses": agent_responses,
+                "pacing_hint": pacing_hint,
+                "events": self._extract_all(scene_content)[0],
+            }))
+        
+        if pending:
+            director_results = self.director_evaluator.evaluate_as_director_batch(
+                [context for _, _, context in pending], platform=platform
+            )
+            for (i, cache_key, _), director_result in zip(pending, director_results):
+                result = DirectorEvaluator.to_environment_changes(director_result["environment_analysis"])
+                self._remember_analysis(cache_key, result)
+                results[i] = result
+        return results
+    
+    def _analyze_locally(self, scene_content: str, agent_responses: List[Dict],
+                         platform: Optional[str]) -> Tuple[Optional[Dict], Optional[str], str]:
+        """
+        评估剧情节奏，并尝试不调用LLM得到结果（快速路径或最近回合的缓存）
         
-        platform = platform or self.config.DEFAULT_API_PLATFORM
+        Returns:
+            (本地结果或None, 缓存键或None, 剧情节奏提示)
+        """
+        # 评估剧情节奏
+        pacing_assessment = self._assess_pacing(scene_content, agent_responses)
         
-        # 调用LLM分析
-        try:
-            if platform.lower() == 'deepseek':
-                response_text = self.chat_service._call_deepseek_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='environment_analysis'
-                )
-            elif platform.lower() == 'openai':
-                response_text = self.chat_service._call_openai_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='environment_analysis'
-                )
-            elif platform.lower() == 'aizex':
-                response_text = self.chat_service._call_aizex_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='environment_analysis'
-                )
-            else:
-                raise ValueError(f"不支持的API平台: {platform}")
-        except Exception as e:
-            # API调用失败，返回空变化
-            logger.error(f"\n❌ 环境分析API调用失败: {e}")
-            logger.error(f"   场景内容长度: {len(scene_content)}")
-            logger.error(f"   响应文本长度: {len(responses_text)}")
-            return {
-                'scene_changes': {
-                    'surface': {},
-                    'hidden': {}
-                },
-                'major_events': [],
-                'decision_points': {'has_decision': False, 'description': '', 'options': []},
-                'status_summary': {'current_location': '', 'current_time': '', 'goal_progress': '', 'next_suggestions': []}
-            }
-        
-        # 解析响应
+        # 详细日志输出到服务器端（不省略内容）；INFO级别被过滤时不拼接字符串
+        if logger.isEnabledFor(logging.INFO):
+            occurred_events = pacing_assessment.get('occurred_events', [])
+            preset_events = pacing_assessment.get('preset_events', [])
+            logger.info("\n%s", '=' * 80)
+            logger.info("🎬 剧情控制器评估")
+            logger.info("%s", '=' * 80)
+            logger.info("已发生事件数: %d", len(occurred_events))
+            if occurred_events:
+                logger.info("已发生事件: %s", ', '.join(occurred_events[:3]))
+            logger.info("预设事件数: %d", len(preset_events))
+            if preset_events:
+                logger.info("预设事件: %s", ', '.join(preset_events[:3]))
+            logger.info("是否需要触发事件: %s", pacing_assessment.get('should_trigger', False))
+            logger.info("触发原因: %s", pacing_assessment.get('trigger_reason', '无'))
+            logger.info("节奏评分: %s", pacing_assessment.get('pacing_score', 'unknown'))
+            logger.info("%s\n", '=' * 80)
+        
+        # 快速路径：不需要触发事件，且Agent响应中没有移动/观察类行动时视为无事发生，不调用LLM
+        if self.config.ENVIRONMENT_ANALYSIS_FAST_PATH and not pacing_assessment.get('should_trigger'):
+            responses_text = _join_responses(agent_responses)
+            if not _RESPONSE_MOVE_RE.search(responses_text) and not _OBSERVE_RE.search(responses_text):
+                logger.info("⏭️ 本回合没有移动或观察类行动，跳过环境分析")
+                return copy.deepcopy(_EMPTY_ANALYSIS), None, ""
+        
+        # 与最近某一回合（或配置了磁盘缓存时，之前某次运行）的输入完全相同时直接复用结果，不再调用LLM
+        use_cache = self.config.ENVIRONMENT_ANALYSIS_CACHE_SIZE > 0 or self.config.LLM_RESPONSE_CACHE_DB
+        cache_key = self._analysis_cache_key(scene_content, agent_responses, platform) if use_cache else None
+        if cache_key is not None:
+            cached = self._lookup_analysis(cache_key)
+            if cached is not None:
+                logger.info("♻️ 场景和响应与之前的回合相同，复用环境分析结果")
+                return copy.deepcopy(cached), cache_key, ""
+        
+        pacing_hint = pacing_assessment['trigger_reason'] if pacing_assessment.get('should_trigger') else ""
+        return None, cache_key, pacing_hint
+    
+    def _lookup_analysis(self, cache_key: str) -> Optional[Dict]:
+        """查找缓存的分析结果：先查内存，未命中时查磁盘缓存（LLM_RESPONSE_CACHE_DB）并放回内存"""
+        with self._recent_cache_lock:
+            cached = self._recent_cache.get(cache_key)
+            if cached is not None:
+                self._recent_cache.move_to_end(cache_key)
+                return cached
+        stored = load_persisted(_PERSIST_PREFIX + cache_key, self.config.LLM_RESPONSE_CACHE_DB)
+        if stored is None:
+            return None
         try:
-            # 尝试提取JSON
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            
-            result = json.loads(response_text)
-            
-            # 详细日志输出分析结果到服务器端
+            cached = json_utils.loads(stored)
+        except json_utils.JSONDecodeError:
+            return None
+        self._store_recent(cache_key, cached)
+        return cached
+    
+    def _store_recent(self, cache_key: str, result: Dict):
+        """放入内存中的最近结果缓存（LRU淘汰）"""
+        cache_size = self.config.ENVIRONMENT_ANALYSIS_CACHE_SIZE
+        if cache_size <= 0:
+            return
+        with self._recent_cache_lock:
+            self._recent_cache[cache_key] = result
+            self._recent_cache.move_to_end(cache_key)
+            while len(self._recent_cache) > cache_size:
+                self._recent_cache.popitem(last=False)
+    
+    def _remember_analysis(self, cache_key: Optional[str], result: Dict):
+        """缓存分析结果（内存，配置了磁盘缓存时同时写入磁盘）并输出日志；评估失败时返回的默认结果没有场景叙述，不缓存"""
+        if cache_key is not None and result.get('scene_changes', {}).get('surface', {}).get('current_narrative'):
+            self._store_recent(cache_key, copy.deepcopy(result))
+            persist(_PERSIST_PREFIX + cache_key, json_utils.dumps(result),
+                    self.config.LLM_RESPONSE_CACHE_DB)
+        
+        # 详细日志输出分析结果到服务器端
+        if logger.isEnabledFor(logging.INFO):
             major_events = result.get('major_events', [])
-            decision_points = result.get('decision_points', {})
-            logger.info(f"\n📊 环境分析结果:")
-            logger.info(f"   重大事件数: {len(major_events)}")
-            if major_events:
-                for i, event in enumerate(major_events, 1):
-                    logger.info(f"   {i}. {event[:100]}{'...' if len(event) > 100 else ''}")
-            logger.info(f"   是否有决策点: {decision_points.get('has_decision', False)}")
-            if decision_points.get('has_decision'):
-                logger.info(f"   决策描述: {decision_points.get('description', '')[:100]}")
+            logger.info("\n📊 环境分析结果:")
+            logger.info("   重大事件数: %d", len(major_events))
+            for i, event in enumerate(major_events, 1):
+                event = str(event)
+                logger.info("   %d. %s%s", i, event[:100], '...' if len(event) > 100 else '')
             logger.info("")
-            
-            return {
-                'scene_changes': result.get('scene_changes', {'surface': {}, 'hidden': {}}),
-                'major_events': major_events,
-                'decision_points': decision_points,
-                'status_summary': result.get('status_summary', {'current_location': '', 'current_time': '', 'goal_progress': '', 'next_suggestions': []})
-            }
-        except json.JSONDecodeError:
-            # 如果解析失败，返回空变化
-            return {
-                'scene_changes': {
-                    'surface': {},
-                    'hidden': {}
-                },
-                'major_events': [],
-                'decision_points': {'has_decision': False, 'description': '', 'options': []},
-                'status_summary': {'current_location': '', 'current_time': '', 'goal_progress': '', 'next_suggestions': []}
-            }
-        except Exception as e:
-            logger.error(f"环境分析失败: {e}")
-            return {
-                'scene_changes': {
-                    'surface': {},
-                    'hidden': {}
-                },
-                'major_events': [],
-                'decision_points': {'has_decision': False, 'description': '', 'options': []},
-                'status_summary': {'current_location': '', 'current_time': '', 'goal_progress': '', 'next_suggestions': []}
-            }
-
+    
+    async def analyze_environment_changes_async(self, scene_content: str, agent_responses: List[Dict],
+                                                platform: str = None) -> Dict:
+        """
+        analyze_environment_changes 的异步版本：LLM等待在线程中进行，不阻塞事件循环
+        
+        与导演评估共用并发上限（DIRECTOR_MAX_CONCURRENCY），调用方可以和Agent响应生成等IO并发执行。
+        """
+        async with self.director_evaluator._get_semaphore():
+            return await asyncio.to_thread(self.analyze_environment_changes, scene_content,
+                                           agent_responses, platform)
@@ -1,6 +1,7 @@
 """
 环境管理器：管理场景状态、处理智能体响应、更新环境
 """
+import asyncio
 import os
 from typing import Dict, List, Optional
 from config import Config
@@ -87,6 +88,10 @@ class EnvironmentManager:
         
         return None
     
+    async def load_scene_async(self, theme: str, save_step: Optional[str] = None) -> Optional[str]:
+        """load_scene 的异步版本，文件读取在线程中进行，可与LLM调用并发（asyncio.gather）"""
+        return await asyncio.to_thread(self.load_scene, theme, save_step)
+    
     def _build_scene_content(self, description: str, state: Dict, room_id: Optional[str], scene_id: str, monsters_info: Optional[Dict] = None) -> str:
         """
         构建场景内容
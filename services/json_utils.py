@@ -0,0 +1,142 @@
+"""
+JSON编解码工具：优先使用orjson（更快），未安装时回退到标准库json
+"""
+import json
+import re
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖
+    orjson = None
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，统一捕获这个即可
+JSONDecodeError = json.JSONDecodeError
+
+# raw_decode 从指定位置解析出一个完整值即停止，允许后面还有其他文本
+_DECODER = json.JSONDecoder()
+
+# JSON结构字符，用于括号匹配扫描
+_JSON_STRUCT_RE = re.compile(r'[{}"\\]')
+
+
+def loads(data) -> Any:
+    """解析JSON文本（str 或 bytes）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    """序列化为JSON字符串（保留非ASCII字符）"""
+    if orjson is not None:
+        return dump_bytes(obj, indent=indent, sort_keys=sort_keys).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None, sort_keys=sort_keys)
+
+
+def dump_bytes(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """序列化为UTF-8编码的JSON字节串，用于一次性写入文件"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+    return json.dumps(
+        obj, ensure_ascii=False, indent=2 if indent else None, sort_keys=sort_keys
+    ).encode('utf-8')
+
+
+def find_object_end(text: str, start: int) -> int:
+    """
+    从 start 处的 '{' 开始做括号深度计数（忽略字符串中的括号），返回匹配的 '}' 之后的位置；
+    对象尚未结束时返回 -1
+    """
+    # 只在结构字符（括号、引号、反斜杠）之间跳跃，避免逐字符的Python循环
+    depth = 0
+    in_string = False
+    escaped_until = -1
+    for match in _JSON_STRUCT_RE.finditer(text, start):
+        i = match.start()
+        if i < escaped_until:
+            continue
+        ch = match.group()
+        if in_string:
+            if ch == '\\':
+                escaped_until = i + 2
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+
+def _scan_object(text: str) -> str:
+    """
+    截取第一个完整的JSON对象（跳过字符串内的括号）
+    
+    找不到起始括号时原样返回；括号未闭合（响应被截断）时取到最后一个右括号，交给JSON解析报错。
+    """
+    start = text.find('{')
+    if start < 0:
+        return text
+    # 多数情况下第一个对象本身是合法JSON，由C实现的解码器直接找到结尾
+    try:
+        return text[start:_DECODER.raw_decode(text, start)[1]]
+    except JSONDecodeError:
+        pass
+    end = find_object_end(text, start)
+    if end != -1:
+        return text[start:end]
+    end = text.rfind('}')
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def _strip_fence(text: str) -> str:
+    """去掉代码块标记（语言标记不区分大小写，缺少结尾标记时取到末尾）"""
+    text = text.strip()
+    _, fence, fenced = text.partition("```")
+    if fence:
+        if fenced[:4].lower() == "json":
+            fenced = fenced[4:]
+        text = fenced.partition("```")[0].strip()
+    return text
+
+
+def extract_json_block(text: str) -> str:
+    """从LLM响应中提取JSON对象文本（去掉 ```json 代码块标记和前后的说明文字）"""
+    return _scan_object(_strip_fence(text))
+
+
+def parse_json_lenient(text: str) -> Optional[Any]:
+    """
+    解析LLM响应中的JSON：先直接解析（JSON模式），失败时从代码块/说明文字中的第一个 { 处解析，仍失败返回None
+    
+    代码块内的字符串本身含有 ``` 时，按代码块截取会截断JSON，此时再从原文本中解析。
+    """
+    try:
+        return loads(text)
+    except JSONDecodeError:
+        pass
+    fenced = _strip_fence(text)
+    # 代码块内通常就是完整的JSON对象，先用（orjson）直接解析
+    try:
+        return loads(fenced)
+    except JSONDecodeError:
+        pass
+    for candidate in (fenced, text):
+        start = candidate.find('{')
+        if start < 0:
+            continue
+        try:
+            return _DECODER.raw_decode(candidate, start)[0]
+        except JSONDecodeError:
+            continue
+    return None
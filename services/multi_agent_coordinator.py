@@ -7,8 +7,8 @@ import time
 import logging
 import traceback
 from typing import Dict, List, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from services.agent import Agent, format_agent_response
+from services.agent import Agent, format_agent_response, is_json_object_complete
+from services.chat_service import get_default_chat_service
 from services.environment_manager import EnvironmentManager
 from services.response_aggregator import ResponseAggregator
 from services.response_formatter import ResponseFormatter
@@ -30,6 +30,7 @@ class MultiAgentCoordinator:
     
     def __init__(self, config: Config):
         self.config = config
+        self.chat_service = get_default_chat_service()
         self.character_store = CharacterStore(config)
         self.environment_manager = EnvironmentManager(config)
         self.response_aggregator = ResponseAggregator(config)
@@ -64,6 +65,22 @@ class MultiAgentCoordinator:
                     return role
         return None
     
+    def _agent_failure_response(self, agent: Agent, error: Exception) -> Dict:
+        """智能体处理失败时的占位响应"""
+        logger.error(f"❌ 智能体处理失败: {agent.character_name}, 错误: {error}")
+        logger.error(traceback.format_exc())
+        return {
+            'character_id': agent.character_id,
+            'character_name': agent.character_name,
+            'response': {
+                'dialogue': f'处理失败: {str(error)}',
+                'action_intent': ''
+            },
+            'hidden': {
+                'inner_monologue': f'处理失败: {str(error)}'
+            }
+        }
+    
     def process_instruction(self, instruction: str, theme: str, 
                            save_step: Optional[str] = None,
                            character_ids: Optional[List[str]] = None,
@@ -180,7 +197,7 @@ class MultiAgentCoordinator:
             else:
                 characters = []
                 for char_id in character_ids:
-                    char = self.character_store.get_character(char_id)
+                    char = self.character_store.get_character(char_id, theme)
                     if char:
                         characters.append(char)
                 logger.info(f"✅ 加载指定角色，找到 {len(characters)} 个角色")
@@ -196,59 +213,68 @@ class MultiAgentCoordinator:
             
             if characters:
                 logger.info(f"🤖 创建 {len(characters)} 个重要角色的智能体...")
-                agents = [Agent(char, self.config) for char in characters]
+                agents = [Agent(char, self.config, self.chat_service) for char in characters]
                 
-                # 使用线程池并行处理
-                logger.info("🚀 开始并行调用智能体...")
-                with ThreadPoolExecutor(max_workers=len(agents)) as executor:
-                    futures = {
-                        executor.submit(
-                            agent.process_instruction,
-                            instruction,
-                            scene_content,
-                            platform,
-                            save_step,
-                            player_role,
-                            conversation_history_text,
+                # 先查询响应缓存，未命中的智能体请求合并为一批并发发送
+                logger.info("🚀 开始批量调用智能体...")
+                resolved_platform = platform or self.config.DEFAULT_API_PLATFORM
+                responses = [None] * len(agents)
+                pending = []  # (序号, agent, cache_key, messages)
+                for index, agent in enumerate(agents):
+                    try:
+                        cache_key, cached = agent.lookup_cached_response(
+                            instruction, scene_content, resolved_platform,
+                            player_role, conversation_history_text,
                             None  # 不再传递预期事件，统一停止点由导演评估决定
-                        ): agent for agent in agents
-                    }
-                    
-                    for future in as_completed(futures):
+                        )
+                        if cached is not None:
+                            logger.info(f"♻️ 命中响应缓存: {agent.character_name}")
+                            responses[index] = cached
+                            continue
+                        messages = agent.build_messages(
+                            instruction, scene_content, player_role, conversation_history_text, None
+                        )
+                        pending.append((index, agent, cache_key, messages))
+                    except Exception as e:
+                        responses[index] = self._agent_failure_response(agent, e)
+                
+                if pending:
+                    batch_results = self.chat_service.batch_call_api(
+                        [messages for _, _, _, messages in pending],
+                        platform=resolved_platform,
+                        operation='agent_response',
+                        contexts=[{'character_id': agent.character_id, 'theme': agent.theme}
+                                  for _, agent, _, _ in pending],
+                        stop_when=is_json_object_complete
+                    )
+                    for (index, agent, cache_key, _), result in zip(pending, batch_results):
                         try:
-                            response = future.result()
-                            if response:
-                                agent_responses.append(response)
-                                logger.info(f"✅ 收到响应: {response.get('character_name', '未知')}")
+                            if isinstance(result, Exception):
+                                response = agent.build_error_response(result)
                             else:
-                                agent = futures[future]
-                                logger.warning(f"⚠️ 收到空响应: {agent.character_name}")
-                                agent_responses.append({
-                                    'character_id': agent.character_id,
-                                    'character_name': agent.character_name,
-                                    'response': {
-                                        'dialogue': '响应为空',
-                                        'action_intent': ''
-                                    },
-                                    'hidden': {
-                                        'inner_monologue': ''
-                                    }
-                                })
+                                response = agent.parse_response(result, cache_key)
                         except Exception as e:
-                            agent = futures[future]
-                            logger.error(f"❌ 智能体处理失败: {agent.character_name}, 错误: {e}")
-                            logger.error(traceback.format_exc())
-                            agent_responses.append({
+                            responses[index] = self._agent_failure_response(agent, e)
+                            continue
+                        if response:
+                            logger.info(f"✅ 收到响应: {response.get('character_name', '未知')}")
+                        else:
+                            logger.warning(f"⚠️ 收到空响应: {agent.character_name}")
+                            response = {
                                 'character_id': agent.character_id,
                                 'character_name': agent.character_name,
                                 'response': {
-                                    'dialogue': f'处理失败: {str(e)}',
+                                    'dialogue': '响应为空',
                                     'action_intent': ''
                                 },
                                 'hidden': {
-                                    'inner_monologue': f'处理失败: {str(e)}'
+                                    'inner_monologue': ''
                                 }
-                            })
+                            }
+                        responses[index] = response
+                
+                # 按角色顺序收集响应
+                agent_responses = [response for response in responses if response is not None]
                 
                 logger.info(f"✅ 收到 {len(agent_responses)} 个重要角色的响应")
             else:
@@ -297,7 +323,6 @@ class MultiAgentCoordinator:
             
             # 从环境变化分析中提取环境变化信息（用于后续状态更新）
             updated_scene_description = environment_analysis.get("updated_scene_description", "")
-            scene_state_changes = environment_analysis.get("scene_state_changes", {})
             agent_execution_results = environment_analysis.get("agent_execution_results", [])
             
             # 合并事件描述和怪物描述到场景描述中（如果有事件或怪物出现）
@@ -320,26 +345,11 @@ class MultiAgentCoordinator:
                 else:
                     updated_scene_description = combined_description
             
-            # 构建environment_changes格式（兼容旧代码）
-            # 处理location可能是字符串或字典的情况
-            location_data = scene_state_changes.get("location", {})
-            if isinstance(location_data, str):
-                # 如果是字符串，转换为字典格式
-                location_data = {'specific_location': location_data}
-            elif not isinstance(location_data, dict):
-                location_data = {}
-            
-            environment_changes = {
-                "scene_changes": {
-                    "surface": {
-                        "location": location_data,
-                        "time": scene_state_changes.get("time", ""),
-                        "current_narrative": updated_scene_description if updated_scene_description else ""
-                    },
-                    "hidden": {}
-                },
-                "agent_execution_results": agent_execution_results
-            }
+            # 构建environment_changes格式（与环境分析器的结果格式一致）
+            environment_changes = self.director_evaluator.to_environment_changes({
+                **environment_analysis,
+                "updated_scene_description": updated_scene_description
+            })
             
             # 处理导演决策
             elapsed_time = director_decision.get("elapsed_time", 1.0)
@@ -455,7 +465,7 @@ class MultiAgentCoordinator:
                         )
                 
                 # 更新场景状态（从环境变化分析结果中提取）
-                major_events = self._extract_major_events(agent_responses)
+                major_events = environment_changes.get('major_events') or self._extract_major_events(agent_responses)
                 # 从environment_analysis中提取场景变化
                 scene_changes = environment_changes.get('scene_changes', {})
                 surface_changes = scene_changes.get('surface', {})
@@ -492,18 +502,15 @@ class MultiAgentCoordinator:
                     scene_changes,
                     major_events
                 )
-                # 验证位置是否已更新
-                updated_scene_check = self.environment_manager.load_scene(theme, new_step)
-                if updated_scene_check:
-                    location_check = re.search(r'\*\*具体位置\*\*[：:]\s*([^\n]+)', updated_scene_check)
+                # 6.4 加载更新后的场景（用于验证位置和格式化，只读取一次）
+                updated_scene_content = self.environment_manager.load_scene(theme, new_step)
+                if updated_scene_content:
+                    # 验证位置是否已更新
+                    location_check = re.search(r'\*\*具体位置\*\*[：:]\s*([^\n]+)', updated_scene_content)
                     if location_check:
                         logger.info(f"✅ 场景位置已更新为: {location_check.group(1).strip()}")
                     else:
                         logger.warning(f"⚠️ 场景位置更新后无法提取位置信息")
-                
-                # 6.4 加载更新后的场景（用于格式化）
-                updated_scene_content = self.environment_manager.load_scene(theme, new_step)
-                if updated_scene_content:
                     scene_content = updated_scene_content
                     # 使用更新后的场景内容来生成环境状态摘要
                     environment_changes['updated_scene_content'] = updated_scene_content
@@ -1003,6 +1010,7 @@ class MultiAgentCoordinator:
                     hidden = resp.get("hidden", {})
                     inner_monologue = hidden.get("inner_monologue", "") if isinstance(hidden, dict) else ""
                     agent_responses_summary.append({
+                        "character_id": resp.get("character_id", ""),
                         "character_name": resp.get("character_name", "未知"),
                         "response": response_text,
                         "inner_monologue": inner_monologue if inner_monologue else ""
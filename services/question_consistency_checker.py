@@ -1,12 +1,22 @@
 """
 提问一致性检查器：检查提问回答与历史信息的一致性
 """
+import copy
 import json
 import os
 from typing import Dict, List, Optional, Tuple
+from services import json_utils
 from services.chat_service import ChatService
 from config import Config
 
+# 检查失败时返回的默认提取信息（返回深拷贝）
+_EMPTY_EXTRACTED_INFO = {
+    'concretized_info': {'surface': {}, 'hidden': {}},
+    'scene_updates': {'surface': {}, 'hidden': {}},
+    'major_events': [],
+    'character_updates': {}
+}
+
 
 class QuestionConsistencyChecker:
     """提问一致性检查器"""
@@ -173,51 +183,23 @@ class QuestionConsistencyChecker:
                 operation = 'consistency_check'
             
             try:
-                if platform.lower() == 'deepseek':
-                    response_text = self.chat_service._call_deepseek_api(
-                        [{"role": "system", "content": check_prompt},
-                         {"role": "user", "content": "检查一致性并提取信息。"}],
-                        operation='consistency_check',
-                        context={'theme': theme, 'question': question[:50]}
-                    )
-                elif platform.lower() == 'openai':
-                    response_text = self.chat_service._call_openai_api(
-                        [{"role": "system", "content": check_prompt},
-                         {"role": "user", "content": "检查一致性并提取信息。"}],
-                        operation='consistency_check',
-                        context={'theme': theme, 'question': question[:50]}
-                    )
-                elif platform.lower() == 'aizex':
-                    response_text = self.chat_service._call_aizex_api(
-                        [{"role": "system", "content": check_prompt},
-                         {"role": "user", "content": "检查一致性并提取信息。"}],
-                        operation='consistency_check',
-                        context={'theme': theme, 'question': question[:50]}
-                    )
-                else:
-                    raise ValueError(f"不支持的API平台: {platform}")
+                response_text = self.chat_service.platform_method(platform)(
+                    [{"role": "system", "content": check_prompt},
+                     {"role": "user", "content": "检查一致性并提取信息。"}],
+                    operation='consistency_check',
+                    context={'theme': theme, 'question': question[:50]}
+                )
             except Exception as e:
                 # API调用失败，返回默认值
                 print(f"一致性检查API调用失败: {e}")
-                return 0.5, f"一致性检查失败: {str(e)}", {
-                    'concretized_info': {'surface': {}, 'hidden': {}},
-                    'scene_updates': {'surface': {}, 'hidden': {}},
-                    'major_events': [],
-                    'character_updates': {}
-                }
+                return 0.5, f"一致性检查失败: {str(e)}", copy.deepcopy(_EMPTY_EXTRACTED_INFO)
             
             # 解析响应
             try:
-                if "```json" in response_text:
-                    json_start = response_text.find("```json") + 7
-                    json_end = response_text.find("```", json_start)
-                    response_text = response_text[json_start:json_end].strip()
-                elif "```" in response_text:
-                    json_start = response_text.find("```") + 3
-                    json_end = response_text.find("```", json_start)
-                    response_text = response_text[json_start:json_end].strip()
+                # 提取JSON（去掉代码块标记和前后的说明文字）
+                response_text = json_utils.extract_json_block(response_text)
                 
-                result = json.loads(response_text)
+                result = json_utils.loads(response_text)
                 score = float(result.get('consistency_score', 0.5))
                 feedback = result.get('consistency_feedback', '')
                 concretized_info = result.get('concretized_info', {'surface': {}, 'hidden': {}})
@@ -234,19 +216,9 @@ class QuestionConsistencyChecker:
                     'major_events': major_events,
                     'character_updates': character_updates
                 }
-            except json.JSONDecodeError:
+            except json_utils.JSONDecodeError:
                 # 如果解析失败，返回默认值
-                return 0.5, "解析一致性检查结果失败", {
-                    'concretized_info': {'surface': {}, 'hidden': {}},
-                    'scene_updates': {'surface': {}, 'hidden': {}},
-                    'major_events': [],
-                    'character_updates': {}
-                }
+                return 0.5, "解析一致性检查结果失败", copy.deepcopy(_EMPTY_EXTRACTED_INFO)
         except Exception as e:
-            return 0.5, f"一致性检查失败: {str(e)}", {
-                'concretized_info': {'surface': {}, 'hidden': {}},
-                'scene_updates': {'surface': {}, 'hidden': {}},
-                'major_events': [],
-                'character_updates': {}
-            }
+            return 0.5, f"一致性检查失败: {str(e)}", copy.deepcopy(_EMPTY_EXTRACTED_INFO)
 
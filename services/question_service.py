@@ -61,7 +61,7 @@ class QuestionService:
         else:
             characters = []
             for char_id in character_ids:
-                char = self.character_store.get_character(char_id)
+                char = self.character_store.get_character(char_id, theme)
                 if char:
                     characters.append(char)
         
@@ -84,29 +84,13 @@ class QuestionService:
         
         # 5. 调用LLM回答问题
         try:
-            if platform.lower() == 'deepseek':
-                answer = self.chat_service._call_deepseek_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='question_answer',
-                    context={'theme': theme, 'question': question[:50]}
-                )
-            elif platform.lower() == 'openai':
-                answer = self.chat_service._call_openai_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='question_answer',
-                    context={'theme': theme, 'question': question[:50]}
-                )
-            elif platform.lower() == 'aizex':
-                answer = self.chat_service._call_aizex_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='question_answer',
-                    context={'theme': theme, 'question': question[:50]}
-                )
-            else:
-                raise ValueError(f"不支持的API平台: {platform}")
+            # 按平台查表取调用方法（不支持的平台抛出ValueError）
+            answer = self.chat_service.platform_method(platform)(
+                [{"role": "system", "content": system_prompt},
+                 {"role": "user", "content": user_message}],
+                operation='question_answer',
+                context={'theme': theme, 'question': question[:50]}
+            )
         except Exception as e:
             return {
                 "error": f"回答问题失败: {str(e)}",
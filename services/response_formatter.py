@@ -1,9 +1,9 @@
 """
 响应格式化器：将Agent的JSON响应转换为适合玩家角色的文本
 """
-import json
 import re
 from typing import Dict, List, Optional
+from services import json_utils
 from services.chat_service import ChatService
 from services.agent import format_agent_response
 from config import Config
@@ -153,26 +153,11 @@ class ResponseFormatter:
         
         # 调用LLM格式化
         try:
-            if platform.lower() == 'deepseek':
-                response_text = self.chat_service._call_deepseek_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='response_formatting'
-                )
-            elif platform.lower() == 'openai':
-                response_text = self.chat_service._call_openai_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='response_formatting'
-                )
-            elif platform.lower() == 'aizex':
-                response_text = self.chat_service._call_aizex_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='response_formatting'
-                )
-            else:
-                raise ValueError(f"不支持的API平台: {platform}")
+            response_text = self.chat_service.platform_method(platform)(
+                [{"role": "system", "content": system_prompt},
+                 {"role": "user", "content": user_message}],
+                operation='response_formatting'
+            )
         except Exception as e:
             # API调用失败，使用简单格式化
             print(f"⚠️ 响应格式化API调用失败: {e}")
@@ -181,17 +166,10 @@ class ResponseFormatter:
         
         # 解析响应
         try:
-            # 尝试提取JSON
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
+            # 提取JSON（去掉代码块标记和前后的说明文字）
+            response_text = json_utils.extract_json_block(response_text)
             
-            result = json.loads(response_text)
+            result = json_utils.loads(response_text)
             formatted_responses = result.get('formatted_responses', [])
             summary = result.get('summary', '')
             
@@ -213,7 +191,7 @@ class ResponseFormatter:
                 # 摘要不符合要求，使用fallback
                 print(f"⚠️ LLM返回的摘要不符合要求，使用fallback方法")
                 return self._simple_format(agent_responses, scene_content)
-        except json.JSONDecodeError as e:
+        except json_utils.JSONDecodeError as e:
             # 如果解析失败，使用简单格式化
             print(f"⚠️ JSON解析失败: {e}")
             print(f"   LLM返回内容: {response_text[:200]}...")
@@ -321,27 +299,16 @@ class ResponseFormatter:
             
             platform = self.config.DEFAULT_API_PLATFORM
             
-            # 调用LLM生成摘要
-            if platform.lower() == 'deepseek':
-                summary = self.chat_service._call_deepseek_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='summary_generation'
-                )
-            elif platform.lower() == 'openai':
-                summary = self.chat_service._call_openai_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='summary_generation'
-                )
-            elif platform.lower() == 'aizex':
-                summary = self.chat_service._call_aizex_api(
-                    [{"role": "system", "content": system_prompt},
-                     {"role": "user", "content": user_message}],
-                    operation='summary_generation'
-                )
-            else:
+            # 调用LLM生成摘要（不支持的平台不生成摘要）
+            try:
+                call_api = self.chat_service.platform_method(platform)
+            except ValueError:
                 return ""
+            summary = call_api(
+                [{"role": "system", "content": system_prompt},
+                 {"role": "user", "content": user_message}],
+                operation='summary_generation'
+            )
             
             # 清理摘要（移除可能的markdown标记和推理标记）
             summary = summary.strip()
@@ -3,9 +3,50 @@
 """
 import os
 import json
-from typing import Dict, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 from config import Config
 
+# 存档文件读取缓存的最大条目数
+_FILE_CACHE_SIZE = 128
+
+# 存档文件内容缓存：路径 -> ((修改时间ns, 大小, inode), 内容)，进程内所有实例共享，
+# 每回合多次加载场景时只需stat一次
+_file_cache: "OrderedDict[str, Tuple[Tuple[int, int, int], str]]" = OrderedDict()
+_file_cache_lock = threading.Lock()
+
+
+def _read_text(path: str) -> Optional[str]:
+    """
+    读取存档中的文本文件，文件不存在返回None
+    
+    修改时间、大小和inode与缓存一致时直接返回缓存内容，不再打开文件。
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _file_cache_lock:
+        cached = _file_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _file_cache.move_to_end(path)
+            return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    with _file_cache_lock:
+        _file_cache[path] = (signature, content)
+        while len(_file_cache) > _FILE_CACHE_SIZE:
+            _file_cache.popitem(last=False)
+    return content
+
+
+def _forget(path: str):
+    """写入或删除文件后丢弃缓存（不依赖文件系统修改时间的精度）"""
+    with _file_cache_lock:
+        _file_cache.pop(path, None)
+
 
 class SceneStateManager:
     """场景状态管理器"""
@@ -33,13 +74,13 @@ class SceneStateManager:
             "SCENE_ID.txt"
         )
         
-        if os.path.exists(scene_id_file):
-            try:
-                with open(scene_id_file, "r", encoding="utf-8") as f:
-                    scene_id = f.read().strip()
-                    return scene_id if scene_id else None
-            except Exception:
-                pass
+        try:
+            content = _read_text(scene_id_file)
+        except Exception:
+            content = None
+        if content is not None:
+            scene_id = content.strip()
+            return scene_id if scene_id else None
         
         return None
     
@@ -62,13 +103,13 @@ class SceneStateManager:
             "ROOM_ID.txt"
         )
         
-        if os.path.exists(room_id_file):
-            try:
-                with open(room_id_file, "r", encoding="utf-8") as f:
-                    room_id = f.read().strip()
-                    return room_id if room_id else None
-            except Exception:
-                pass
+        try:
+            content = _read_text(room_id_file)
+        except Exception:
+            content = None
+        if content is not None:
+            room_id = content.strip()
+            return room_id if room_id else None
         
         return None
     
@@ -92,6 +133,7 @@ class SceneStateManager:
         try:
             with open(scene_id_file, "w", encoding="utf-8") as f:
                 f.write(scene_id)
+            _forget(scene_id_file)
             return True
         except Exception as e:
             print(f"设置场景ID失败: {e}")
@@ -122,6 +164,7 @@ class SceneStateManager:
                 # 如果room_id为None，删除文件（表示在一级场景中）
                 if os.path.exists(room_id_file):
                     os.remove(room_id_file)
+            _forget(room_id_file)
             return True
         except Exception as e:
             print(f"设置房间ID失败: {e}")
@@ -146,12 +189,13 @@ class SceneStateManager:
             "SCENE_STATE.json"
         )
         
-        if os.path.exists(state_file):
-            try:
-                with open(state_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception:
-                pass
+        try:
+            content = _read_text(state_file)
+            if content is not None:
+                # 每次返回新解析的字典，调用方可以直接修改
+                return json.loads(content)
+        except Exception:
+            pass
         
         # 返回默认状态
         return {
@@ -200,6 +244,7 @@ class SceneStateManager:
         try:
             with open(state_file, "w", encoding="utf-8") as f:
                 json.dump(current_state, f, ensure_ascii=False, indent=2)
+            _forget(state_file)
             return True
         except Exception as e:
             print(f"更新场景状态失败: {e}")
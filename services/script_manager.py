@@ -4,9 +4,23 @@
 import os
 import json
 import re
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional, Tuple
 from config import Config
 
+# 场景/房间剧本缓存的最大条目数
+_SCRIPT_CACHE_SIZE = 256
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """文件的(修改时间ns, 大小, inode)，文件不存在返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
 
 class ScriptManager:
     """剧本管理器"""
@@ -15,10 +29,37 @@ class ScriptManager:
         self.config = config
         self.base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
         self._story_overview_cache = {}  # 故事总览缓存
-        self._scene_script_cache = {}  # 场景剧本缓存
-        self._room_script_cache = {}  # 房间剧本缓存
+        # 场景/房间剧本缓存：键 -> (文件路径, 文件签名, 剧本)，按最近使用淘汰，文件修改后重新解析
+        self._scene_script_cache: "OrderedDict[str, Tuple[str, Tuple[int, int, int], Dict]]" = OrderedDict()
+        self._room_script_cache: "OrderedDict[str, Tuple[str, Tuple[int, int, int], Dict]]" = OrderedDict()
+        self._script_cache_lock = threading.Lock()
         self._monster_cache = {}  # 怪物卡缓存
     
+    def _get_cached_script(self, cache: OrderedDict, cache_key: str) -> Optional[Dict]:
+        """剧本文件未修改时返回缓存的剧本，否则返回None"""
+        with self._script_cache_lock:
+            cached = cache.get(cache_key)
+        if cached is None:
+            return None
+        path, signature, script = cached
+        if _file_signature(path) != signature:
+            return None
+        with self._script_cache_lock:
+            if cache_key in cache:
+                cache.move_to_end(cache_key)
+        return script
+    
+    def _cache_script(self, cache: OrderedDict, cache_key: str, path: str,
+                      signature: Optional[Tuple[int, int, int]], script: Dict):
+        """记录剧本及其来源文件的签名（签名在读取前获取，读取期间的修改会在下次访问时发现）"""
+        if signature is None:
+            return
+        with self._script_cache_lock:
+            cache[cache_key] = (path, signature, script)
+            cache.move_to_end(cache_key)
+            while len(cache) > _SCRIPT_CACHE_SIZE:
+                cache.popitem(last=False)
+    
     def load_story_overview(self, theme: str) -> Dict:
         """
         加载故事总览
@@ -266,8 +307,9 @@ class ScriptManager:
             场景剧本字典
         """
         cache_key = f"{theme}:{scene_id}"
-        if cache_key in self._scene_script_cache:
-            return self._scene_script_cache[cache_key]
+        cached = self._get_cached_script(self._scene_script_cache, cache_key)
+        if cached is not None:
+            return cached
         
         # 优先尝试加载JSON格式（支持可读文件名：scene_001_名称.json）
         scenarios_dir = os.path.join(
@@ -287,11 +329,12 @@ class ScriptManager:
         
         if json_path and os.path.exists(json_path):
             try:
+                signature = _file_signature(json_path)
                 with open(json_path, "r", encoding="utf-8") as f:
                     script = json.load(f)
                 # 验证 scene_id 是否匹配
                 if script.get('scene_id') == scene_id:
-                    self._scene_script_cache[cache_key] = script
+                    self._cache_script(self._scene_script_cache, cache_key, json_path, signature, script)
                     return script
             except Exception as e:
                 print(f"加载场景剧本JSON失败: {e}")
@@ -309,11 +352,12 @@ class ScriptManager:
             return {}
         
         try:
+            signature = _file_signature(md_path)
             with open(md_path, "r", encoding="utf-8") as f:
                 content = f.read()
             
             script = self._parse_scene_script(content, scene_id)
-            self._scene_script_cache[cache_key] = script
+            self._cache_script(self._scene_script_cache, cache_key, md_path, signature, script)
             return script
         except Exception as e:
             print(f"加载场景剧本失败: {e}")
@@ -331,8 +375,9 @@ class ScriptManager:
             房间剧本字典
         """
         cache_key = f"{theme}:{room_id}"
-        if cache_key in self._room_script_cache:
-            return self._room_script_cache[cache_key]
+        cached = self._get_cached_script(self._room_script_cache, cache_key)
+        if cached is not None:
+            return cached
         
         # 从房间ID提取场景ID（假设格式为 room_{scene_id}_{number}）
         parts = room_id.split('_')
@@ -361,11 +406,12 @@ class ScriptManager:
         
         if json_path and os.path.exists(json_path):
             try:
+                signature = _file_signature(json_path)
                 with open(json_path, "r", encoding="utf-8") as f:
                     script = json.load(f)
                 # 验证 room_id 是否匹配
                 if script.get('room_id') == room_id:
-                    self._room_script_cache[cache_key] = script
+                    self._cache_script(self._room_script_cache, cache_key, json_path, signature, script)
                     return script
             except Exception as e:
                 print(f"加载房间剧本JSON失败: {e}")
@@ -385,11 +431,12 @@ class ScriptManager:
             return {}
         
         try:
+            signature = _file_signature(md_path)
             with open(md_path, "r", encoding="utf-8") as f:
                 content = f.read()
             
             script = self._parse_room_script(content, room_id)
-            self._room_script_cache[cache_key] = script
+            self._cache_script(self._room_script_cache, cache_key, md_path, signature, script)
             return script
         except Exception as e:
             print(f"加载房间剧本失败: {e}")
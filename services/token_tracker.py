@@ -36,12 +36,27 @@ class TokenTracker:
             'operation': operation,
             'context': context or {},
             'input_tokens': usage.get('prompt_tokens', 0),
+            'cached_input_tokens': self._cached_input_tokens(usage),
             'output_tokens': usage.get('completion_tokens', 0),
             'total_tokens': usage.get('total_tokens', 0)
         }
         
         self.calls.append(call_record)
     
+    @staticmethod
+    def _cached_input_tokens(usage: Dict) -> int:
+        """
+        命中平台前缀缓存的输入token数
+        
+        DeepSeek 返回 prompt_cache_hit_tokens，OpenAI 兼容接口返回 prompt_tokens_details.cached_tokens
+        """
+        if 'prompt_cache_hit_tokens' in usage:
+            return usage.get('prompt_cache_hit_tokens') or 0
+        details = usage.get('prompt_tokens_details')
+        if not isinstance(details, dict):
+            return 0
+        return details.get('cached_tokens') or 0
+    
     def get_session_stats(self) -> Dict:
         """
         获取当前会话的统计信息
@@ -54,6 +69,7 @@ class TokenTracker:
                 'total_calls': 0,
                 'total_tokens': 0,
                 'total_input_tokens': 0,
+                'total_cached_input_tokens': 0,
                 'total_output_tokens': 0,
                 'by_platform': {},
                 'by_operation': {},
@@ -62,6 +78,7 @@ class TokenTracker:
         
         total_tokens = sum(c['total_tokens'] for c in self.calls)
         total_input = sum(c['input_tokens'] for c in self.calls)
+        total_cached = sum(c.get('cached_input_tokens', 0) for c in self.calls)
         total_output = sum(c['output_tokens'] for c in self.calls)
         
         by_platform = defaultdict(lambda: {'calls': 0, 'tokens': 0})
@@ -83,6 +100,7 @@ class TokenTracker:
             'total_calls': len(self.calls),
             'total_tokens': total_tokens,
             'total_input_tokens': total_input,
+            'total_cached_input_tokens': total_cached,
             'total_output_tokens': total_output,
             'by_platform': dict(by_platform),
             'by_operation': dict(by_operation),
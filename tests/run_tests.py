@@ -23,6 +23,12 @@ def run_all_tests():
         'tests.test_multi_agent_coordinator',
         'tests.test_integration',
         'tests.test_conversation_store',
+        'tests.test_conversation_history',
+        'tests.test_character_store',
+        'tests.test_chat_service',
+        'tests.test_consistency_checker',
+        'tests.test_batch_processor',
+        'tests.test_director_evaluator',
         'tests.test_environment_modification',  # 环境修改测试（真实文件系统）
         'tests.test_scene_update_and_joint_call'  # 场景更新和联合调用测试
     ]
@@ -8,7 +8,7 @@ import unittest
 import os
 from unittest.mock import Mock, patch, MagicMock
 import json
-from services.agent import Agent
+from services.agent import Agent, clear_response_cache, is_json_object_complete, _extract_json_payload
 from config import Config
 
 
@@ -44,6 +44,7 @@ class TestAgent(unittest.TestCase):
             'theme': 'adventure_party'
         }
         self.agent = Agent(self.character_data, self.config)
+        clear_response_cache()
     
     def test_agent_initialization(self):
         """测试智能体初始化"""
@@ -130,6 +131,35 @@ class TestAgent(unittest.TestCase):
         self.assertEqual(result['state_changes'], {})
         self.assertEqual(result['attribute_changes'], {})
     
+    @patch('services.agent.ChatService._call_deepseek_api')
+    def test_process_instruction_cached(self, mock_api):
+        """测试相同输入命中响应缓存，属性变化后缓存失效"""
+        self.config.AGENT_RESPONSE_CACHE_SIZE = 256
+        mock_api.return_value = json.dumps({
+            'response': {'dialogue': '出发！', 'action_intent': '拔出长剑'},
+            'hidden': {'inner_monologue': '小心埋伏'}
+        })
+        
+        first = self.agent.process_instruction("前进", "场景", platform='deepseek')
+        first['response']['dialogue'] = '被调用方修改'
+        second = self.agent.process_instruction("前进", "场景", platform='deepseek')
+        
+        self.assertEqual(mock_api.call_count, 1)
+        self.assertEqual(second['response']['dialogue'], '出发！')
+        
+        self.agent.update_attributes({**self.agent.attributes, 'level': 11})
+        self.agent.process_instruction("前进", "场景", platform='deepseek')
+        self.assertEqual(mock_api.call_count, 2)
+    
+    @patch('services.agent.ChatService._call_deepseek_api')
+    def test_response_cache_off_by_default(self, mock_api):
+        """测试默认不缓存智能体回复，相同输入每次重新生成"""
+        mock_api.return_value = json.dumps({'response': {'dialogue': '出发！'}})
+        
+        self.agent.process_instruction("前进", "场景", platform='deepseek')
+        self.agent.process_instruction("前进", "场景", platform='deepseek')
+        self.assertEqual(mock_api.call_count, 2)
+    
     def test_build_agent_prompt(self):
         """测试构建智能体提示词"""
         scene_content = "测试场景"
@@ -141,6 +171,40 @@ class TestAgent(unittest.TestCase):
         self.assertIn('测试场景', prompt)
         self.assertIn('角色扮演智能体', prompt)
 
+    
+    @patch('services.agent.ChatService._load_attr_guide', return_value='属性说明')
+    def test_build_agent_prompt_cached(self, mock_guide):
+        """测试提示词缓存：重复构建只读取一次属性说明，属性替换后重新构建"""
+        first = self.agent._build_agent_prompt("测试场景")
+        second = self.agent._build_agent_prompt("测试场景")
+        self.assertIs(first, second)
+        self.assertEqual(mock_guide.call_count, 1)
+        
+        self.agent.attributes = {**self.agent.attributes, 'level': 11}
+        third = self.agent._build_agent_prompt("测试场景")
+        self.assertIn('"level":11', third.replace(' ', ''))
+        self.assertEqual(mock_guide.call_count, 1)
+
+    
+    def test_extract_json_payload(self):
+        """测试JSON提取：推理标记、代码块、前后夹杂文本以及字符串中的括号和转义"""
+        self.assertEqual(_extract_json_payload('<think>想一想</think>```json\n{"a": 1}\n```'), '{"a": 1}')
+        self.assertEqual(_extract_json_payload('```\n{"a": 1}\n```'), '{"a": 1}')
+        self.assertEqual(
+            _extract_json_payload('好的：{"a": "}{\\"", "b": {"c": 2}} 以上'),
+            '{"a": "}{\\"", "b": {"c": 2}}'
+        )
+        self.assertEqual(_extract_json_payload(' 这不是JSON格式的响应 '), '这不是JSON格式的响应')
+        self.assertEqual(_extract_json_payload('```JSON\n{"a": 1}\n```'), '{"a": 1}')
+        # 非法JSON（尾随逗号）时由括号扫描截取对象，交给解析报错
+        self.assertEqual(_extract_json_payload('结果：{"a": "{", "b": [1,],} 以上'), '{"a": "{", "b": [1,],}')
+    
+    def test_is_json_object_complete(self):
+        """测试流式响应完整性判断：字符串中的括号和转义引号不影响深度计数，推理未结束时不算完整"""
+        self.assertFalse(is_json_object_complete('{"a": "}\\"}'))
+        self.assertTrue(is_json_object_complete('好的 {"a": "}\\"", "b": {}}'))
+        self.assertFalse(is_json_object_complete('<think>{"a": 1}'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,53 @@
+"""
+BatchProcessor 单元测试
+"""
+import unittest
+from unittest.mock import Mock
+from services.batch_processor import BatchProcessor
+
+
+class TestBatchProcessor(unittest.TestCase):
+    """BatchProcessor 类测试"""
+
+    def setUp(self):
+        """设置测试环境"""
+        self.chat_service = Mock()
+        self.processor = BatchProcessor(self.chat_service, max_concurrency=2, rpm=100)
+
+    def test_run_batch_keeps_order(self):
+        """测试结果与输入顺序一致，并报告进度"""
+        async def fake_achat(user_message, **kwargs):
+            return f"回复:{user_message}"
+        self.chat_service.achat = fake_achat
+
+        progress = []
+        items = [{'character_description': '勇者', 'character_attributes': {}, 'user_message': str(i)}
+                 for i in range(5)]
+        results = self.processor.run(items, on_progress=lambda done, total: progress.append((done, total)))
+
+        self.assertEqual(results, [f"回复:{i}" for i in range(5)])
+        self.assertEqual(progress[-1], (5, 5))
+
+    def test_run_batch_retries_failed_once(self):
+        """测试失败的请求会重试一次，重试仍失败时返回异常对象"""
+        calls = {}
+
+        async def fake_achat(user_message, **kwargs):
+            calls[user_message] = calls.get(user_message, 0) + 1
+            if user_message == 'flaky' and calls[user_message] == 1:
+                raise Exception("临时错误")
+            if user_message == 'broken':
+                raise Exception("持续错误")
+            return user_message
+        self.chat_service.achat = fake_achat
+
+        results = self.processor.run([{'user_message': 'ok'}, {'user_message': 'flaky'},
+                                      {'user_message': 'broken'}])
+
+        self.assertEqual(results[:2], ['ok', 'flaky'])
+        self.assertIsInstance(results[2], Exception)
+        self.assertEqual(calls, {'ok': 1, 'flaky': 2, 'broken': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+CharacterStore 单元测试
+"""
+import unittest
+import os
+import json
+import tempfile
+import shutil
+from unittest.mock import patch
+from services.character_store import CharacterStore, MANIFEST_FILENAME
+from config import Config
+
+
+class TestCharacterStore(unittest.TestCase):
+    """CharacterStore 类测试"""
+
+    def setUp(self):
+        """设置测试环境"""
+        self.config = Config()
+        # 使用临时目录进行测试
+        self.test_dir = tempfile.mkdtemp()
+        self.store = CharacterStore(self.config)
+        # 修改store的base_dir指向测试目录
+        self.store.base_dir = self.test_dir
+
+    def tearDown(self):
+        """清理测试环境"""
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_create_and_get_character(self):
+        """测试创建并读取人物卡"""
+        character = self.store.create_character('勇者', '一个勇敢的角色', {'hp': 100}, theme='adventure')
+
+        loaded = self.store.get_character(character['id'])
+        self.assertEqual(loaded, character)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.test_dir, 'adventure', 'characters', f"{character['id']}.json")
+        ))
+        self.assertTrue(os.path.exists(os.path.join(self.test_dir, MANIFEST_FILENAME)))
+
+    def test_list_characters_picks_up_manual_files(self):
+        """测试索引能发现手动放入的人物卡文件（新格式和旧格式）"""
+        self.store.create_character('勇者', '描述', theme='adventure')
+        self.assertEqual(len(self.store.list_characters()), 1)
+
+        characters_dir = os.path.join(self.test_dir, 'adventure', 'characters')
+        with open(os.path.join(characters_dir, 'manual.json'), 'w', encoding='utf-8') as f:
+            json.dump({'id': 'manual', 'name': '手动角色', 'description': '', 'theme': 'adventure'}, f)
+        with open(os.path.join(self.test_dir, 'adventure', 'core_events.json'), 'w', encoding='utf-8') as f:
+            json.dump({'events': []}, f)
+
+        ids = [c['id'] for c in self.store.list_characters()]
+        self.assertEqual(len(ids), 2)
+        self.assertIn('manual', ids)
+        self.assertIsNone(self.store.get_character('missing'))
+
+    def test_get_character_cache(self):
+        """测试内存缓存：返回副本，文件被外部修改后重新读取"""
+        character = self.store.create_character('勇者', '描述', {'hp': 100}, theme='adventure')
+
+        loaded = self.store.get_character(character['id'])
+        loaded['attributes']['hp'] = 0
+        self.assertEqual(self.store.get_character(character['id'])['attributes']['hp'], 100)
+
+        path = self.store._find_file(character['id'])
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        data['attributes']['hp'] = 50
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(self.store.get_character(character['id'])['attributes']['hp'], 50)
+
+    def test_get_character_with_theme(self):
+        """测试指定主题时直接定位文件，主题不匹配时回退到索引查找"""
+        character = self.store.create_character('勇者', '描述', theme='adventure')
+
+        with patch.object(self.store, '_find_file') as mock_find:
+            self.assertEqual(self.store.get_character(character['id'], 'adventure')['name'], '勇者')
+            mock_find.assert_not_called()
+        self.assertEqual(self.store.get_character(character['id'], 'other')['name'], '勇者')
+
+    def test_update_and_delete_character(self):
+        """测试更新和删除人物卡"""
+        character = self.store.create_character('勇者', '描述', theme='adventure')
+
+        updated = self.store.update_character(character['id'], {'name': '老勇者'})
+        self.assertEqual(updated['name'], '老勇者')
+        self.assertEqual(self.store.get_character(character['id'])['name'], '老勇者')
+
+        self.assertTrue(self.store.delete_character(character['id']))
+        self.assertIsNone(self.store.get_character(character['id']))
+        self.assertFalse(self.store.delete_character(character['id']))
+        self.assertEqual(self.store.list_characters(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+"""
+ChatService 单元测试
+
+使用mock替换HTTP会话，不调用真实API。
+"""
+import asyncio
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import Mock, patch
+import requests
+from services.chat_service import ChatService, clear_response_cache, flush_call_logs
+
+
+def _mock_response(content, usage=None):
+    """构造一个成功的 chat/completions 响应"""
+    response = Mock()
+    response.raise_for_status.return_value = None
+    response.json.return_value = {
+        'choices': [{'message': {'content': content}}],
+        'usage': usage or {}
+    }
+    return response
+
+
+class TestChatService(unittest.TestCase):
+    """ChatService 类测试"""
+
+    def setUp(self):
+        """设置测试环境"""
+        self.service = ChatService()
+        self.service.session = Mock()
+        self.service._record_call = Mock()
+        clear_response_cache()
+
+    def test_call_platform_api_uses_provider_config(self):
+        """测试各平台共用同一调用逻辑，按平台配置选择URL和模型"""
+        self.service._providers['aizex']['url'] = 'https://aizex.example/v1/chat/completions'
+        self.service.session.post.return_value = _mock_response('你好')
+
+        result = self.service._call_aizex_api([{'role': 'user', 'content': 'hi'}])
+
+        self.assertEqual(result, '你好')
+        args, kwargs = self.service.session.post.call_args
+        self.assertEqual(args[0], 'https://aizex.example/v1/chat/completions')
+        self.assertEqual(kwargs['json']['model'], self.service.config.AIZEX_MODEL)
+        self.service._record_call.assert_called_once()
+        self.assertNotIn('response_format', kwargs['json'])
+
+        self.service._call_aizex_api([{'role': 'user', 'content': 'hi'}],
+                                     response_format={'type': 'json_object'})
+        self.assertEqual(self.service.session.post.call_args[1]['json']['response_format'],
+                         {'type': 'json_object'})
+
+    def test_call_platform_api_unknown_platform(self):
+        """测试不支持的平台"""
+        with self.assertRaises(ValueError):
+            self.service.call_platform_api('unknown', [])
+        with self.assertRaises(ValueError):
+            self.service.platform_method('unknown')
+
+    def test_platform_method_dispatch(self):
+        """测试按平台名称（不区分大小写）查表得到调用方法，替换后的方法同样生效"""
+        self.assertEqual(self.service.platform_method('OpenAI'), self.service._call_openai_api)
+        self.service._call_deepseek_api = Mock(return_value='回复')
+
+        self.assertEqual(self.service.call_platform_api('DeepSeek', []), '回复')
+        self.service._call_deepseek_api.assert_called_once()
+
+    def test_session_retries_throttling(self):
+        """测试HTTP会话对限流和服务端错误自动重试（遵循Retry-After）"""
+        retry = ChatService().session.get_adapter('https://api.example.com').max_retries
+
+        self.assertTrue(retry.is_retry('POST', 429, has_retry_after=True))
+        self.assertTrue(retry.is_retry('POST', 503))
+        self.assertFalse(retry.is_retry('POST', 400))
+        self.assertTrue(retry.respect_retry_after_header)
+
+    @patch('services.chat_service.api_failure_handler')
+    def test_call_failure_reported(self, mock_handler):
+        """测试请求最终失败时通知失败处理器并抛出异常"""
+        mock_handler.record_failure.return_value = True
+        self.service.session.post.side_effect = requests.exceptions.ConnectionError('断开')
+
+        with self.assertRaises(Exception) as ctx:
+            self.service.call_platform_api('deepseek', [{'role': 'user', 'content': 'hi'}])
+
+        self.assertIn('API调用失败', str(ctx.exception))
+        mock_handler.record_failure.assert_called_once()
+        self.service._record_call.assert_not_called()
+
+    def test_astream_chat_yields_deltas(self):
+        """测试流式对话逐段返回内容，结束后记录完整回复"""
+        response = Mock()
+        response.raise_for_status.return_value = None
+        response.iter_lines.return_value = [
+            b'data: {"choices": [{"delta": {"content": "\xe4\xbd\xa0"}}]}',
+            b'',
+            b'data: {"choices": [{"delta": {"content": "\xe5\xa5\xbd"}}]}',
+            b'data: [DONE]',
+        ]
+        self.service.session.post.return_value = response
+        self.service._load_scene = Mock(return_value=None)
+
+        async def collect():
+            return [delta async for delta in self.service.astream_chat('勇者', {}, 'hi', platform='deepseek')]
+
+        self.assertEqual(asyncio.run(collect()), ['你', '好'])
+        self.assertTrue(self.service.session.post.call_args[1]['json']['stream'])
+        self.assertEqual(self.service._record_call.call_args[0][3], '你好')
+        response.close.assert_called_once()
+
+    @patch('services.chat_service.api_failure_handler')
+    def test_stream_failure_mid_stream_reported(self, mock_handler):
+        """测试流式接收中途数据无法解析时通知失败处理器，已收到的内容按小写平台名记录"""
+        mock_handler.record_failure.return_value = True
+        response = Mock()
+        response.raise_for_status.return_value = None
+        response.iter_lines.return_value = [
+            b'data: {"choices": [{"delta": {"content": "a"}}]}',
+            b'data: {broken',
+        ]
+        self.service.session.post.return_value = response
+
+        received = []
+        with self.assertRaises(Exception) as ctx:
+            for delta in self.service.stream_platform_api('DeepSeek', []):
+                received.append(delta)
+
+        self.assertEqual(received, ['a'])
+        self.assertIn('API调用失败', str(ctx.exception))
+        mock_handler.record_failure.assert_called_once()
+        self.assertEqual(self.service._record_call.call_args[0][:1], ('deepseek',))
+        response.close.assert_called_once()
+
+    def test_record_call_logs_in_background(self):
+        """测试调用日志在后台线程写入，token统计同步记录"""
+        service = ChatService()
+        service._llm_logger = Mock()
+        service._token_tracker = Mock()
+
+        service._record_call('deepseek', 'model', [], '回复', 0.7, {'total_tokens': 3}, 'chat')
+        flush_call_logs()
+
+        service._token_tracker.record_call.assert_called_once()
+        self.assertEqual(service._llm_logger.log_call.call_args[1]['response'], '回复')
+
+    def test_batch_chat_merges_same_character(self):
+        """测试同一角色的多条消息合并为一次请求，并按编号拆分回复"""
+        self.service._load_scene = Mock(return_value=None)
+        prompts = []
+
+        def fake_call(platform, messages, temperature=0.7, operation='chat', context=None):
+            prompts.append(messages[-1]['content'])
+            if context.get('batch_size'):
+                return "1) 你好，旅人。\n2) 村口往东走。\n继续走就到了。"
+            return "我是法师。"
+        self.service.call_platform_api = fake_call
+
+        hero = {'character_description': '勇者', 'character_attributes': {}, 'platform': 'deepseek'}
+        results = self.service.batch_chat([
+            {**hero, 'user_message': '你好'},
+            {'character_description': '法师', 'character_attributes': {}, 'platform': 'deepseek',
+             'user_message': '你是谁'},
+            {**hero, 'user_message': '村子\n在哪'},
+        ])
+
+        self.assertEqual(results, ['你好，旅人。', '我是法师。', '村口往东走。\n继续走就到了。'])
+        self.assertEqual(len(prompts), 2)
+        self.assertTrue(any('2) 村子 在哪' in p for p in prompts))
+
+    def test_batch_chat_falls_back_when_unparseable(self):
+        """测试合并回复无法按编号拆分时逐条重新请求"""
+        self.service._load_scene = Mock(return_value=None)
+
+        def fake_call(platform, messages, temperature=0.7, operation='chat', context=None):
+            if context.get('batch_size'):
+                return "无法识别的回复"
+            return "单独回复:" + messages[-1]['content']
+        self.service.call_platform_api = fake_call
+
+        hero = {'character_description': '勇者', 'character_attributes': {}, 'platform': 'deepseek'}
+        results = self.service.batch_chat([{**hero, 'user_message': 'a'}, {**hero, 'user_message': 'b'}])
+
+        self.assertEqual(results, ['单独回复:a', '单独回复:b'])
+
+    def test_deterministic_calls_cached(self):
+        """测试temperature为0的相同请求只调用一次接口，非确定性调用不缓存"""
+        self.service.session.post.return_value = _mock_response('固定回复', {'total_tokens': 10})
+        messages = [{'role': 'user', 'content': 'hi'}]
+
+        self.assertEqual(self.service.call_platform_api('deepseek', messages, temperature=0), '固定回复')
+        self.assertEqual(self.service.call_platform_api('deepseek', messages, temperature=0), '固定回复')
+        self.assertEqual(self.service.session.post.call_count, 1)
+        self.assertTrue(self.service._record_call.call_args[0][5]['cached'])
+
+        self.service.call_platform_api('deepseek', messages, temperature=0.7)
+        self.service.call_platform_api('deepseek', messages, temperature=0.7)
+        self.assertEqual(self.service.session.post.call_count, 3)
+
+        # 同名模型配置在不同平台时不共用缓存
+        self.service._providers['aizex']['model'] = self.service._providers['deepseek']['model']
+        self.service.call_platform_api('aizex', messages, temperature=0)
+        self.assertEqual(self.service.session.post.call_count, 4)
+
+    def test_deterministic_cache_persisted(self):
+        """测试配置磁盘缓存后，清空内存缓存（如重新运行）仍能命中之前的确定性调用结果"""
+        save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_dir)
+        self.service.config.LLM_RESPONSE_CACHE_DB = str(Path(save_dir) / 'cache' / 'responses.db')
+        self.addCleanup(setattr, self.service.config, 'LLM_RESPONSE_CACHE_DB', '')
+        self.service.session.post.return_value = _mock_response('固定回复')
+        messages = [{'role': 'user', 'content': 'hi'}]
+
+        self.service.call_platform_api('deepseek', messages, temperature=0)
+        clear_response_cache()
+        self.assertEqual(self.service.call_platform_api('deepseek', messages, temperature=0), '固定回复')
+        self.assertEqual(self.service.session.post.call_count, 1)
+
+    def test_submit_and_poll_batch(self):
+        """测试提交Batch任务并按提交顺序取回结果"""
+        save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_dir)
+        self.service._save_dir = Path(save_dir)
+        self.service.config.USE_BATCH_API = True
+        self.service._token_tracker = None
+
+        upload, create = Mock(), Mock()
+        upload.json.return_value = {'id': 'file-in'}
+        create.json.return_value = {'id': 'batch-1'}
+        self.service.session.post.side_effect = [upload, create]
+
+        batch_id = self.service.submit_batch([[{'role': 'user', 'content': 'a'}],
+                                              [{'role': 'user', 'content': 'b'}]])
+        self.assertEqual(batch_id, 'batch-1')
+        self.assertTrue((Path(save_dir) / 'batches' / 'batch-1.json').exists())
+
+        pending = Mock()
+        pending.json.return_value = {'status': 'in_progress'}
+        self.service.session.get.return_value = pending
+        self.assertIsNone(self.service.poll_batch('batch-1'))
+
+        done, output = Mock(), Mock()
+        done.json.return_value = {'status': 'completed', 'output_file_id': 'file-out'}
+        output.text = "\n".join([
+            '{"custom_id": "request-1", "response": {"status_code": 200, "body": {"choices": [{"message": {"content": "B"}}]}}}',
+            '{"custom_id": "request-0", "response": {"status_code": 200, "body": {"choices": [{"message": {"content": "A"}}]}}}',
+        ])
+        self.service.session.get.side_effect = [done, output]
+        self.assertEqual(self.service.poll_batch('batch-1'), ['A', 'B'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+"""
+ConsistencyChecker 单元测试
+
+使用mock替换API调用，不调用真实API。
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import Mock, patch
+from services import json_utils
+from config import Config
+from services.chat_service import _build_providers, _read_first_existing
+from services.consistency_checker import ConsistencyChecker
+
+
+class TestConsistencyChecker(unittest.TestCase):
+    """ConsistencyChecker 类测试"""
+
+    def setUp(self):
+        """设置测试环境"""
+        self.checker = ConsistencyChecker()
+        self.checker._enabled = True
+
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_check_consistency(self, mock_api):
+        """测试同步检测：解析代码块中的JSON并限制评分范围"""
+        mock_api.return_value = '```json\n{"score": 1.5, "feedback": "符合设定"}\n```'
+
+        score, feedback = self.checker.check_consistency('勇者', {'hp': 100}, '你好', '你好，旅人。')
+
+        self.assertEqual(score, 1.0)
+        self.assertEqual(feedback, '符合设定')
+
+    def test_parse_check_result_fences(self):
+        """测试代码块提取：大写语言标记、无语言标记、缺少结尾标记"""
+        for text in ('```JSON\n{"score": 0.6, "feedback": "a"}\n```',
+                     '结果如下：```{"score": 0.6, "feedback": "a"}``` 以上',
+                     '```json\n{"score": 0.6, "feedback": "a"}'):
+            self.assertEqual(self.checker._parse_check_result(text), (0.6, 'a'))
+
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_check_consistency_cached(self, mock_api):
+        """测试相同输入的重复检测使用缓存，失败结果不缓存"""
+        mock_api.return_value = '{"score": 0.9, "feedback": "好"}'
+
+        first = self.checker.check_consistency('勇者', {'hp': 100, 'mp': 5}, '你好', '回复')
+        second = self.checker.check_consistency('勇者', {'mp': 5, 'hp': 100}, '你好', '回复')
+        self.assertEqual(first, second)
+        self.assertEqual(mock_api.call_count, 1)
+
+        self.checker.check_consistency('勇者', {'hp': 100, 'mp': 5}, '你好', '另一个回复')
+        self.assertEqual(mock_api.call_count, 2)
+
+        mock_api.side_effect = Exception('超时')
+        self.checker.check_consistency('勇者', {}, '再见', '回复')
+        mock_api.side_effect = None
+        self.assertEqual(self.checker.check_consistency('勇者', {}, '再见', '回复'), (0.9, '好'))
+        self.assertEqual(mock_api.call_count, 4)
+
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_attributes_serialized_once(self, mock_api):
+        """测试每次检测只序列化一次人物属性（缓存键和提示词共用）"""
+        mock_api.return_value = '{"score": 0.9, "feedback": ""}'
+        with patch('services.consistency_checker.json_utils.dumps', wraps=json_utils.dumps) as mock_dumps:
+            self.checker.check_consistency('勇者', {'hp': 100}, '你好', '回复')
+        self.assertEqual(mock_dumps.call_count, 1)
+
+    def test_build_check_messages(self):
+        """测试提示词填入紧凑属性JSON，无场景时不输出场景段落"""
+        self.checker._load_scene = Mock(return_value=None)
+        prompt = self.checker._build_check_messages('勇者', {'hp': 100, 'name': '亚瑟'}, '你好', '回复')[0]['content']
+
+        attr_line = next(line for line in prompt.splitlines() if line.startswith('- 属性: '))
+        self.assertEqual(json.loads(attr_line[len('- 属性: '):]), {'hp': 100, 'name': '亚瑟'})
+        self.assertNotIn('【场景】', prompt)
+        self.assertIn('"score": 0.95', prompt)
+
+        self.checker._load_scene = Mock(return_value='酒馆')
+        prompt = self.checker._build_check_messages('勇者', {}, '你好', '回复')[0]['content']
+        self.assertIn('**【场景】**\n酒馆', prompt)
+
+    def test_scene_read_shared_with_chat_service(self):
+        """测试场景文件读取与对话服务共用同一份缓存（字符串路径和Path路径命中同一条目）"""
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        self.checker.base_dir = base_dir
+        scene_dir = os.path.join(base_dir, self.checker.config.CHARACTER_CONFIG_DIR, 'shared_theme')
+        os.makedirs(scene_dir)
+        with open(os.path.join(scene_dir, 'SCENE.md'), 'w', encoding='utf-8') as f:
+            f.write('酒馆')
+        
+        self.assertEqual(self.checker._load_scene('shared_theme'), '酒馆')
+        with patch('builtins.open', wraps=open) as mock_file:
+            self.assertEqual(_read_first_existing([Path(scene_dir) / 'SCENE.md']), '酒馆')
+        mock_file.assert_not_called()
+    
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_disabled_skips_all_work(self, mock_api):
+        """测试关闭检测时不读取文件也不调用接口"""
+        self.checker._enabled = False
+        self.checker._load_scene = Mock()
+
+        self.assertEqual(self.checker.check_consistency('勇者', {}, '你好', '回复'), (None, None))
+        self.assertEqual(asyncio.run(self.checker.check_consistency_async('勇者', {}, '你好', '回复')),
+                         (None, None))
+        self.assertEqual(self.checker.check_consistency_batch('勇者', {}, [('a', '1'), ('b', '2')]),
+                         [(None, None)] * 2)
+        self.checker._load_scene.assert_not_called()
+        mock_api.assert_not_called()
+
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_check_consistency_async(self, mock_api):
+        """测试异步检测可以并发执行"""
+        mock_api.side_effect = lambda messages, platform=None: (
+            '{"score": 0.8, "feedback": "ok"}' if '你好' in messages[0]['content'] else 'not json'
+        )
+
+        async def run():
+            return await asyncio.gather(
+                self.checker.check_consistency_async('勇者', {}, '你好', '回复'),
+                self.checker.check_consistency_async('勇者', {}, '再见', '回复'),
+            )
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, (0.8, 'ok'))
+        self.assertEqual(second[0], 0.5)
+        self.assertIn('检测过程中出现错误', second[1])
+
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_async_concurrency_limited(self, mock_api):
+        """测试异步检测的并发请求数不超过配置上限"""
+        self.checker.config.CONSISTENCY_CHECK_MAX_CONCURRENCY = 2
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def fake_call(messages, platform=None):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+            return '{"score": 0.9, "feedback": ""}'
+        mock_api.side_effect = fake_call
+
+        async def run():
+            return await asyncio.gather(*(
+                self.checker.check_consistency_async('勇者', {}, str(i), '回复') for i in range(6)
+            ))
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 6)
+        self.assertLessEqual(state['peak'], 2)
+
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_check_consistency_batch(self, mock_api):
+        """测试多组对话合并为一次请求，结果按idx放回，缺失的条目单独重新检测"""
+        def fake_call(messages, platform=None):
+            if '对话列表' in messages[0]['content']:
+                return '```json\n{"results": [{"idx": 2, "score": 0.2, "feedback": "违和"}, ' \
+                       '{"idx": 0, "score": 0.9, "feedback": "好"}]}\n```'
+            return '{"score": 0.7, "feedback": "单独检测"}'
+        mock_api.side_effect = fake_call
+
+        results = self.checker.check_consistency_batch('勇者', {}, [('a', '1'), ('b', '2'), ('c', '3')])
+
+        self.assertEqual(results, [(0.9, '好'), (0.7, '单独检测'), (0.2, '违和')])
+        self.assertEqual(mock_api.call_count, 2)
+
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_check_consistency_batch_too_large(self, mock_api):
+        """测试对话数超过上限时逐条检测"""
+        mock_api.return_value = '{"score": 0.8, "feedback": ""}'
+        dialogues = [(str(i), '回复') for i in range(10)]
+
+        self.assertEqual(self.checker.check_consistency_batch('勇者', {}, dialogues), [(0.8, '')] * 10)
+        self.assertEqual(mock_api.call_count, 10)
+    
+    @patch.object(ConsistencyChecker, '_call_api')
+    def test_check_consistency_batch_too_large_inside_event_loop(self, mock_api):
+        """测试在运行中的事件循环内调用超过上限的批量检测也能逐条完成"""
+        mock_api.return_value = '{"score": 0.8, "feedback": ""}'
+        dialogues = [(str(i), '回复') for i in range(9)]
+        
+        async def main():
+            return self.checker.check_consistency_batch('勇者', {}, dialogues)
+        
+        self.assertEqual(asyncio.run(main()), [(0.8, '')] * 9)
+        self.assertEqual(mock_api.call_count, 9)
+
+    def test_call_api_uses_shared_session(self):
+        """测试检测请求通过共享HTTP会话发送（会话自带连接池和重试）"""
+        self.assertIs(self.checker.session, ConsistencyChecker().session)
+        self.checker.session = Mock()
+        response = Mock()
+        response.json.return_value = {'choices': [{'message': {'content': '结果'}}]}
+        self.checker.session.post.return_value = response
+
+        self.assertEqual(self.checker._call_api([], 'deepseek'), '结果')
+        self.assertEqual(self.checker.session.post.call_args[1]['json']['temperature'], 0.3)
+        response.raise_for_status.assert_called_once()
+    
+    def test_call_api_uses_chat_service_providers(self):
+        """测试检测请求的接口地址与对话服务一致（aizex地址已含路径时不重复拼接），不支持的平台报错"""
+        self.checker.config.AIZEX_API_BASE = 'https://aizex.example/v1/chat/completions/'
+        self.addCleanup(setattr, self.checker.config, 'AIZEX_API_BASE', Config.AIZEX_API_BASE)
+        self.checker._providers = _build_providers(self.checker.config)
+        self.checker.session = Mock()
+        self.checker.session.post.return_value.json.return_value = {'choices': [{'message': {'content': '结果'}}]}
+        
+        self.checker._call_api([], 'AIZEX')
+        args, kwargs = self.checker.session.post.call_args
+        self.assertEqual(args[0], 'https://aizex.example/v1/chat/completions')
+        self.assertEqual(kwargs['json']['model'], self.checker.config.AIZEX_MODEL)
+        with self.assertRaises(ValueError):
+            self.checker._call_api([], 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+ConversationHistory 单元测试
+"""
+import unittest
+import os
+import tempfile
+import shutil
+from services.conversation_history import ConversationHistory
+from config import Config
+
+
+class TestConversationHistory(unittest.TestCase):
+    """ConversationHistory 类测试"""
+
+    def setUp(self):
+        """设置测试环境"""
+        self.config = Config()
+        # 使用临时目录进行测试
+        self.test_dir = tempfile.mkdtemp()
+        self.history = ConversationHistory(self.config)
+        # 修改base_dir指向测试目录
+        self.history.base_dir = self.test_dir
+
+    def tearDown(self):
+        """清理测试环境"""
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_load_recent_history(self):
+        """测试加载当前步骤之前的最近历史（按步骤号排序）"""
+        for i in range(12):
+            self.history.save_conversation('quest', f'{i}_step', f'指令{i}', f'摘要{i}')
+
+        history_list = self.history.load_recent_history('quest', '10_step', limit=3)
+
+        self.assertEqual([r['step'] for r in history_list], ['7_step', '8_step', '9_step'])
+        self.assertEqual(history_list[-1]['instruction'], '指令9')
+        self.assertEqual(self.history.load_recent_history('missing', '0_step'), [])
+
+    def test_load_recent_history_after_overwrite(self):
+        """测试步骤历史被覆盖后重新读取，返回的记录修改不影响缓存"""
+        self.history.save_conversation('quest', '0_step', '旧指令', '旧摘要')
+        self.history.save_conversation('quest', '1_step', '指令1', '摘要1')
+
+        first = self.history.load_recent_history('quest', '1_step')
+        first[0]['instruction'] = '被修改'
+        self.assertEqual(self.history.load_recent_history('quest', '1_step')[0]['instruction'], '旧指令')
+
+        self.history.save_conversation('quest', '0_step', '新指令', '新摘要')
+        self.assertEqual(self.history.load_recent_history('quest', '1_step')[0]['instruction'], '新指令')
+
+    def test_steps_index_picks_up_new_steps(self):
+        """测试步骤目录索引在外部新增步骤目录后刷新"""
+        self.history.save_conversation('quest', '0_step', '指令0', '摘要0')
+        self.assertEqual(len(self.history.load_recent_history('quest', '2_step')), 1)
+
+        # 其他模块（如存档管理）直接创建步骤目录
+        step_dir = os.path.join(self.test_dir, self.config.SAVE_DIR, 'quest', '1_step')
+        os.makedirs(step_dir)
+        with open(os.path.join(step_dir, 'HISTORY.json'), 'w', encoding='utf-8') as f:
+            f.write('[{"step": "1_step", "instruction": "指令1", "summary": "摘要1"}]')
+
+        steps = [r['step'] for r in self.history.load_recent_history('quest', '2_step')]
+        self.assertEqual(steps, ['0_step', '1_step'])
+
+    def test_get_history_text(self):
+        """测试历史文本格式"""
+        text = self.history.get_history_text([{'step': '0_step', 'instruction': '前进', 'summary': '出发了'}])
+
+        self.assertTrue(text.startswith('【对话历史（最近5个步骤）】'))
+        self.assertIn('步骤 0_step:', text)
+        self.assertIn('  玩家指令: 前进', text)
+        self.assertIn('  摘要: 出发了', text)
+        self.assertEqual(self.history.get_history_text([]), '')
+
+        text = self.history.get_history_text([{'step': '0_step', 'instruction': 'a', 'summary': 'b'}, {}])
+        self.assertEqual(text, '【对话历史（最近5个步骤）】\n\n步骤 0_step:\n  玩家指令: a\n  摘要: b'
+                               '\n\n步骤 未知:\n  玩家指令: \n  摘要: ')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,13 @@
 """
 ConversationStore 单元测试
 """
+import asyncio
 import unittest
 import os
 import json
 import tempfile
 import shutil
+from unittest.mock import patch
 from services.conversation_store import ConversationStore
 from config import Config
 
@@ -28,6 +30,11 @@ class TestConversationStore(unittest.TestCase):
         if os.path.exists(self.test_dir):
             shutil.rmtree(self.test_dir)
     
+    def _read_records(self, file_path):
+        """逐行读取记录文件"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    
     def test_save_conversation(self):
         """测试保存对话记录"""
         conversation = self.store.save_conversation(
@@ -50,10 +57,9 @@ class TestConversationStore(unittest.TestCase):
         self.assertTrue(os.path.exists(file_path))
         
         # 验证文件内容
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            self.assertEqual(len(data), 1)
-            self.assertEqual(data[0]['user_message'], '你好')
+        data = self._read_records(file_path)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['user_message'], '你好')
     
     def test_save_multiple_conversations(self):
         """测试保存多条对话记录"""
@@ -64,11 +70,11 @@ class TestConversationStore(unittest.TestCase):
         
         # 验证文件中有两条记录
         file_path = self.store._get_file_path('hero')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            self.assertEqual(len(data), 2)
-            self.assertEqual(data[0]['user_message'], '消息1')
-            self.assertEqual(data[1]['user_message'], '消息2')
+        data = self._read_records(file_path)
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]['user_message'], '消息1')
+        self.assertEqual(data[1]['user_message'], '消息2')
+        self.assertEqual([c['id'] for c in data], [1, 2])
     
     def test_get_conversations_empty(self):
         """测试获取对话记录（空）"""
@@ -103,19 +109,59 @@ class TestConversationStore(unittest.TestCase):
         self.store.save_conversation('hero', '测试', '回复')
         
         file_path = self.store._get_file_path('hero')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-            # 验证JSON格式
-            self.assertIsInstance(data, list)
-            self.assertGreater(len(data), 0)
-            
-            conv = data[0]
-            self.assertIn('id', conv)
-            self.assertIn('character_id', conv)
-            self.assertIn('user_message', conv)
-            self.assertIn('character_response', conv)
-            self.assertIn('created_at', conv)
+        self.assertTrue(file_path.endswith('.jsonl'))
+        data = self._read_records(file_path)
+        
+        # 验证JSON Lines格式：每行一条记录
+        self.assertGreater(len(data), 0)
+        
+        conv = data[0]
+        self.assertIn('id', conv)
+        self.assertIn('character_id', conv)
+        self.assertIn('user_message', conv)
+        self.assertIn('character_response', conv)
+        self.assertIn('created_at', conv)
+    
+    def test_migrate_legacy_json_file(self):
+        """测试旧格式（JSON数组）记录文件自动转换并继续编号"""
+        legacy_path = os.path.join(self.store.base_dir, 'hero.json')
+        with open(legacy_path, 'w', encoding='utf-8') as f:
+            json.dump([
+                {'id': 1, 'character_id': 'hero', 'user_message': '旧消息', 'character_response': '旧回复',
+                 'created_at': '2024-01-01T00:00:00'}
+            ], f, ensure_ascii=False)
+        
+        self.assertEqual(self.store.get_conversations('hero')[0]['user_message'], '旧消息')
+        self.assertFalse(os.path.exists(legacy_path))
+        
+        conversation = self.store.save_conversation('hero', '新消息', '新回复')
+        self.assertEqual(conversation['id'], 2)
+        self.assertEqual(len(self.store.get_conversations('hero')), 2)
+
+    
+    def test_get_conversations_tail_read(self):
+        """测试大文件按数量读取时只从末尾读取，结果与完整读取一致"""
+        for i in range(200):
+            self.store.save_conversation('hero', f'消息{i}' * 20, f'回复{i}' * 20)
+        
+        with patch('services.conversation_store.TAIL_READ_THRESHOLD', 0), \
+                patch('services.conversation_store.TAIL_READ_BLOCK', 1000):
+            tail = self.store.get_conversations('hero', limit=7)
+        
+        self.assertEqual([c['id'] for c in tail], [c['id'] for c in self.store.get_conversations('hero')[:7]])
+        self.assertEqual(sorted(c['id'] for c in tail), list(range(194, 201)))
+    
+    def test_save_conversation_async(self):
+        """测试并发异步保存，记录id不重复"""
+        async def save_all():
+            return await asyncio.gather(*(
+                self.store.save_conversation_async('hero', f'消息{i}', f'回复{i}') for i in range(5)
+            ))
+        
+        saved = asyncio.run(save_all())
+        
+        self.assertEqual(sorted(c['id'] for c in saved), [1, 2, 3, 4, 5])
+        self.assertEqual(len(self.store.get_conversations('hero')), 5)
 
 
 if __name__ == '__main__':
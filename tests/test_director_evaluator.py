@@ -0,0 +1,504 @@
+"""
+DirectorEvaluator 单元测试
+
+使用mock替换API调用，不调用真实API。
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+from services import json_utils
+from services.chat_service import ChatService, get_default_chat_service
+from services.director_evaluator import DirectorEvaluator, _clip_middle, _render_character_states, _render_events
+from config import Config
+
+
+class TestDirectorEvaluator(unittest.TestCase):
+    """DirectorEvaluator 类测试"""
+
+    def setUp(self):
+        """设置测试环境"""
+        self.evaluator = DirectorEvaluator(Config())
+        self.evaluator.chat_service = ChatService()
+        self.evaluator.chat_service._call_deepseek_api = Mock()
+
+    def test_shares_default_chat_service(self):
+        """测试导演评估器和环境分析器共用进程内的ChatService（同一HTTP连接池）"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        evaluator = DirectorEvaluator(Config())
+        self.assertIs(evaluator.chat_service, get_default_chat_service())
+        self.assertIs(EnvironmentAnalyzer(Config()).chat_service, evaluator.chat_service)
+
+    def test_analyze_environment_changes_uses_director_call(self):
+        """测试环境变化分析通过一次导演评估调用完成，并转换为环境分析器格式"""
+        self.evaluator.chat_service._call_deepseek_api.return_value = json.dumps({
+            "environment_analysis": {
+                "updated_scene_description": "队伍抵达遗迹入口",
+                "scene_state_changes": {"location": "遗迹入口", "time": None, "weather": "起雾"},
+                "hidden": {"risk_hints": "雾中有魔物"},
+                "major_events": ["听到远处传来奇怪的声响"],
+                "agent_execution_results": [],
+                "decision_points": {"has_decision": True, "description": "是否进入遗迹", "options": ["进入", "撤退"]},
+                "status_summary": {"goal_progress": "已抵达遗迹", "next_suggestions": ["探查入口"]}
+            },
+            "director_decision": {"trigger_event": None}
+        }, ensure_ascii=False)
+
+        result = self.evaluator.analyze_environment_changes(
+            "测试场景", [{'character_name': '勇者', 'response': '我们出发！'}], platform='deepseek'
+        )
+
+        self.assertEqual(self.evaluator.chat_service._call_deepseek_api.call_count, 1)
+        surface = result['scene_changes']['surface']
+        self.assertEqual(surface['location'], {'specific_location': '遗迹入口'})
+        self.assertEqual(surface['time'], '')
+        self.assertEqual(surface['weather'], '起雾')
+        self.assertEqual(surface['current_narrative'], '队伍抵达遗迹入口')
+        self.assertEqual(result['scene_changes']['hidden'], {"risk_hints": "雾中有魔物"})
+        self.assertEqual(result['major_events'], ["听到远处传来奇怪的声响"])
+        self.assertEqual(result['status_summary']['current_location'], '遗迹入口')
+        self.assertEqual(result['decision_points'],
+                         {'has_decision': True, 'description': '是否进入遗迹', 'options': ['进入', '撤退']})
+        self.assertEqual(result['status_summary']['goal_progress'], '已抵达遗迹')
+        self.assertEqual(result['status_summary']['next_suggestions'], ['探查入口'])
+
+        messages = self.evaluator.chat_service._call_deepseek_api.call_args[0][0]
+        self.assertIn('测试场景', messages[1]['content'])
+
+    def test_json_mode_request(self):
+        """测试JSON模式下请求带response_format，关闭后按自由文本提取JSON"""
+        api = self.evaluator.chat_service._call_deepseek_api
+        api.return_value = '{"director_decision": {"trigger_event": "e1", "appear_monster": "哥布林"}}'
+        self.evaluator.config.DIRECTOR_JSON_MODE = True
+
+        result = self.evaluator.evaluate_as_director({'current_scene': 'village', 'player_instruction': '前进'}, platform='deepseek')
+        self.assertEqual(api.call_args[1]['response_format'], {"type": "json_object"})
+        self.assertEqual(result['director_decision']['appear_monster'], ['哥布林'])
+
+        self.evaluator.config.DIRECTOR_JSON_MODE = False
+        api.return_value = '```json\n{"director_decision": {"trigger_event": "e2"}}\n```'
+        result = self.evaluator.evaluate_as_director({'current_scene': 'village', 'player_instruction': '前进'}, platform='deepseek')
+        self.assertNotIn('response_format', api.call_args[1])
+        self.assertEqual(result['director_decision']['trigger_event'], 'e2')
+
+    def test_streaming_environment_analysis_callback(self):
+        """测试流式响应中environment_analysis闭合后立即回调，早于决策部分生成完毕"""
+        self.evaluator.config.LLM_STREAMING_ENABLED = True
+        received = []
+        chunks = ['{"environment_analysis": {"updated_scene_description": "门', '后有{光}"',
+                  ', "agent_execution_results": []}, "director_decision": ',
+                  '{"trigger_event": "e1"}}']
+
+        def fake_stream(platform, messages, **kwargs):
+            for index, chunk in enumerate(chunks):
+                if index == 3:
+                    self.assertEqual(len(received), 1)
+                yield chunk
+        self.evaluator.chat_service.stream_platform_api = Mock(side_effect=fake_stream)
+
+        result = self.evaluator.evaluate_as_director({'current_scene': 'village', 'player_instruction': '前进'}, platform='deepseek',
+                                                     on_environment_analysis=received.append)
+
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['updated_scene_description'], '门后有{光}')
+        self.assertEqual(result['director_decision']['trigger_event'], 'e1')
+        self.evaluator.chat_service._call_deepseek_api.assert_not_called()
+
+        self.evaluator.config.LLM_STREAMING_ENABLED = False
+        self.evaluator.chat_service._call_deepseek_api.return_value = "".join(chunks)
+        self.evaluator.evaluate_as_director({'current_scene': 'village', 'player_instruction': '前进'}, platform='deepseek',
+                                            on_environment_analysis=received.append)
+        self.assertEqual(len(received), 2)
+
+    def test_normalize_fills_defaults_without_sharing(self):
+        """测试补全缺失字段（兼容只有决策部分的旧格式），默认的可变值不在结果间共享"""
+        first = self.evaluator._normalize_director_result({"trigger_event": "null", "appear_monster": "哥布林"})
+        second = self.evaluator._parse_director_response('不是JSON')
+
+        self.assertIsNone(first['director_decision']['trigger_event'])
+        self.assertEqual(first['director_decision']['appear_monster'], ['哥布林'])
+        self.assertEqual(first['environment_analysis']['major_events'], [])
+        self.assertTrue(second['director_decision']['reasoning'].startswith('解析失败'))
+
+        first['environment_analysis']['major_events'].append('事件')
+        second['environment_analysis']['hidden']['risk_hints'] = '危险'
+        fresh = self.evaluator._normalize_director_result({})
+        self.assertEqual(fresh['environment_analysis']['major_events'], [])
+        self.assertEqual(fresh['environment_analysis']['hidden'], {})
+        self.assertEqual(fresh['director_decision']['reasoning'], '')
+
+    def test_invalid_json_repaired_once(self):
+        """测试导演响应无法解析时发起一次修复调用，修复仍失败时返回默认结果"""
+        api = self.evaluator.chat_service._call_deepseek_api
+        api.side_effect = ['{"director_decision": {"trigger_event": "e1",}',
+                           '{"director_decision": {"trigger_event": "e1"}}']
+
+        result = self.evaluator.evaluate_as_director({'current_scene': 'village', 'player_instruction': '前进'},
+                                                     platform='deepseek')
+
+        self.assertEqual(result['director_decision']['trigger_event'], 'e1')
+        self.assertEqual(api.call_count, 2)
+        repair_args, repair_kwargs = api.call_args
+        self.assertEqual(repair_args[1], 0)
+        self.assertEqual(repair_kwargs['operation'], 'director_repair')
+        self.assertIn('"trigger_event": "e1",', repair_args[0][-1]['content'])
+
+        api.side_effect = ['不是JSON', '仍然不是JSON']
+        result = self.evaluator.evaluate_as_director({'current_scene': 'village', 'player_instruction': '前进'},
+                                                     platform='deepseek')
+        self.assertTrue(result['director_decision']['reasoning'].startswith('解析失败'))
+        self.assertEqual(api.call_count, 4)
+
+    def test_idle_turn_skips_llm(self):
+        """测试没有玩家指令、Agent响应和状态变化的空闲回合不调用LLM"""
+        self.evaluator.config.DIRECTOR_IDLE_TICK_MINUTES = 5.0
+        received = []
+
+        result = self.evaluator.evaluate_as_director({'current_scene': 'village', 'player_instruction': '  '},
+                                                     platform='deepseek', on_environment_analysis=received.append)
+
+        self.evaluator.chat_service._call_deepseek_api.assert_not_called()
+        self.assertEqual(result['director_decision']['elapsed_time'], 5.0)
+        self.assertIsNone(result['director_decision']['trigger_event'])
+        self.assertEqual(len(received), 1)
+
+        self.evaluator.chat_service._call_deepseek_api.return_value = '{"director_decision": {}}'
+        self.evaluator.evaluate_as_director({'current_scene': 'village',
+                                             'scene_state': {'state_changes': {'door': 'open'}}},
+                                            platform='deepseek')
+        self.evaluator.chat_service._call_deepseek_api.assert_called_once()
+
+    def test_environment_analyzer_reuses_identical_turn(self):
+        """测试环境分析器对相同场景和响应（顺序无关）复用结果，返回副本；失败结果不缓存"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        analyzer = EnvironmentAnalyzer(Config())
+        analyzer.director_evaluator = self.evaluator
+        api = self.evaluator.chat_service._call_deepseek_api
+        api.return_value = '{"environment_analysis": {"updated_scene_description": "雾散了"}}'
+        responses = [{'character_id': 'a', 'response': '走'}, {'character_id': 'b', 'response': '等等'}]
+
+        first = analyzer.analyze_environment_changes('场景', responses, platform='deepseek')
+        first['major_events'].append('被修改')
+        second = analyzer.analyze_environment_changes('场景', list(reversed(responses)), platform='deepseek')
+
+        self.assertEqual(api.call_count, 1)
+        self.assertEqual(second['scene_changes']['surface']['current_narrative'], '雾散了')
+        self.assertEqual(second['major_events'], [])
+
+        api.return_value = '不是JSON'
+        analyzer.analyze_environment_changes('另一个场景', responses, platform='deepseek')
+        analyzer.analyze_environment_changes('另一个场景', responses, platform='deepseek')
+        self.assertEqual(api.call_count, 1 + 4)
+
+    def test_environment_analyzer_persisted_across_runs(self):
+        """测试配置磁盘缓存后，新的分析器实例（如重新运行回放）复用之前的分析结果，不再调用导演"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_dir)
+        config = Config()
+        config.LLM_RESPONSE_CACHE_DB = os.path.join(save_dir, 'responses.db')
+        api = self.evaluator.chat_service._call_deepseek_api
+        api.return_value = '{"environment_analysis": {"updated_scene_description": "雾散了"}}'
+        responses = [{'character_id': 'a', 'response': '走'}]
+
+        for _ in range(2):
+            analyzer = EnvironmentAnalyzer(config)
+            analyzer.director_evaluator = self.evaluator
+            result = analyzer.analyze_environment_changes('场景', responses, platform='deepseek')
+            self.assertEqual(result['scene_changes']['surface']['current_narrative'], '雾散了')
+        self.assertEqual(api.call_count, 1)
+
+    def test_environment_analyzer_extracts_events(self):
+        """测试从场景Markdown中提取预设事件和已发生事件（去除编号、粗体和角色名前缀）"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        analyzer = EnvironmentAnalyzer(Config())
+        scene = ("# 村庄\n## 剧本预设事件\n1. **狼袭** 狼群夜袭村庄\n- 商队到来\n\n"
+                 "## 重大事件\n- 初始场景\n- 勇者：击退了狼群\n- 暂无\n## 其他\n")
+
+        self.assertEqual(analyzer._extract_preset_events(scene), ['狼群夜袭村庄', '商队到来'])
+        self.assertEqual(analyzer._extract_occurred_events(scene), ['击退了狼群'])
+        self.assertEqual(analyzer._extract_preset_events("## 重大事件\n- 桥塌了\n- 暂无\n##"), ['桥塌了'])
+
+    def test_environment_analyzer_sends_preset_events(self):
+        """测试环境分析把场景中的预设事件列入导演提示词，模型未给出决策点时使用默认值"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        analyzer = EnvironmentAnalyzer(Config())
+        analyzer.director_evaluator = self.evaluator
+        api = self.evaluator.chat_service._call_deepseek_api
+        api.return_value = '{"environment_analysis": {"updated_scene_description": "夜深了", "decision_points": "无"}}'
+        scene = "# 村庄\n## 剧本预设事件\n1. **狼袭** 狼群夜袭村庄\n- 商队到来\n## 重大事件\n- 初始场景\n"
+
+        result = analyzer.analyze_environment_changes(scene, [{'character_name': '勇者', 'response': '守夜'}],
+                                                      platform='deepseek')
+
+        scene_context = api.call_args[0][0][1]['content']
+        self.assertIn('- 狼群夜袭村庄\n- 商队到来', scene_context)
+        self.assertEqual(result['decision_points'], {'has_decision': False, 'description': '', 'options': []})
+        self.assertEqual(result['status_summary']['next_suggestions'], [])
+
+    def test_environment_analyzer_extraction_cached(self):
+        """测试同一场景内容的两次节奏评估只解析一次，返回的列表互不影响"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        analyzer = EnvironmentAnalyzer(Config())
+        analyzer._extract_preset_events = Mock(return_value=['狼袭'])
+        analyzer._extract_occurred_events = Mock(return_value=[])
+
+        before = analyzer._assess_pacing_before_action('场景', '前进')
+        before['preset_events'].append('被修改')
+        after = analyzer._assess_pacing('场景', [])
+
+        self.assertEqual(after['preset_events'], ['狼袭'])
+        self.assertEqual(analyzer._extract_preset_events.call_count, 1)
+        analyzer._assess_pacing('新场景', [])
+        self.assertEqual(analyzer._extract_preset_events.call_count, 2)
+
+    def test_environment_analyzer_fast_path(self):
+        """测试开启快速路径后，无需触发事件且没有移动/观察行动的回合不调用LLM"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        config = Config()
+        config.ENVIRONMENT_ANALYSIS_FAST_PATH = True
+        analyzer = EnvironmentAnalyzer(config)
+        analyzer.director_evaluator = self.evaluator
+        api = self.evaluator.chat_service._call_deepseek_api
+        api.return_value = '{"environment_analysis": {"updated_scene_description": "雾散了"}}'
+        scene = "## 重大事件\n- 狼袭\n- 桥塌了\n- 商队到来\n##"
+
+        quiet = analyzer.analyze_environment_changes(scene, [{'response': '我同意'}], platform='deepseek')
+        self.assertEqual(quiet['major_events'], [])
+        api.assert_not_called()
+
+        analyzer.analyze_environment_changes(scene, [{'response': '我们继续前进'}], platform='deepseek')
+        self.assertEqual(api.call_count, 1)
+
+    def test_environment_analyzer_batch(self):
+        """测试批量环境分析合并为一次导演调用，没有响应的回合不参与，结果按输入顺序返回"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        analyzer = EnvironmentAnalyzer(Config())
+        analyzer.director_evaluator = self.evaluator
+        api = self.evaluator.chat_service._call_deepseek_api
+        api.return_value = json.dumps({"turns": [
+            {"turn": 1, "environment_analysis": {"updated_scene_description": "桥塌了"}},
+            {"turn": 0, "environment_analysis": {"updated_scene_description": "雾散了"}},
+        ]}, ensure_ascii=False)
+
+        results = analyzer.analyze_environment_changes_batch(
+            [('场景A', [{'response': '走'}]), ('场景B', []), ('场景C', [{'response': '跑'}])], platform='deepseek'
+        )
+
+        self.assertEqual([r['scene_changes']['surface'].get('current_narrative') for r in results],
+                         ['雾散了', None, '桥塌了'])
+        self.assertEqual(api.call_count, 1)
+
+    def test_environment_analyzer_pacing_keywords(self):
+        """测试按移动/观察关键词判断节奏：移动中未发现异常时触发事件"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        analyzer = EnvironmentAnalyzer(Config())
+
+        self.assertIn('移动中', analyzer._assess_pacing_before_action('场景', '去村口')['trigger_reason'])
+        self.assertIn('未遇到任何事件',
+                      analyzer._assess_pacing('场景', [{'response': '我们继续前进'}])['trigger_reason'])
+        self.assertNotIn('未遇到任何事件',
+                         analyzer._assess_pacing('场景', [{'response': '前进时听到狼嚎'}])['trigger_reason'])
+
+    def test_director_messages_stable_prefix(self):
+        """测试固定指令和场景级上下文在不同回合间保持不变，只有最后的用户消息变化"""
+        context = {
+            'current_scene': 'village',
+            'scene_script': {'surface': {'description': '宁静的村庄'}},
+            'potential_events': [{'id': 'e1', 'name': '狼袭', 'type': 'random'}],
+            'player_instruction': '前进',
+        }
+        first = self.evaluator._build_director_messages(context)
+        second = self.evaluator._build_director_messages({**context, 'player_instruction': '休息',
+                                                          'agent_responses': [{'character_name': '勇者',
+                                                                               'response': '好'}]})
+
+        self.assertEqual([m['role'] for m in first], ['system', 'system', 'user'])
+        self.assertEqual(first[:2], second[:2])
+        self.assertIn('狼袭', first[1]['content'])
+        self.assertIn('宁静的村庄', first[1]['content'])
+        self.assertIn('休息', second[2]['content'])
+        self.assertNotEqual(first[2], second[2])
+
+    def test_static_fragments_cached(self):
+        """测试事件列表按内容缓存渲染结果，本场景事件的触发状态变化时才重新渲染"""
+        _render_events.cache_clear()
+        context = {
+            'current_scene': 'village',
+            'potential_events': [{'id': 'e1', 'name': '狼袭', 'type': 'core'}],
+            'triggered_events': [],
+        }
+        first = self.evaluator._build_context_sections(context)[0]
+        self.evaluator._build_context_sections({**context, 'player_instruction': '休息'})
+        self.assertEqual(_render_events.cache_info().hits, 1)
+        self.assertIn('狼袭 (ID: e1) [未触发] [核心事件]', first)
+
+        self.evaluator._build_context_sections({**context, 'triggered_events': ['other_scene_event']})
+        self.assertEqual(_render_events.cache_info().hits, 2)
+
+        triggered = self.evaluator._build_context_sections({**context, 'triggered_events': ['e1']})[0]
+        self.assertIn('狼袭 (ID: e1) [已触发]', triggered)
+        self.assertEqual(_render_events.cache_info().misses, 2)
+
+    def test_agent_responses_text(self):
+        """测试导演上下文中的Agent响应（协调器摘要格式和原始格式）都带上内心活动"""
+        turn_context = self.evaluator._build_context_sections({'agent_responses': [
+            {'character_id': 'c1', 'character_name': '勇者', 'response': '前进！', 'inner_monologue': '有点害怕'},
+            {'character_name': '法师', 'response': {'dialogue': '小心', 'action_intent': '施放护盾'},
+             'hidden': {'inner_monologue': '感到魔力波动'}},
+        ]})[1]
+
+        self.assertIn('重要角色1: 勇者 (ID: c1)\n  响应: 前进！\n  内心活动: 有点害怕', turn_context)
+        self.assertIn('  响应: 小心 施放护盾\n  内心活动: 感到魔力波动', turn_context)
+
+    def test_event_previews_truncated_only_when_long(self):
+        """测试事件预览只有被截断时才加省略号"""
+        events = [{'id': 'e2', 'name': '商队', 'description_template': '短模板',
+                   'trigger_conditions': {'behavior_condition': '长' * 60}}]
+        events_text = self.evaluator._build_context_sections({'potential_events': events})[0]
+
+        self.assertIn('描述预览: 短模板\n', events_text)
+        self.assertIn(f"行为: {'长' * 50}...", events_text)
+
+    def test_legacy_event_type_field(self):
+        """测试旧格式事件（event_type字段）同样区分核心事件和随机事件"""
+        events = [{'id': 'e3', 'name': '古老仪式', 'event_type': 'core'}, {'id': 'e4', 'name': '野猪'}]
+        events_text = self.evaluator._build_context_sections({'potential_events': events})[0]
+
+        self.assertIn('古老仪式 (ID: e3) [未触发] [核心事件]', events_text)
+        self.assertIn('野猪 (ID: e4) [未触发] [随机事件]', events_text)
+
+    def test_character_states_projected_and_cached(self):
+        """测试角色状态只保留导演需要的字段并紧凑输出，状态未变化时复用渲染结果"""
+        _render_character_states.cache_clear()
+        self.evaluator.config.DIRECTOR_CHARACTER_FIELDS = ['vitals', 'state']
+        states = {'hero': {'vitals': {'current_hp': 10}, 'background': '很长的背景故事', 'state': '警觉'}}
+        turn_context = self.evaluator._build_context_sections({'character_states': states})[1]
+        self.evaluator._build_context_sections({'character_states': {'hero': dict(states['hero'])}})
+
+        self.assertIn('{"hero":{"vitals":{"current_hp":10},"state":"警觉"}}', turn_context)
+        self.assertNotIn('很长的背景故事', turn_context)
+        self.assertEqual(_render_character_states.cache_info().hits, 1)
+
+        self.evaluator.config.DIRECTOR_CHARACTER_FIELDS = []
+        turn_context = self.evaluator._build_context_sections({'character_states': states})[1]
+        self.assertIn('很长的背景故事', turn_context)
+
+    def test_evaluate_as_director_batch(self):
+        """测试多个回合合并为一次调用，按回合编号放回，缺失的回合单独评估"""
+        self.evaluator.config.DIRECTOR_BATCH_SIZE = 4
+        calls = []
+
+        def fake_call(messages, operation=None, context=None, response_format=None):
+            calls.append(context)
+            if context.get('batch_size'):
+                return json.dumps({"turns": [
+                    {"turn": 2, "director_decision": {"trigger_event": "e3"}},
+                    {"turn": 0, "director_decision": {"trigger_event": "e1", "appear_monster": "哥布林"}},
+                ]})
+            return json.dumps({"director_decision": {"trigger_event": "single"}})
+        self.evaluator.chat_service._call_deepseek_api.side_effect = fake_call
+
+        contexts = [{'current_scene': f's{i}', 'player_instruction': str(i)} for i in range(3)]
+        results = self.evaluator.evaluate_as_director_batch(contexts + [{'current_scene': 'idle'}],
+                                                            platform='deepseek')
+
+        self.assertEqual([r['director_decision']['trigger_event'] for r in results], ['e1', 'single', 'e3', None])
+        self.assertEqual(results[0]['director_decision']['appear_monster'], ['哥布林'])
+        self.assertIn('agent_execution_results', results[2]['environment_analysis'])
+        self.assertEqual(len(calls), 2)
+        batch_prompt = self.evaluator.chat_service._call_deepseek_api.call_args_list[0][0][0][-1]['content']
+        self.assertIn('## Turn 2', batch_prompt)
+
+    def test_evaluate_concurrently(self):
+        """测试多个场景并发评估，结果按输入顺序返回，并发请求数不超过配置上限"""
+        self.evaluator.config.DIRECTOR_MAX_CONCURRENCY = 2
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def fake_call(messages, operation=None, context=None, response_format=None):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+            return json.dumps({"director_decision": {"trigger_event": context['theme']}})
+        self.evaluator.chat_service._call_deepseek_api.side_effect = fake_call
+
+        contexts = [{'current_scene': f's{i}', 'player_instruction': '前进'} for i in range(5)]
+        results = self.evaluator.evaluate_concurrently(contexts, platform='deepseek')
+
+        self.assertEqual([r['director_decision']['trigger_event'] for r in results],
+                         [f's{i}' for i in range(5)])
+        self.assertLessEqual(state['peak'], 2)
+
+    def test_environment_analysis_async(self):
+        """测试环境分析的异步版本在线程中执行，多个分析可以并发进行"""
+        from services.environment_analyzer import EnvironmentAnalyzer
+        analyzer = EnvironmentAnalyzer(Config())
+        analyzer.director_evaluator = self.evaluator
+        self.evaluator.config.DIRECTOR_MAX_CONCURRENCY = 2
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def fake_call(messages, operation=None, context=None, response_format=None):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+            return '{"environment_analysis": {"updated_scene_description": "雾散了"}}'
+        self.evaluator.chat_service._call_deepseek_api.side_effect = fake_call
+
+        async def run():
+            return await asyncio.gather(*(
+                analyzer.analyze_environment_changes_async(f'场景{i}', [{'response': '走'}], platform='deepseek')
+                for i in range(3)
+            ))
+
+        results = asyncio.run(run())
+        self.assertEqual([r['scene_changes']['surface']['current_narrative'] for r in results], ['雾散了'] * 3)
+        self.assertLessEqual(state['peak'], 2)
+
+    def test_long_scene_and_responses_clipped(self):
+        """测试过长的场景内容和Agent响应按配置截断，保留开头和最近的结尾"""
+        self.evaluator.config.DIRECTOR_MAX_SCENE_CHARS = 100
+        self.evaluator.config.DIRECTOR_MAX_RESPONSE_CHARS = 50
+        scene = '开头' + '中' * 500 + '最新叙述'
+        scene_context, turn_context = self.evaluator._build_context_sections({
+            'scene_content': scene,
+            'agent_responses': [{'character_name': '勇者', 'response': '我' * 200 + '结尾'}],
+        })
+
+        self.assertIn('开头', scene_context)
+        self.assertIn('最新叙述', scene_context)
+        self.assertNotIn('中' * 100, scene_context)
+        self.assertIn('结尾', turn_context)
+        self.assertNotIn('我' * 50, turn_context)
+        self.assertEqual(len(_clip_middle(scene, 100)), 100)
+        self.assertEqual(_clip_middle(scene, 0), scene)
+
+    def test_extract_json_block(self):
+        """测试提取JSON：去掉代码块和说明文字，字符串中的括号不影响匹配"""
+        payload = '{"a": {"b": "含有}和{的文本"}, "c": "\\"}"}'
+        for text in ('```json\n' + payload + '\n```',
+                     '结果如下：```JSON\n' + payload + '\n```',
+                     '说明文字 ' + payload + ' 其他说明 {"d": 1}',
+                     '```\n' + payload):
+            self.assertEqual(json.loads(json_utils.extract_json_block(text)),
+                             {"a": {"b": "含有}和{的文本"}, "c": '"}'})
+            self.assertEqual(json_utils.parse_json_lenient(text), {"a": {"b": "含有}和{的文本"}, "c": '"}'})
+        self.assertEqual(json_utils.extract_json_block('没有JSON'), '没有JSON')
+        self.assertIsNone(json_utils.parse_json_lenient('没有JSON'))
+        self.assertEqual(json_utils.parse_json_lenient('```json\n{"a": "用```包裹"}\n```'), {"a": "用```包裹"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 """
 EnvironmentManager 单元测试
 """
+import asyncio
+import shutil
+import tempfile
 import unittest
-from unittest.mock import patch, mock_open
+from unittest.mock import Mock, patch, mock_open
 import os
 from services.environment_manager import EnvironmentManager
 from config import Config
@@ -50,6 +53,59 @@ class TestEnvironmentManager(unittest.TestCase):
         
         self.assertIsNone(scene)
     
+    def test_load_scene_async(self):
+        """测试异步加载场景在线程中调用同步加载，参数原样传递"""
+        self.env_manager.load_scene = Mock(return_value='场景')
+        
+        async def run():
+            return await asyncio.gather(self.env_manager.load_scene_async('adventure_party', '1_step'),
+                                        asyncio.sleep(0, result='其他任务'))
+        
+        self.assertEqual(asyncio.run(run()), ['场景', '其他任务'])
+        self.env_manager.load_scene.assert_called_once_with('adventure_party', '1_step')
+    
+    def test_scene_state_reads_cached(self):
+        """测试存档文件未变化时不重复读取，写入后（即使大小相同）读到新内容"""
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        manager = self.env_manager.scene_state_manager
+        manager.base_dir = base_dir
+        manager.set_current_scene('adventure_party', '1_step', 'scene_1')
+        
+        with patch('builtins.open', wraps=open) as mock_file:
+            self.assertEqual(manager.get_current_scene_id('adventure_party', '1_step'), 'scene_1')
+            self.assertEqual(manager.get_current_scene_id('adventure_party', '1_step'), 'scene_1')
+        self.assertEqual(mock_file.call_count, 1)
+        
+        manager.set_current_scene('adventure_party', '1_step', 'scene_2')
+        self.assertEqual(manager.get_current_scene_id('adventure_party', '1_step'), 'scene_2')
+        manager.update_scene_state('adventure_party', '1_step', {'weather': 'rain'})
+        state = manager.get_scene_state('adventure_party', '1_step')
+        state['state_changes']['door'] = 'open'
+        self.assertEqual(manager.get_scene_state('adventure_party', '1_step')['state_changes'], {'weather': 'rain'})
+    
+    def test_room_script_cached_until_modified(self):
+        """测试房间剧本文件未修改时不重复解析，文件修改后重新加载"""
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        script_manager = self.env_manager.script_manager
+        script_manager.base_dir = base_dir
+        rooms_dir = os.path.join(base_dir, self.config.CHARACTER_CONFIG_DIR, 'adventure_party',
+                                 'scenarios', 'scene_001', 'rooms')
+        os.makedirs(rooms_dir)
+        room_path = os.path.join(rooms_dir, 'scene_001_002_大厅.json')
+        with open(room_path, 'w', encoding='utf-8') as f:
+            f.write('{"room_id": "scene_001_002", "name": "大厅"}')
+    
+        with patch('builtins.open', wraps=open) as mock_file:
+            self.assertEqual(script_manager.load_room_script('adventure_party', 'scene_001_002')['name'], '大厅')
+            self.assertEqual(script_manager.load_room_script('adventure_party', 'scene_001_002')['name'], '大厅')
+        self.assertEqual(mock_file.call_count, 1)
+    
+        with open(room_path, 'w', encoding='utf-8') as f:
+            f.write('{"room_id": "scene_001_002", "name": "废弃大厅"}')
+        self.assertEqual(script_manager.load_room_script('adventure_party', 'scene_001_002')['name'], '废弃大厅')
+    
     def test_apply_responses_to_environment(self):
         """测试应用响应到环境"""
         scene_content = "测试场景"